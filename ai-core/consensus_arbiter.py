@@ -10,7 +10,7 @@ import os
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from datetime import datetime
 
-import mysql.connector
+from db_pool import get_connection
 
 # ====== DB 設定 ======
 MYSQL_DB = "cockswain"
@@ -26,12 +26,15 @@ MIN_SCORE = 40
 
 
 def get_db():
-    return mysql.connector.connect(
+    """從共用連線池借 DB 連線；close() 即還回 pool"""
+    return get_connection(
+        "consensus_arbiter",
         user=MYSQL_USER,
         password=MYSQL_PASSWORD,
         database=MYSQL_DB,
         unix_socket=MYSQL_SOCKET,
         ssl_disabled=True,
+        autocommit=False,
     )
 
 
@@ -3,11 +3,13 @@ import os
 import time
 import logging
 import json
-from typing import Any, Dict, Optional
+from typing import Any, Dict
 
 import mysql.connector
 import requests
 
+from db_pool import get_connection
+
 # =========================
 # 基本設定
 # =========================
@@ -44,30 +46,34 @@ POLL_INTERVAL = int(os.getenv("POLL_INTERVAL", "3"))
 
 def get_db_conn():
     """
-    建立一個禁用 SSL 的 MySQL 連線。
+    從共用連線池借一條禁用 SSL 的 MySQL 連線（close() 即還回 pool）。
     這是這版最重要的改動：ssl_disabled=True
     """
     # 主連線：走 host/port
     try:
-        conn = mysql.connector.connect(
+        conn = get_connection(
+            "core_bridge",
             host=MYSQL_HOST,
             user=MYSQL_USER,
             password=MYSQL_PASSWORD,
             database=MYSQL_DB,
             port=MYSQL_PORT,
             ssl_disabled=True,  # ← 關鍵：不要用 python 那顆還在 dummy 的 ssl
+            autocommit=False,
         )
         return conn
     except mysql.connector.Error as e:
         logger.error(f"db connect error (host/port): {e}")
         # 如果有 socket 再試一次（有些人習慣本機走 socket）
         try:
-            conn = mysql.connector.connect(
+            conn = get_connection(
+                "core_bridge_socket",
                 unix_socket=MYSQL_SOCKET,
                 user=MYSQL_USER,
                 password=MYSQL_PASSWORD,
                 database=MYSQL_DB,
                 ssl_disabled=True,  # ← 這裡也要關
+                autocommit=False,
             )
             return conn
         except mysql.connector.Error as e2:
@@ -135,44 +141,41 @@ def mark_task_done(conn, task_id: int):
 
 def main_loop():
     logger.info("core_bridge started.")
-    conn: Optional[mysql.connector.connection.MySQLConnection] = None
 
     while True:
-        # 確保手上有 DB 連線
-        if conn is None or not conn.is_connected():
-            try:
-                conn = get_db_conn()
-            except Exception:
-                # 上面已經 log 過了
-                time.sleep(POLL_INTERVAL)
-                continue
-
-        # 拉任務
-        tasks = fetch_pending_tasks(conn)
-        if tasks:
-            logger.info(f"fetched {len(tasks)} pending tasks")
-        else:
-            # 沒事就睡一下
+        # 每一輪從 pool 借一條連線，pool 會 pre-ping，斷線自動換新的
+        try:
+            conn = get_db_conn()
+        except Exception:
+            # 上面已經 log 過了
             time.sleep(POLL_INTERVAL)
             continue
 
-        # 一個一個處理
-        for t in tasks:
-            task_id = t.get("id")
-            payload = t.get("payload")
-            # payload 若是字串就轉 dict
-            if isinstance(payload, str):
-                try:
-                    payload = json.loads(payload)
-                except Exception:
-                    # 就用原始的
-                    pass
-
-            ok = call_orchestrator({"id": task_id, "payload": payload})
-            if ok and task_id is not None:
-                mark_task_done(conn, task_id)
-
-        # 不要炸 CPU
+        try:
+            # 拉任務
+            tasks = fetch_pending_tasks(conn)
+            if tasks:
+                logger.info(f"fetched {len(tasks)} pending tasks")
+
+            # 一個一個處理
+            for t in tasks:
+                task_id = t.get("id")
+                payload = t.get("payload")
+                # payload 若是字串就轉 dict
+                if isinstance(payload, str):
+                    try:
+                        payload = json.loads(payload)
+                    except Exception:
+                        # 就用原始的
+                        pass
+
+                ok = call_orchestrator({"id": task_id, "payload": payload})
+                if ok and task_id is not None:
+                    mark_task_done(conn, task_id)
+        finally:
+            conn.close()
+
+        # 沒事就睡一下，有事也別炸 CPU
         time.sleep(POLL_INTERVAL)
 
 
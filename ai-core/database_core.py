@@ -5,14 +5,16 @@ Cockswain Core - Database Helper (強化版 v1)
 - 強制使用 mysql_native_password
 - 強制 ssl_disabled=True，避免 sha256_password requires SSL
 - 提供簡單 debug 訊息，幫助確認實際使用的設定
+- 連線一律從 db_pool 的共用連線池借（pool 名稱 "database_core"）
 """
 
 import os
 from pathlib import Path
 from typing import Dict
 
-import mysql.connector
-from mysql.connector import Error, MySQLConnection
+from mysql.connector import Error
+
+from db_pool import PooledConnection, get_pool
 
 try:
     from dotenv import load_dotenv  # type: ignore
@@ -113,9 +115,9 @@ def _get_db_config() -> dict:
 
 def get_db_connection(
     autocommit: bool = True,
-) -> MySQLConnection:
+) -> PooledConnection:
     """
-    取得一個新的 MySQL 連線。
+    從共用連線池借一條 MySQL 連線（用完 conn.close() 就是還回 pool）。
 
     - 強制 auth_plugin = mysql_native_password
     - 強制 ssl_disabled = True（避免 sha256_password requires SSL）
@@ -123,14 +125,15 @@ def get_db_connection(
     cfg = _get_db_config()
 
     try:
-        conn = mysql.connector.connect(
+        conn = get_pool(
+            "database_core",
             host=cfg["host"],
             database=cfg["database"],
             user=cfg["user"],
             password=cfg["password"],
             auth_plugin="mysql_native_password",
             ssl_disabled=True,
-        )
+        ).acquire()
         conn.autocommit = autocommit
         return conn
     except Error as e:
@@ -0,0 +1,344 @@
+"""
+Cockswain Core - SQL Query Instrumentation v1
+
+db_pool 借出的連線，其 cursor() 會包成 InstrumentedCursor：
+- 以「語句指紋」（fingerprint：字面值 / 參數換成 ?、IN (...) 摺疊、空白正規化）為單位
+  記錄延遲 histogram 與 row 數（有安裝 prometheus_client 時匯出）；metrics 的 label 只用
+  指紋的短 hash，語句文字不進 metrics（series 數才不會跟著 SQL 花樣一直長）
+- 延遲 = execute + fetch 花的時間（不含呼叫端在兩次 fetch 之間自己做事的時間）；
+  SELECT 要等下一次 execute / close 時才記，沒 close 的 cursor 不會留下樣本
+- 每個指紋第一次出現時在 slow log 記一筆 {"event": "fingerprint"}，hash → 語句文字的對照在那裡查
+- 超過 DB_SLOW_QUERY_MS 的語句寫進 slow log（JSONL），參數只留型別與長度，不落實際值
+- DB_SLOW_QUERY_EXPLAIN=1 時，對慢語句自動跑 EXPLAIN，計畫存到 DB_EXPLAIN_DIR/<fingerprint>.json
+  （EXPLAIN 延到連線還回 pool 前才跑，避免撞到 cursor 還沒讀完的結果；
+   同一個指紋 DB_EXPLAIN_INTERVAL 秒內只 EXPLAIN 一次）
+
+這樣就能抓出 DATE(created_at) = ...、LIKE '%q%' 這類全表掃描的查詢。
+DB_INSTRUMENT=0 可整個關掉，cursor() 直接回傳原生 cursor。
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import datetime
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+try:
+    from prometheus_client import Counter, Gauge, Histogram  # type: ignore
+except ImportError:  # pragma: no cover
+    Counter = Gauge = Histogram = None  # type: ignore
+
+
+ENABLED = os.getenv("DB_INSTRUMENT", "1") != "0"
+SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "500"))
+SLOW_QUERY_LOG = os.getenv("DB_SLOW_QUERY_LOG", "/srv/cockswain-core/logs/db_slow_queries.jsonl")
+EXPLAIN_ENABLED = os.getenv("DB_SLOW_QUERY_EXPLAIN", "0") == "1"
+EXPLAIN_DIR = os.getenv("DB_EXPLAIN_DIR", "/srv/cockswain-core/logs/db_explain")
+EXPLAIN_INTERVAL = float(os.getenv("DB_EXPLAIN_INTERVAL", "3600"))
+
+# MySQL 只接受這幾種語句的 EXPLAIN
+_EXPLAINABLE = ("select", "update", "delete", "insert", "replace")
+
+logger = logging.getLogger("cockswain.db")
+
+if Histogram is not None:
+    QUERY_LATENCY = Histogram(
+        "db_query_duration_seconds",
+        "SQL statement latency by fingerprint",
+        ["fingerprint", "op"],
+        buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    )
+    QUERY_ROWS = Counter("db_query_rows_total", "Rows returned or affected by fingerprint", ["fingerprint", "op"])
+    QUERY_ERRORS = Counter("db_query_errors_total", "Failed SQL statements by fingerprint", ["fingerprint", "op"])
+    SLOW_QUERIES = Counter("db_slow_queries_total", "Statements slower than DB_SLOW_QUERY_MS", ["fingerprint", "op"])
+    FINGERPRINTS_SEEN = Gauge("db_query_fingerprints", "Distinct statement fingerprints seen by this process")
+else:  # pragma: no cover
+    QUERY_LATENCY = QUERY_ROWS = QUERY_ERRORS = SLOW_QUERIES = FINGERPRINTS_SEEN = None
+
+
+# ============================================================
+# 指紋
+# ============================================================
+
+_COMMENT_RE = re.compile(r"/\*.*?\*/|--[^\n]*|#[^\n]*", re.S)
+_STRING_RE = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBER_RE = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])")
+_PARAM_RE = re.compile(r"%\(\w+\)s|%s|\?")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_VALUES_LIST_RE = re.compile(r"(values\s*\(\?\+?\))(?:\s*,\s*\(\?\+?\))+")
+_WS_RE = re.compile(r"\s+")
+
+_fingerprints: Dict[str, str] = {}
+_fp_lock = threading.Lock()
+
+
+def normalize_sql(sql: str) -> str:
+    # 先換掉字串，字串裡的 # / -- 才不會被當成註解
+    s = _STRING_RE.sub("?", sql)
+    s = _COMMENT_RE.sub(" ", s)
+    s = _PARAM_RE.sub("?", s)
+    s = _NUMBER_RE.sub("?", s)
+    s = _WS_RE.sub(" ", s).strip().rstrip(";").strip().lower()
+    s = _IN_LIST_RE.sub("(?+)", s)
+    s = _VALUES_LIST_RE.sub(r"\1", s)
+    return s
+
+
+def fingerprint(sql: str) -> Tuple[str, str, str]:
+    """
+    回傳 (fingerprint_id, normalized_sql, op)。
+    fingerprint_id 是 normalized_sql 的短 hash，拿來當 metrics label；第一次看到時把對照寫進 slow log。
+    """
+    norm = normalize_sql(sql)
+    fp_id = hashlib.sha1(norm.encode("utf-8")).hexdigest()[:12]
+    op = norm.split(" ", 1)[0] if norm else "unknown"
+    if fp_id not in _fingerprints:
+        with _fp_lock:
+            first = fp_id not in _fingerprints
+            if first:
+                _fingerprints[fp_id] = norm
+                if FINGERPRINTS_SEEN is not None:
+                    FINGERPRINTS_SEEN.set(len(_fingerprints))
+        if first:
+            _append_jsonl(SLOW_QUERY_LOG, {
+                "ts": datetime.datetime.utcnow().isoformat() + "Z",
+                "event": "fingerprint",
+                "fingerprint": fp_id,
+                "statement": norm,
+            })
+    return fp_id, norm, op
+
+
+def redact_params(params: Any) -> Any:
+    """
+    參數只留型別與長度，例如 "<str:12>"、"<int>"。
+    """
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {k: _redact_value(v) for k, v in params.items()}
+    if isinstance(params, (list, tuple)):
+        return [redact_params(p) if isinstance(p, (list, tuple, dict)) else _redact_value(p) for p in params]
+    return _redact_value(params)
+
+
+def _redact_value(v: Any) -> str:
+    if v is None:
+        return "<null>"
+    if isinstance(v, (str, bytes, bytearray)):
+        return f"<{type(v).__name__}:{len(v)}>"
+    return f"<{type(v).__name__}>"
+
+
+# ============================================================
+# slow log / EXPLAIN
+# ============================================================
+
+_log_lock = threading.Lock()
+_explain_lock = threading.Lock()
+_explained_at: Dict[str, float] = {}
+
+
+def _append_jsonl(path: str, record: Dict[str, Any]) -> None:
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with _log_lock:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+    except Exception as e:
+        logger.warning("failed to write slow query log %s: %r", path, e)
+
+
+def record_slow_query(fp_id: str, norm: str, op: str, elapsed: float, params: Any, rows: int) -> None:
+    if SLOW_QUERIES is not None:
+        SLOW_QUERIES.labels(fingerprint=fp_id, op=op).inc()
+    record = {
+        "ts": datetime.datetime.utcnow().isoformat() + "Z",
+        "event": "slow",
+        "fingerprint": fp_id,
+        "statement": norm,
+        "duration_ms": round(elapsed * 1000, 3),
+        "rows": rows,
+        "params": redact_params(params),
+    }
+    logger.warning("slow query %.1fms [%s] %s", elapsed * 1000, fp_id, norm[:200])
+    _append_jsonl(SLOW_QUERY_LOG, record)
+
+
+def should_explain(fp_id: str, op: str) -> bool:
+    if not EXPLAIN_ENABLED or op not in _EXPLAINABLE:
+        return False
+    now = time.monotonic()
+    # 多個 thread 同時撞到同一條慢查詢時只讓一個去 EXPLAIN
+    with _explain_lock:
+        last = _explained_at.get(fp_id)
+        if last is not None and now - last < EXPLAIN_INTERVAL:
+            return False
+        _explained_at[fp_id] = now
+    return True
+
+
+def explain(conn: Any, sql: str, params: Any = None) -> List[Dict[str, Any]]:
+    """
+    在 conn 上跑 EXPLAIN（傳統表格格式），回傳 list of dict。
+    """
+    cur = conn.cursor(dictionary=True, buffered=True)
+    try:
+        cur.execute("EXPLAIN " + sql, params)
+        return list(cur.fetchall())
+    finally:
+        cur.close()
+
+
+def save_explain(conn: Any, fp_id: str, norm: str, sql: str, params: Any, elapsed: float) -> None:
+    try:
+        plan = explain(conn, sql, params)
+    except Exception as e:
+        logger.warning("EXPLAIN failed for [%s]: %r", fp_id, e)
+        return
+    record = {
+        "ts": datetime.datetime.utcnow().isoformat() + "Z",
+        "fingerprint": fp_id,
+        "statement": norm,
+        "duration_ms": round(elapsed * 1000, 3),
+        "plan": plan,
+        "full_scan": any(str(row.get("type") or "").upper() == "ALL" for row in plan),
+    }
+    try:
+        os.makedirs(EXPLAIN_DIR, exist_ok=True)
+        path = os.path.join(EXPLAIN_DIR, f"{fp_id}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False, indent=2, default=str)
+    except Exception as e:
+        logger.warning("failed to save EXPLAIN for [%s]: %r", fp_id, e)
+
+
+# ============================================================
+# InstrumentedCursor
+# ============================================================
+
+class InstrumentedCursor:
+    """
+    包住 mysql.connector 的 cursor；沒包到的屬性（rowcount / lastrowid / description ...）
+    直接轉給底層 cursor。
+    owner 是 db_pool.PooledConnection，慢語句的 EXPLAIN 會掛在它身上，還回 pool 前才跑。
+    """
+
+    def __init__(self, cursor: Any, owner: Any = None):
+        self._cursor = cursor
+        self._owner = owner
+        self._current: Optional[Tuple[str, str, str, float, Any, str]] = None
+        self._fetched = 0
+        self._fetch_seconds = 0.0
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        it = iter(self._cursor)
+        while True:
+            t0 = time.perf_counter()
+            try:
+                row = next(it)
+            except StopIteration:
+                self._fetch_seconds += time.perf_counter() - t0
+                return
+            self._fetch_seconds += time.perf_counter() - t0
+            self._fetched += 1
+            yield row
+
+    def __enter__(self) -> "InstrumentedCursor":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    # ---- execute ----
+
+    def _run(self, method: str, sql: str, params: Any, *args: Any, **kwargs: Any) -> Any:
+        self._finish()
+        fp_id, norm, op = fingerprint(sql)
+        t0 = time.perf_counter()
+        try:
+            result = getattr(self._cursor, method)(sql, params, *args, **kwargs)
+        except Exception:
+            if QUERY_ERRORS is not None:
+                QUERY_ERRORS.labels(fingerprint=fp_id, op=op).inc()
+            raise
+        elapsed = time.perf_counter() - t0
+
+        # SELECT 的 row 數與 fetch 時間要等讀完才知道，先掛著，下一次 execute / close 時結算
+        self._current = (fp_id, norm, op, elapsed, params, sql)
+        self._fetched = 0
+        self._fetch_seconds = 0.0
+        if op != "select":
+            self._finish()
+        return result
+
+    def execute(self, operation: str, params: Any = None, *args: Any, **kwargs: Any) -> Any:
+        return self._run("execute", operation, params, *args, **kwargs)
+
+    def executemany(self, operation: str, seq_params: Sequence[Any], *args: Any, **kwargs: Any) -> Any:
+        return self._run("executemany", operation, seq_params, *args, **kwargs)
+
+    # ---- fetch ----
+
+    def fetchone(self) -> Any:
+        t0 = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._fetch_seconds += time.perf_counter() - t0
+        if row is not None:
+            self._fetched += 1
+        return row
+
+    def fetchmany(self, *args: Any, **kwargs: Any) -> Any:
+        t0 = time.perf_counter()
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        self._fetch_seconds += time.perf_counter() - t0
+        self._fetched += len(rows)
+        return rows
+
+    def fetchall(self) -> Any:
+        t0 = time.perf_counter()
+        rows = self._cursor.fetchall()
+        self._fetch_seconds += time.perf_counter() - t0
+        self._fetched += len(rows)
+        return rows
+
+    def close(self) -> Any:
+        self._finish()
+        return self._cursor.close()
+
+    # ---- 結算 ----
+
+    def _finish(self) -> None:
+        if self._current is None:
+            return
+        fp_id, norm, op, elapsed, params, sql = self._current
+        self._current = None
+        elapsed += self._fetch_seconds
+        self._fetch_seconds = 0.0
+        if QUERY_LATENCY is not None:
+            QUERY_LATENCY.labels(fingerprint=fp_id, op=op).observe(elapsed)
+
+        if op == "select":
+            rows = self._fetched
+        else:
+            try:
+                rows = max(int(self._cursor.rowcount or 0), 0)
+            except Exception:
+                rows = 0
+        if QUERY_ROWS is not None and rows:
+            QUERY_ROWS.labels(fingerprint=fp_id, op=op).inc(rows)
+
+        if elapsed * 1000 < SLOW_QUERY_MS:
+            return
+        is_many = isinstance(params, list) and params and isinstance(params[0], (list, tuple, dict))
+        record_slow_query(fp_id, norm, op, elapsed, params[:3] if is_many else params, rows)
+        if self._owner is not None and not is_many and should_explain(fp_id, op):
+            self._owner.defer_explain(fp_id, norm, sql, params, elapsed)
@@ -0,0 +1,383 @@
+"""
+Cockswain Core - Shared MySQL Connection Pool v1
+
+所有 ai-core 服務共用的連線池：
+- 每個「具名 pool」固定上限（DB_POOL_SIZE），借不到就排隊等（DB_POOL_TIMEOUT）
+- 借出前 pre-ping：閒置超過 DB_POOL_PING_INTERVAL 秒的連線先 ping 一下，死掉就換一條
+- 連線用超過 DB_POOL_RECYCLE 秒就汰換，避免被 MySQL wait_timeout 砍掉
+- connect timeout（DB_CONNECT_TIMEOUT）與 read/write timeout（DB_READ_TIMEOUT，
+  需要 mysql-connector-python >= 9.1，0 表示不設定）
+- thread-safe（threading.Condition）；async 呼叫端用 acquire_async()，不會卡住 event loop
+- 借出的是 PooledConnection，呼叫端照舊 conn.close()，實際上是還回 pool
+- 有安裝 prometheus_client 時匯出等待時間 / 使用中 / 閒置連線數等 metrics；
+  設定 DB_POOL_METRICS_PORT 時，非 HTTP 的 worker 也會自己開一個 /metrics
+- conn.cursor() 回傳 db_instrument.InstrumentedCursor：每個語句指紋的延遲 / row 數、
+  slow query log 與慢語句自動 EXPLAIN（詳見 db_instrument.py）
+
+用法：
+    from db_pool import get_connection
+
+    conn = get_connection("orchestrator", user=..., password=..., unix_socket=...)
+    try:
+        cur = conn.cursor()
+        ...
+    finally:
+        conn.close()   # 還回 pool
+
+同一個 name 第一次呼叫時用傳入的參數建 pool，之後的呼叫直接沿用。
+"""
+
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import mysql.connector
+from mysql.connector import Error
+
+import db_instrument
+
+try:
+    from prometheus_client import Counter, Gauge, Histogram, start_http_server  # type: ignore
+except ImportError:  # pragma: no cover
+    Counter = Gauge = Histogram = start_http_server = None  # type: ignore
+
+
+# ---- 預設參數（可被環境變數覆寫）----
+
+DEFAULT_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DEFAULT_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DEFAULT_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "5"))
+DEFAULT_READ_TIMEOUT = int(os.getenv("DB_READ_TIMEOUT", "0"))
+DEFAULT_PING_INTERVAL = float(os.getenv("DB_POOL_PING_INTERVAL", "30"))
+DEFAULT_RECYCLE = float(os.getenv("DB_POOL_RECYCLE", "3600"))
+METRICS_PORT = int(os.getenv("DB_POOL_METRICS_PORT", "0"))
+
+
+class PoolTimeout(Error):
+    """等超過 timeout 仍借不到連線。"""
+
+
+# ---- metrics（沒有 prometheus_client 就全部略過）----
+
+if Histogram is not None:
+    POOL_WAIT = Histogram(
+        "db_pool_wait_seconds",
+        "Time spent waiting to check out a pooled MySQL connection",
+        ["pool"],
+        buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10),
+    )
+    POOL_IN_USE = Gauge("db_pool_connections_in_use", "Checked-out pooled MySQL connections", ["pool"])
+    POOL_IDLE = Gauge("db_pool_connections_idle", "Idle pooled MySQL connections", ["pool"])
+    POOL_SIZE = Gauge("db_pool_size", "Configured max connections of a MySQL pool", ["pool"])
+    POOL_CREATED = Counter("db_pool_connections_created_total", "MySQL connections opened by the pool", ["pool"])
+    POOL_TIMEOUTS = Counter("db_pool_checkout_timeouts_total", "Pool checkouts that timed out", ["pool"])
+    POOL_PING_FAILURES = Counter("db_pool_ping_failures_total", "Pre-ping failures on checkout", ["pool"])
+else:  # pragma: no cover
+    POOL_WAIT = POOL_IN_USE = POOL_IDLE = POOL_SIZE = None
+    POOL_CREATED = POOL_TIMEOUTS = POOL_PING_FAILURES = None
+
+_metrics_server_started = False
+
+
+def _maybe_start_metrics_server() -> None:
+    global _metrics_server_started
+    if _metrics_server_started or not METRICS_PORT or start_http_server is None:
+        return
+    try:
+        start_http_server(METRICS_PORT)
+        _metrics_server_started = True
+    except OSError as e:
+        print(f"[db_pool] failed to start metrics server on :{METRICS_PORT}: {e!r}")
+
+
+# ============================================================
+# PooledConnection：把 close() 換成「還回 pool」
+# ============================================================
+
+class PooledConnection:
+    """
+    包住真正的 MySQL 連線，其餘屬性 / 方法全部轉給底層連線。
+    close() 只會還回 pool，不會真的斷線；重複 close() 無害。
+    """
+
+    _OWN_ATTRS = ("_pool", "_conn", "_pending_explains")
+
+    def __init__(self, pool: "ConnectionPool", conn: Any):
+        self._pool = pool
+        self._conn: Optional[Any] = conn
+        self._pending_explains: List[Tuple[str, str, str, Any, float]] = []
+
+    def __getattr__(self, name: str) -> Any:
+        conn = self.__dict__.get("_conn")
+        if conn is None:
+            raise Error(msg="pooled connection already returned to pool")
+        return getattr(conn, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if name in self._OWN_ATTRS:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._conn, name, value)
+
+    @property
+    def raw_connection(self) -> Any:
+        return self._conn
+
+    def cursor(self, *args: Any, **kwargs: Any) -> Any:
+        if self._conn is None:
+            raise Error(msg="pooled connection already returned to pool")
+        cur = self._conn.cursor(*args, **kwargs)
+        if not db_instrument.ENABLED:
+            return cur
+        return db_instrument.InstrumentedCursor(cur, owner=self)
+
+    def defer_explain(self, fp_id: str, norm: str, sql: str, params: Any, elapsed: float) -> None:
+        """
+        慢語句的 EXPLAIN 先排著，等 close() 還回 pool 前再跑。
+        """
+        self._pending_explains.append((fp_id, norm, sql, params, elapsed))
+
+    def _run_pending_explains(self) -> None:
+        pending, self._pending_explains = self._pending_explains, []
+        for fp_id, norm, sql, params, elapsed in pending:
+            db_instrument.save_explain(self._conn, fp_id, norm, sql, params, elapsed)
+
+    def close(self) -> None:
+        if self._conn is not None and self._pending_explains:
+            self._run_pending_explains()
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.release(conn)
+
+    def __enter__(self) -> "PooledConnection":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        # 呼叫端忘了 close()：至少別讓 pool 的名額永久消失
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+# ============================================================
+# ConnectionPool
+# ============================================================
+
+class ConnectionPool:
+    def __init__(
+        self,
+        name: str,
+        size: int = DEFAULT_POOL_SIZE,
+        timeout: float = DEFAULT_POOL_TIMEOUT,
+        ping_interval: float = DEFAULT_PING_INTERVAL,
+        recycle: float = DEFAULT_RECYCLE,
+        autocommit: bool = True,
+        **connect_args: Any,
+    ):
+        self.name = name
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self.recycle = recycle
+        self.autocommit = autocommit
+
+        connect_args.setdefault("connection_timeout", DEFAULT_CONNECT_TIMEOUT)
+        if DEFAULT_READ_TIMEOUT > 0:
+            connect_args.setdefault("read_timeout", DEFAULT_READ_TIMEOUT)
+            connect_args.setdefault("write_timeout", DEFAULT_READ_TIMEOUT)
+        self.connect_args = connect_args
+
+        self._cond = threading.Condition()
+        # (conn, created_at, last_used_at)
+        self._idle: Deque[Tuple[Any, float, float]] = deque()
+        self._created_at: Dict[int, float] = {}
+        self._in_use = 0
+        self._total = 0
+
+        if POOL_SIZE is not None:
+            POOL_SIZE.labels(pool=name).set(self.size)
+        _maybe_start_metrics_server()
+
+    # ---- 內部工具 ----
+
+    def _connect(self) -> Any:
+        conn = mysql.connector.connect(**self.connect_args)
+        self._created_at[id(conn)] = time.monotonic()
+        if POOL_CREATED is not None:
+            POOL_CREATED.labels(pool=self.name).inc()
+        return conn
+
+    def _discard(self, conn: Any) -> None:
+        self._created_at.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _update_gauges(self) -> None:
+        if POOL_IN_USE is not None:
+            POOL_IN_USE.labels(pool=self.name).set(self._in_use)
+            POOL_IDLE.labels(pool=self.name).set(len(self._idle))
+
+    def _healthy(self, conn: Any, created_at: float, last_used_at: float) -> bool:
+        now = time.monotonic()
+        if self.recycle and now - created_at > self.recycle:
+            return False
+        if now - last_used_at < self.ping_interval:
+            return True
+        try:
+            conn.ping(reconnect=False, attempts=1, delay=0)
+            return True
+        except Exception:
+            if POOL_PING_FAILURES is not None:
+                POOL_PING_FAILURES.labels(pool=self.name).inc()
+            return False
+
+    # ---- 借 / 還 ----
+
+    def acquire(self, timeout: Optional[float] = None) -> PooledConnection:
+        """
+        借一條連線；pool 滿了就等，超過 timeout 丟 PoolTimeout。
+        """
+        timeout = self.timeout if timeout is None else timeout
+        t0 = time.monotonic()
+        deadline = t0 + timeout
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, created_at, last_used_at = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._total < self.size:
+                    # 先佔名額，真正連線在鎖外做，避免慢連線卡住其他 thread
+                    self._total += 1
+                    self._in_use += 1
+                    conn = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    if POOL_TIMEOUTS is not None:
+                        POOL_TIMEOUTS.labels(pool=self.name).inc()
+                    raise PoolTimeout(msg=f"pool '{self.name}' exhausted (size={self.size}) after {timeout}s")
+                self._cond.wait(remaining)
+            self._update_gauges()
+
+        try:
+            if conn is not None and not self._healthy(conn, created_at, last_used_at):
+                self._discard(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+            conn.autocommit = self.autocommit
+        except Exception:
+            with self._cond:
+                self._total -= 1
+                self._in_use -= 1
+                self._update_gauges()
+                self._cond.notify()
+            raise
+
+        if POOL_WAIT is not None:
+            POOL_WAIT.labels(pool=self.name).observe(time.monotonic() - t0)
+        return PooledConnection(self, conn)
+
+    async def acquire_async(self, timeout: Optional[float] = None) -> PooledConnection:
+        """
+        給 asyncio 呼叫端：排隊 / 建連線都丟到 thread 裡做。
+        """
+        return await asyncio.to_thread(self.acquire, timeout)
+
+    def release(self, conn: Any) -> None:
+        """
+        還連線：沒 commit 的交易一律 rollback，壞掉的連線直接丟掉。
+        """
+        keep = True
+        try:
+            if not conn.is_connected():
+                keep = False
+            elif conn.in_transaction:
+                conn.rollback()
+        except Exception:
+            keep = False
+
+        with self._cond:
+            self._in_use -= 1
+            if keep:
+                created_at = self._created_at.get(id(conn), time.monotonic())
+                self._idle.append((conn, created_at, time.monotonic()))
+            else:
+                self._total -= 1
+            self._update_gauges()
+            self._cond.notify()
+
+        if not keep:
+            self._discard(conn)
+
+    def close_all(self) -> None:
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._total -= len(idle)
+            self._update_gauges()
+        for conn, _, _ in idle:
+            self._discard(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "pool": self.name,
+                "size": self.size,
+                "total": self._total,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+            }
+
+
+# ============================================================
+# 具名 pool registry
+# ============================================================
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(name: str = "default", **connect_args: Any) -> ConnectionPool:
+    """
+    取得（必要時建立）具名 pool。
+    pool 專屬參數：size / timeout / ping_interval / recycle / autocommit，
+    其他參數原封不動交給 mysql.connector.connect()。
+    """
+    pool = _pools.get(name)
+    if pool is not None:
+        return pool
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None:
+            pool = ConnectionPool(name, **connect_args)
+            _pools[name] = pool
+        return pool
+
+
+def get_connection(name: str = "default", **connect_args: Any) -> PooledConnection:
+    return get_pool(name, **connect_args).acquire()
+
+
+async def get_connection_async(name: str = "default", **connect_args: Any) -> PooledConnection:
+    return await get_pool(name, **connect_args).acquire_async()
+
+
+def pool_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: pool.stats() for name, pool in list(_pools.items())}
+
+
+def close_all_pools() -> None:
+    for pool in list(_pools.values()):
+        pool.close_all()
@@ -0,0 +1,115 @@
+"""
+NDJSON 解析 micro-benchmark：舊的「aiter_lines + httpx.Response(text=line).json()」
+vs. hybrid_engine.clients.ndjson.NDJSONDecoder。
+
+用錄下來的 Ollama 串流：
+    curl -sN http://127.0.0.1:11434/api/generate \\
+         -d '{"model":"llama3.1:8b-instruct-q4_K_M","prompt":"寫一篇 500 字短文"}' > stream.ndjson
+    python benchmarks/bench_ndjson.py stream.ndjson
+
+不給檔案時用合成的 Ollama 格式串流（每個 token 一行）。
+chunking 模擬 Ollama 的行為：每個 token 各自 flush 成一個 chunk（--chunk N 改成固定 N bytes）。
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+import httpx
+from httpx._decoders import LineDecoder, TextDecoder
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+from hybrid_engine.clients import ndjson  # noqa: E402
+
+
+def synth_stream(tokens: int) -> bytes:
+    words = ["舵手", " the", " engine", "，", " 混合", " stream", "ing", " 測試", ".", "\n"]
+    lines = []
+    for i in range(tokens):
+        lines.append(json.dumps({
+            "model": "llama3.1:8b-instruct-q4_K_M",
+            "created_at": "2025-11-12T23:13:25.123456789Z",
+            "response": words[i % len(words)],
+            "done": False,
+        }, ensure_ascii=False))
+    lines.append(json.dumps({
+        "model": "llama3.1:8b-instruct-q4_K_M", "created_at": "2025-11-12T23:13:30Z",
+        "response": "", "done": True, "context": list(range(512)),
+        "total_duration": 5_000_000_000, "eval_count": tokens, "eval_duration": 4_000_000_000,
+    }))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def chunked(data: bytes, size: int) -> List[bytes]:
+    if size > 0:
+        return [data[i:i + size] for i in range(0, len(data), size)]
+    return [line + b"\n" for line in data.split(b"\n") if line]
+
+
+def run_old(chunks: List[bytes]) -> int:
+    text_decoder, line_decoder = TextDecoder("utf-8"), LineDecoder()
+    n = 0
+    for chunk in chunks:
+        for line in line_decoder.decode(text_decoder.decode(chunk)):
+            if not line:
+                continue
+            try:
+                data = httpx.Response(200, text=line).json()
+            except Exception:
+                continue
+            if data.get("response"):
+                n += 1
+    return n
+
+
+def run_new(chunks: List[bytes]) -> int:
+    decoder = ndjson.NDJSONDecoder()
+    n = 0
+    for chunk in chunks:
+        for data in decoder.feed(chunk):
+            if data.get("response"):
+                n += 1
+    for data in decoder.flush():
+        if data.get("response"):
+            n += 1
+    return n
+
+
+def bench(fn, chunks: List[bytes], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(chunks)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("file", nargs="?", help="錄下來的 Ollama NDJSON 串流")
+    ap.add_argument("--tokens", type=int, default=5000)
+    ap.add_argument("--chunk", type=int, default=0, help="固定 chunk 大小（bytes），0 = 每行一個 chunk")
+    ap.add_argument("--repeat", type=int, default=7)
+    args = ap.parse_args()
+
+    data = Path(args.file).read_bytes() if args.file else synth_stream(args.tokens)
+    chunks = chunked(data, args.chunk)
+
+    tokens = run_old(chunks)
+    assert tokens == run_new(chunks), "old / new decoders disagree"
+
+    print(f"stream: {len(data)} bytes, {len(chunks)} chunks, {tokens} tokens, "
+          f"json backend: {'orjson' if ndjson._ZERO_COPY else 'json'}")
+    results = {}
+    for name, fn in (("old (Response per line)", run_old), ("new (NDJSONDecoder)", run_new)):
+        t = bench(fn, chunks, args.repeat)
+        results[name] = t
+        print(f"{name:<26} {t * 1e3:8.2f} ms  {t / tokens * 1e6:6.2f} us/token  {tokens / t:12,.0f} tokens/s")
+    old, new = results.values()
+    print(f"speedup: {old / new:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
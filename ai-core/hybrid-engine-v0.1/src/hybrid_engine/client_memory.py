@@ -1,17 +1,156 @@
+"""
+寫 Memory Keeper（MK_URL）的 append：呼叫端只把記錄丟進 buffer 就回來，背景批次送出。
+
+- buffer 上限 MK_BUFFER_MAX 筆，滿了丟最舊的（drop-oldest），不會卡住呼叫端
+- 湊滿 MK_FLUSH_SIZE 筆或每 MK_FLUSH_INTERVAL 秒送一次，走共用的 httpx client（core/http.py）
+- MK_BATCH_PATH 有設（例如 /append_batch）就整批一個 POST {"items": [...]}；
+  沒設就對 /append 逐筆 POST（同一批並行送，連線共用）
+- 送失敗的記錄直接丟掉並計數（跟原本「靜默失敗，不阻斷主流程」一樣）
+- 關機時（routes 的 lifespan）會把 buffer 裡剩下的盡量送完
+
+/metrics：he_memory_sink_items_total{result=flushed|dropped|failed}、he_memory_sink_buffered
+"""
+import asyncio
+import logging
 import os
-import httpx
+from collections import deque
+from functools import lru_cache
+from typing import Any, Deque, Dict, List, Optional
+
+from prometheus_client import Counter, Gauge
+
+from .core.http import get_http_client
+
+log = logging.getLogger(__name__)
 
 MK_URL = os.getenv("MK_URL", "http://127.0.0.1:7781")
 MK_TIMEOUT = float(os.getenv("MK_TIMEOUT", "2.0"))
+MK_BUFFER_MAX = int(os.getenv("MK_BUFFER_MAX", "1000"))
+MK_FLUSH_SIZE = int(os.getenv("MK_FLUSH_SIZE", "50"))
+MK_FLUSH_INTERVAL = float(os.getenv("MK_FLUSH_INTERVAL", "1.0"))
+MK_BATCH_PATH = os.getenv("MK_BATCH_PATH", "")
+
+MEMORY_SINK_ITEMS = Counter(
+    "he_memory_sink_items_total", "Memory Keeper appends by outcome", ["result"]
+)
+MEMORY_SINK_BUFFERED = Gauge("he_memory_sink_buffered", "Memory Keeper appends waiting to be flushed")
+
+
+class MemorySink:
+    def __init__(
+        self,
+        base_url: str = MK_URL,
+        max_buffer: int = MK_BUFFER_MAX,
+        flush_size: int = MK_FLUSH_SIZE,
+        flush_interval: float = MK_FLUSH_INTERVAL,
+        batch_path: str = MK_BATCH_PATH,
+        timeout: float = MK_TIMEOUT,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.flush_size = max(1, flush_size)
+        self.flush_interval = flush_interval
+        self.batch_path = batch_path
+        self.timeout = timeout
+        self._buf: Deque[Dict[str, Any]] = deque(maxlen=max(1, max_buffer))
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional["asyncio.Task[None]"] = None
+        self._closing = False
+
+    def __len__(self) -> int:
+        return len(self._buf)
+
+    def enqueue(self, item: Dict[str, Any]) -> None:
+        """不 await、不做 I/O；需要在 event loop 裡呼叫（背景 flush task 第一次用到時才啟動）"""
+        if len(self._buf) == self._buf.maxlen:
+            MEMORY_SINK_ITEMS.labels("dropped").inc()
+        self._buf.append(item)  # deque(maxlen) 滿了會自動擠掉最舊的
+        MEMORY_SINK_BUFFERED.set(len(self._buf))
+        self._ensure_task()
+        if len(self._buf) >= self.flush_size:
+            self._wake.set()
+
+    def _ensure_task(self) -> None:
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self) -> None:
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            while self._buf:
+                await self.flush_once()
+                if len(self._buf) < self.flush_size:
+                    break
+
+    def _take(self) -> List[Dict[str, Any]]:
+        n = min(self.flush_size, len(self._buf))
+        batch = [self._buf.popleft() for _ in range(n)]
+        MEMORY_SINK_BUFFERED.set(len(self._buf))
+        return batch
+
+    async def flush_once(self) -> int:
+        """送出一批；回傳成功筆數"""
+        batch = self._take()
+        if not batch:
+            return 0
+        client = get_http_client()
+        if self.batch_path:
+            try:
+                r = await client.post(f"{self.base_url}{self.batch_path}", json={"items": batch}, timeout=self.timeout)
+                r.raise_for_status()
+                ok = len(batch)
+            except Exception as e:
+                log.debug("memory batch append failed: %r", e)
+                ok = 0
+        else:
+            async def one(item: Dict[str, Any]) -> bool:
+                try:
+                    r = await client.post(f"{self.base_url}/append", json=item, timeout=self.timeout)
+                    r.raise_for_status()
+                    return True
+                except Exception as e:
+                    log.debug("memory append failed: %r", e)
+                    return False
+
+            ok = sum(await asyncio.gather(*(one(item) for item in batch)))
+        MEMORY_SINK_ITEMS.labels("flushed").inc(ok)
+        if ok < len(batch):
+            MEMORY_SINK_ITEMS.labels("failed").inc(len(batch) - ok)
+        return ok
+
+    async def close(self, timeout: float = 5.0) -> None:
+        """停掉背景 task（正在送的那批會送完），剩下的在 timeout 內盡量送完"""
+        self._closing = True
+
+        async def drain() -> None:
+            if self._task is not None:
+                self._wake.set()
+                await self._task
+            while self._buf:
+                await self.flush_once()
+
+        try:
+            await asyncio.wait_for(drain(), timeout)
+        except asyncio.TimeoutError:
+            MEMORY_SINK_ITEMS.labels("dropped").inc(len(self._buf))
+            self._buf.clear()
+            MEMORY_SINK_BUFFERED.set(0)
+        finally:
+            self._task = None
+            self._closing = False
+
+
+@lru_cache(maxsize=1)
+def get_memory_sink() -> MemorySink:
+    return MemorySink()
+
 
 async def append_memory(role: str, content: str, tags=None):
-    url = f"{MK_URL.rstrip('/')}/append"
+    """丟進背景 buffer 就回來；回傳 True 表示已收下（不代表已經寫進 Memory Keeper）"""
     payload = {"role": role or "system", "content": content, "tags": tags or []}
-    try:
-        async with httpx.AsyncClient(timeout=MK_TIMEOUT) as client:
-            r = await client.post(url, json=payload)
-            r.raise_for_status()
-            return True
-    except Exception:
-        # 靜默失敗，不阻斷主流程
-        return False
\ No newline at end of file
+    get_memory_sink().enqueue(payload)
+    return True
@@ -0,0 +1,90 @@
+"""
+Ollama 串流回應（NDJSON）的增量解碼器。
+
+- 直接吃 raw bytes chunk（response.aiter_bytes()），不先 decode 成 str、也不逐行建 httpx.Response
+- 用 bytes.find 找換行；有 orjson 時整行以 memoryview 切片直接餵給 orjson.loads（不複製），
+  沒有 orjson 時退回標準庫 json.loads（只多一次 bytes 切片）
+- 只有「跨 chunk 的那一行」才會進內部 buffer
+- 解析失敗的行直接跳過（與原本行為一致），數量記在 bad_lines
+"""
+import json
+from typing import Any, AsyncIterator, List
+
+import httpx
+
+try:
+    import orjson  # type: ignore
+
+    _loads = orjson.loads
+    _ZERO_COPY = True  # orjson 可以直接吃 memoryview
+except ImportError:  # pragma: no cover - 依安裝環境而定
+    _loads = json.loads
+    _ZERO_COPY = False
+
+
+class NDJSONDecoder:
+    __slots__ = ("_buf", "bad_lines")
+
+    def __init__(self) -> None:
+        self._buf = bytearray()
+        self.bad_lines = 0
+
+    def _decode(self, line: Any, out: List[Any]) -> None:
+        try:
+            out.append(_loads(line))
+        except ValueError:  # json.JSONDecodeError / orjson.JSONDecodeError 都是 ValueError
+            if bytes(line).strip():
+                self.bad_lines += 1
+
+    def feed(self, chunk: bytes) -> List[Any]:
+        """
+        餵一個 chunk，回傳這個 chunk 湊完整的所有 JSON 物件（可能是空 list）。
+        """
+        out: List[Any] = []
+        start = 0
+        if self._buf:
+            nl = chunk.find(b"\n")
+            if nl < 0:
+                self._buf += chunk
+                return out
+            self._buf += chunk[:nl]
+            if self._buf.strip():
+                self._decode(self._buf, out)
+            self._buf.clear()
+            start = nl + 1
+
+        view = memoryview(chunk) if _ZERO_COPY else chunk
+        find = chunk.find
+        while True:
+            nl = find(b"\n", start)
+            if nl < 0:
+                break
+            if nl > start:
+                self._decode(view[start:nl], out)
+            start = nl + 1
+
+        if start < len(chunk):
+            self._buf += view[start:]
+        return out
+
+    def flush(self) -> List[Any]:
+        """
+        串流結束時呼叫：最後一行沒有換行的話在這裡吐出來。
+        """
+        out: List[Any] = []
+        if self._buf.strip():
+            self._decode(self._buf, out)
+        self._buf.clear()
+        return out
+
+
+async def aiter_ndjson(response: httpx.Response) -> AsyncIterator[Any]:
+    """
+    逐一 yield 串流回應裡的 JSON 物件。
+    """
+    decoder = NDJSONDecoder()
+    async for chunk in response.aiter_bytes():
+        for obj in decoder.feed(chunk):
+            yield obj
+    for obj in decoder.flush():
+        yield obj
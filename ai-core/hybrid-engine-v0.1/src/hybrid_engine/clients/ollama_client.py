@@ -1,14 +1,30 @@
 from typing import AsyncGenerator, Dict, Any, Optional
-import httpx, time
+import asyncio
+import httpx
+from contextlib import aclosing
 from hybrid_engine.core.config import get_llm_config
+from hybrid_engine.core.http import get_http_client
+from hybrid_engine.core.backends import Backend, get_backend_pool
+from hybrid_engine.core.llm_metrics import GenerationTimer
+from hybrid_engine.clients.ndjson import aiter_ndjson
 
 class OllamaClient:
-    def __init__(self):
+    """
+    Ollama /api/generate 的薄包裝。預設用 application 共用的 httpx client，
+    所以每個 request 建一個 OllamaClient 很便宜；傳入自己的 client 時才由 close() 關掉。
+    每次呼叫由 core/backends 的 BackendPool 挑後端（warm model 優先、least in-flight、失敗換下一台）。
+    TTFT / token 間隔 / tokens/s 記在 core/llm_metrics，label 用 route。
+    """
+    def __init__(self, client: Optional[httpx.AsyncClient] = None, route: str = "complete"):
+        self.route = route
         self.cfg = get_llm_config()
-        self._client = httpx.AsyncClient(base_url=self.cfg.base_url, timeout=self.cfg.timeout)
+        self._owns_client = client is not None
+        self._client = client or get_http_client()
+        self._pool = get_backend_pool()
 
     async def close(self):
-        await self._client.aclose()
+        if self._owns_client:
+            await self._client.aclose()
 
     async def generate(self, prompt: str, model: Optional[str] = None, temperature: Optional[float] = None,
                        max_tokens: Optional[int] = None, keep_alive: Optional[str] = None,
@@ -24,23 +40,26 @@ class OllamaClient:
         if _opts:
             payload["options"] = _opts
 
-        t0 = time.perf_counter()
-        text_chunks, stats = [], {}
-        async with self._client.stream("POST", "/api/generate", json=payload) as r:
-            r.raise_for_status()
-            async for line in r.aiter_lines():
-                if not line: continue
-                try:
-                    data = httpx.Response(200, text=line).json()
-                except Exception:
-                    continue
-                if "response" in data:
-                    text_chunks.append(data["response"])
-                if data.get("done"):
-                    stats = {k: data.get(k) for k in ["load_duration","prompt_eval_count","prompt_eval_duration",
-                                                      "eval_count","eval_duration","total_duration"]}
-                    break
-        return {"model": payload["model"], "text": "".join(text_chunks), "stats": {**stats, "latency_s": time.perf_counter()-t0}}
+        timer = GenerationTimer(self.route, payload["model"])
+
+        async def run(b: Backend) -> Dict[str, Any]:
+            text_chunks, stats = [], {}
+            async with self._client.stream("POST", f"{b.url}/api/generate", json=payload) as r:
+                r.raise_for_status()
+                async for data in aiter_ndjson(r):
+                    if not isinstance(data, dict): continue
+                    if data.get("response"):
+                        timer.token()
+                        text_chunks.append(data["response"])
+                    if data.get("done"):
+                        stats = {k: data.get(k) for k in ["load_duration","prompt_eval_count","prompt_eval_duration",
+                                                          "eval_count","eval_duration","total_duration"]}
+                        break
+            latency = timer.finish(stats)
+            return {"model": payload["model"], "text": "".join(text_chunks),
+                    "stats": {**stats, "backend": b.name, "ttft_s": timer.ttft, "latency_s": latency}}
+
+        return await self._pool.call(payload["model"], run, payload["keep_alive"])
 
     async def stream_generate(self, prompt: str, model: Optional[str] = None, temperature: Optional[float] = None,
                               max_tokens: Optional[int] = None, keep_alive: Optional[str] = None,
@@ -51,14 +70,27 @@ class OllamaClient:
         if temperature is not None: _opts["temperature"] = temperature
         _opts["num_predict"] = max_tokens if max_tokens else self.cfg.max_tokens
         if _opts: payload["options"] = _opts
-        async with self._client.stream("POST", "/api/generate", json=payload) as r:
-            r.raise_for_status()
-            async for line in r.aiter_lines():
-                if not line: continue
-                try:
-                    data = httpx.Response(200, text=line).json()
-                except Exception:
-                    continue
-                if token := data.get("response"):
-                    yield token
-                if data.get("done"): return
+
+        timer = GenerationTimer(self.route, payload["model"])
+
+        async def run(b: Backend) -> AsyncGenerator[str, None]:
+            try:
+                async with self._client.stream("POST", f"{b.url}/api/generate", json=payload) as r:
+                    r.raise_for_status()
+                    async for data in aiter_ndjson(r):
+                        if not isinstance(data, dict): continue
+                        if token := data.get("response"):
+                            timer.token()
+                            yield token
+                        if data.get("done"):
+                            timer.finish(data)
+                            return
+            except (asyncio.CancelledError, GeneratorExit):
+                # 下游走了（client 斷線）：離開 async with 就關掉上游連線，Ollama 會停止生成
+                timer.cancel(_opts["num_predict"])
+                raise
+
+        # aclosing：被 aclose() 時把整條 generator 鏈一路關到上游，不等 GC
+        async with aclosing(self._pool.stream(payload["model"], run, payload["keep_alive"])) as tokens:
+            async for token in tokens:
+                yield token
@@ -0,0 +1,296 @@
+"""
+多個 Ollama 相容後端的路由（HE_BACKENDS / HE_BACKENDS_FILE，沒設就是單一 LLM_BASE_URL）。
+
+挑後端的順序：
+1. 有提供這個 model 的後端（models 空 = 全部都接；都沒有人列這個 model 時，所有後端都是候選）
+2. 沒被踢出（ejected）的優先
+3. model 已經 warm（載入在記憶體裡）的優先：成功跑過一次後依 keep_alive 記為 warm，
+   背景 health check 也會用 /api/ps 同步實際載入的 model
+4. in-flight / weight 最小的
+呼叫端可以帶 prefer=後端名稱（例如 chat session 上一輪跑的那台，KV cache 還在），
+在「沒被踢出」之後、warm 之前優先考慮。
+
+失敗處理：
+- 連線失敗 / 5xx：記一次失敗並換下一個後端重試（串流只在第一個 token 之前重試）
+- 連續失敗 HE_BACKEND_EJECT_AFTER 次就踢出 HE_BACKEND_EJECT_SECONDS 秒（連續踢出會倍增，上限 10 分鐘）
+- 背景 health check（GET /api/ps，每 HE_BACKEND_HEALTH_INTERVAL 秒）成功就放回來
+- 全部都被踢出時還是會挑一個試，不會直接失敗
+
+/metrics：he_backend_requests_total、he_backend_in_flight、he_backend_healthy
+"""
+import asyncio
+import logging
+import re
+import time
+from contextlib import aclosing
+from functools import lru_cache
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Set, TypeVar
+
+import httpx
+from prometheus_client import Counter, Gauge
+
+from .config import BackendPoolConfig, get_backend_pool_config, get_llm_config
+from .http import get_http_client
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+BACKEND_REQUESTS = Counter(
+    "he_backend_requests_total", "LLM backend calls by backend and outcome", ["backend", "outcome"]
+)
+BACKEND_IN_FLIGHT = Gauge("he_backend_in_flight", "In-flight LLM calls per backend", ["backend"])
+BACKEND_HEALTHY = Gauge("he_backend_healthy", "1 if the backend is currently routable", ["backend"])
+
+_MAX_EJECT_SECONDS = 600.0
+_DURATION_RE = re.compile(r"^\s*(-?\d+(?:\.\d+)?)\s*([smh]?)\s*$")
+
+
+def parse_keep_alive(value: Optional[str]) -> float:
+    """Ollama keep_alive（"5m" / "300" / "1h" / "-1"）→ 秒；負數表示永久"""
+    m = _DURATION_RE.match(str(value or ""))
+    if not m:
+        return 300.0
+    n = float(m.group(1))
+    if n < 0:
+        return float("inf")
+    return n * {"": 1, "s": 1, "m": 60, "h": 3600}[m.group(2)]
+
+
+def normalize_model(name: str) -> str:
+    return name if ":" in name else f"{name}:latest"
+
+
+class Backend:
+    def __init__(self, name: str, url: str, models: Iterable[str] = (), weight: float = 1.0):
+        self.name = name
+        self.url = url.rstrip("/")
+        self.models: Set[str] = {normalize_model(m) for m in models}
+        self.weight = max(float(weight), 1e-6)
+        self.in_flight = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.ejections = 0
+        # model -> warm 到期時間（monotonic）
+        self.warm: Dict[str, float] = {}
+
+    def serves(self, model: str) -> bool:
+        return not self.models or normalize_model(model) in self.models
+
+    def available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def is_warm(self, model: str, now: float) -> bool:
+        return self.warm.get(normalize_model(model), 0.0) > now
+
+    def load(self) -> float:
+        return self.in_flight / self.weight
+
+    def __repr__(self) -> str:
+        return f"Backend({self.name!r}, {self.url!r})"
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500
+    return isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError))
+
+
+class BackendPool:
+    def __init__(self, cfg: BackendPoolConfig):
+        self.cfg = cfg
+        self.backends: List[Backend] = [Backend(b.name, b.url, b.models, b.weight) for b in cfg.backends]
+        self._health_task: Optional["asyncio.Task[None]"] = None
+        for b in self.backends:
+            BACKEND_HEALTHY.labels(b.name).set(1)
+
+    # ---- 選後端 ----
+
+    def candidates(self, model: str, exclude: Iterable[Backend] = (), prefer: Optional[str] = None) -> List[Backend]:
+        """依偏好排好的候選清單（第一個就是會被挑中的）"""
+        excluded = set(id(b) for b in exclude)
+        pool = [b for b in self.backends if id(b) not in excluded]
+        serving = [b for b in pool if b.serves(model)] or pool
+        now = time.monotonic()
+
+        def rank(b: Backend):
+            avail = b.available(now)
+            return (not avail, 0.0 if avail else b.ejected_until, b.name != prefer, not b.is_warm(model, now), b.load())
+
+        return sorted(serving, key=rank)
+
+    def pick(self, model: str, exclude: Iterable[Backend] = (), prefer: Optional[str] = None) -> Optional[Backend]:
+        ranked = self.candidates(model, exclude, prefer)
+        return ranked[0] if ranked else None
+
+    # ---- 狀態更新 ----
+
+    def _begin(self, b: Backend) -> None:
+        b.in_flight += 1
+        BACKEND_IN_FLIGHT.labels(b.name).set(b.in_flight)
+
+    def _end(self, b: Backend) -> None:
+        b.in_flight -= 1
+        BACKEND_IN_FLIGHT.labels(b.name).set(b.in_flight)
+
+    def mark_success(self, b: Backend, model: Optional[str] = None, keep_alive: Optional[str] = None) -> None:
+        b.failures = 0
+        b.ejections = 0
+        if b.ejected_until:
+            b.ejected_until = 0.0
+            BACKEND_HEALTHY.labels(b.name).set(1)
+        if model:
+            ttl = parse_keep_alive(keep_alive or get_llm_config().keep_alive)
+            b.warm[normalize_model(model)] = time.monotonic() + ttl
+        BACKEND_REQUESTS.labels(b.name, "ok").inc()
+
+    def mark_failure(self, b: Backend, exc: Optional[BaseException] = None) -> None:
+        b.failures += 1
+        BACKEND_REQUESTS.labels(b.name, "error").inc()
+        if b.failures >= self.cfg.eject_after:
+            cooldown = min(self.cfg.eject_seconds * (2 ** b.ejections), _MAX_EJECT_SECONDS)
+            b.ejected_until = time.monotonic() + cooldown
+            b.ejections += 1
+            b.failures = 0
+            b.warm.clear()
+            BACKEND_HEALTHY.labels(b.name).set(0)
+            log.warning("backend %s ejected for %.0fs: %r", b.name, cooldown, exc)
+
+    # ---- 呼叫 ----
+
+    async def call(
+        self,
+        model: str,
+        fn: Callable[[Backend], Awaitable[T]],
+        keep_alive: Optional[str] = None,
+        prefer: Optional[str] = None,
+    ) -> T:
+        """
+        在挑中的後端上跑 fn(backend)；可重試的錯誤就換下一個後端。
+        """
+        tried: List[Backend] = []
+        last: Optional[BaseException] = None
+        while True:
+            b = self.pick(model, tried, prefer)
+            if b is None:
+                break
+            tried.append(b)
+            self._begin(b)
+            try:
+                result = await fn(b)
+            except Exception as e:
+                if not is_retryable(e):
+                    if isinstance(e, httpx.HTTPStatusError):
+                        BACKEND_REQUESTS.labels(b.name, "client_error").inc()
+                    raise
+                self.mark_failure(b, e)
+                last = e
+                continue
+            finally:
+                self._end(b)
+            self.mark_success(b, model, keep_alive)
+            return result
+        if last is not None:
+            raise last
+        raise RuntimeError("no LLM backend configured")
+
+    async def stream(
+        self,
+        model: str,
+        fn: Callable[[Backend], AsyncIterator[T]],
+        keep_alive: Optional[str] = None,
+        prefer: Optional[str] = None,
+    ) -> AsyncIterator[T]:
+        """
+        串流版 call()：只有在吐出第一個 item 之前失敗才會換後端。
+        """
+        tried: List[Backend] = []
+        last: Optional[BaseException] = None
+        while True:
+            b = self.pick(model, tried, prefer)
+            if b is None:
+                break
+            tried.append(b)
+            started = False
+            self._begin(b)
+            try:
+                async with aclosing(fn(b)) as items:
+                    async for item in items:
+                        started = True
+                        yield item
+            except Exception as e:
+                if started or not is_retryable(e):
+                    if is_retryable(e):
+                        self.mark_failure(b, e)
+                    raise
+                self.mark_failure(b, e)
+                last = e
+                continue
+            finally:
+                self._end(b)
+            self.mark_success(b, model, keep_alive)
+            return
+        if last is not None:
+            raise last
+        raise RuntimeError("no LLM backend configured")
+
+    # ---- health check ----
+
+    async def check(self, b: Backend) -> bool:
+        try:
+            r = await get_http_client().get(f"{b.url}/api/ps", timeout=self.cfg.health_timeout)
+            r.raise_for_status()
+            data = r.json()
+        except Exception as e:
+            self.mark_failure(b, e)
+            return False
+        now = time.monotonic()
+        # /api/ps 是「現在真的載入著」的 model；沒列在上面的就不算 warm 了
+        b.warm = {
+            normalize_model(m.get("name") or m.get("model") or ""): now + max(self.cfg.health_interval * 2, 1.0)
+            for m in (data.get("models") or [])
+            if isinstance(m, dict)
+        }
+        b.failures = 0
+        if b.ejected_until:
+            b.ejected_until = 0.0
+            b.ejections = 0
+            BACKEND_HEALTHY.labels(b.name).set(1)
+            log.info("backend %s is healthy again", b.name)
+        return True
+
+    async def _health_loop(self) -> None:
+        while True:
+            await asyncio.gather(*(self.check(b) for b in self.backends), return_exceptions=True)
+            await asyncio.sleep(self.cfg.health_interval)
+
+    def start(self) -> None:
+        if self._health_task is None and self.cfg.health_interval > 0:
+            self._health_task = asyncio.ensure_future(self._health_loop())
+
+    async def stop(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+
+    def stats(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        return [
+            {
+                "name": b.name,
+                "url": b.url,
+                "in_flight": b.in_flight,
+                "available": b.available(now),
+                "warm": sorted(m for m, exp in b.warm.items() if exp > now),
+            }
+            for b in self.backends
+        ]
+
+
+@lru_cache(maxsize=1)
+def get_backend_pool() -> BackendPool:
+    return BackendPool(get_backend_pool_config())
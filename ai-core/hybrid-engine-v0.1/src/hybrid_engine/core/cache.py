@@ -0,0 +1,288 @@
+"""
+/llm/complete、/llm/chat 的確定性回應快取（HE_CACHE_ENABLED=1 才啟用）。
+
+- 只快取確定性的請求：temperature 明確為 0（非串流）。key 是 (route, model, prompt/messages,
+  system, options) 正規化 JSON 的 sha256
+- 兩層：
+  - memory：LRU（OrderedDict），筆數與總 bytes 上限；存的是已經 serialize 好的 JSON body，
+    命中時直接回 bytes，不再經過 pydantic / json.dumps
+  - disk（HE_CACHE_DIR）：一個 key 一個檔，mtime 當建立時間；總 bytes 超過上限時從最舊的刪；
+    檔案 I/O 丟到 thread，不卡 event loop
+- 兩層共用 TTL（HE_CACHE_TTL）
+- 請求端用 Cache-Control 控制：
+  - no-store   ：完全不碰快取
+  - no-cache   ：不讀快取、強制重新生成，但結果會寫回（refresh）
+  - max-age=N  ：只接受 N 秒內產生的快取
+- 回應帶 X-Cache: HIT / MISS / REFRESH / BYPASS；/metrics 有 he_response_cache_* 指標
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi.responses import Response
+from prometheus_client import Counter, Gauge
+
+from .config import CacheConfig, get_cache_config
+
+log = logging.getLogger(__name__)
+
+CACHE_REQUESTS = Counter(
+    "he_response_cache_requests_total",
+    "Response cache lookups by route and result",
+    ["route", "result"],
+)
+CACHE_MEMORY_ENTRIES = Gauge("he_response_cache_memory_entries", "Entries in the in-memory cache tier")
+CACHE_MEMORY_BYTES = Gauge("he_response_cache_memory_bytes", "Bytes held by the in-memory cache tier")
+CACHE_DISK_BYTES = Gauge("he_response_cache_disk_bytes", "Bytes held by the disk cache tier")
+
+
+@dataclass(frozen=True)
+class CachePolicy:
+    no_store: bool = False
+    no_cache: bool = False
+    max_age: Optional[float] = None
+
+
+def parse_cache_control(header: Optional[str]) -> CachePolicy:
+    if not header:
+        return CachePolicy()
+    no_store = no_cache = False
+    max_age: Optional[float] = None
+    for token in header.split(","):
+        token = token.strip().lower()
+        if token == "no-store":
+            no_store = True
+        elif token == "no-cache":
+            no_cache = True
+        elif token.startswith("max-age="):
+            try:
+                max_age = max(0.0, float(token.split("=", 1)[1]))
+            except ValueError:
+                pass
+    return CachePolicy(no_store=no_store, no_cache=no_cache, max_age=max_age)
+
+
+def is_deterministic(temperature: Optional[float], options: Optional[Dict[str, Any]]) -> bool:
+    """
+    request 的 temperature 優先，其次 options.temperature；沒指定（走模型預設）就不算確定性。
+    """
+    if temperature is None and isinstance(options, dict):
+        temperature = options.get("temperature")
+    try:
+        return temperature is not None and float(temperature) == 0.0
+    except (TypeError, ValueError):
+        return False
+
+
+def make_key(route: str, parts: Dict[str, Any]) -> str:
+    canonical = json.dumps(
+        {"route": route, **parts}, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, cfg: CacheConfig):
+        self.cfg = cfg
+        self.enabled = cfg.enabled
+        # key -> (created_at, body)
+        self._mem: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._mem_bytes = 0
+        self._disk_dir = cfg.disk_dir or None
+        self._disk_bytes = 0
+        self._disk_lock = threading.Lock()
+        if self.enabled and self._disk_dir:
+            try:
+                os.makedirs(self._disk_dir, exist_ok=True)
+                self._disk_bytes = sum(e.stat().st_size for e in os.scandir(self._disk_dir) if e.is_file())
+                CACHE_DISK_BYTES.set(self._disk_bytes)
+            except OSError as e:
+                log.warning("response cache disk tier disabled (%s): %s", self._disk_dir, e)
+                self._disk_dir = None
+
+    # ---- memory tier ----
+
+    def _mem_get(self, key: str, max_age: float) -> Optional[bytes]:
+        item = self._mem.get(key)
+        if item is None:
+            return None
+        created, body = item
+        if time.time() - created > self.cfg.ttl:
+            self._mem_pop(key)
+            return None
+        if time.time() - created > max_age:
+            return None
+        self._mem.move_to_end(key)
+        return body
+
+    def _mem_pop(self, key: str) -> None:
+        item = self._mem.pop(key, None)
+        if item is not None:
+            self._mem_bytes -= len(item[1])
+
+    def _mem_put(self, key: str, created: float, body: bytes) -> None:
+        if len(body) > self.cfg.memory_max_bytes:
+            return
+        self._mem_pop(key)
+        self._mem[key] = (created, body)
+        self._mem_bytes += len(body)
+        while self._mem and (
+            len(self._mem) > self.cfg.memory_max_entries or self._mem_bytes > self.cfg.memory_max_bytes
+        ):
+            _, (_, old) = self._mem.popitem(last=False)
+            self._mem_bytes -= len(old)
+        CACHE_MEMORY_ENTRIES.set(len(self._mem))
+        CACHE_MEMORY_BYTES.set(self._mem_bytes)
+
+    # ---- disk tier（在 thread 裡跑）----
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self._disk_dir, key + ".json")
+
+    def _disk_get(self, key: str, max_age: float) -> Optional[Tuple[float, bytes]]:
+        path = self._disk_path(key)
+        try:
+            created = os.stat(path).st_mtime
+            age = time.time() - created
+            if age > self.cfg.ttl:
+                self._disk_remove(path)
+                return None
+            if age > max_age:
+                return None
+            with open(path, "rb") as f:
+                return created, f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            log.warning("response cache disk read failed: %s", e)
+            return None
+
+    def _disk_remove(self, path: str) -> None:
+        with self._disk_lock:
+            try:
+                size = os.stat(path).st_size
+                os.remove(path)
+                self._disk_bytes -= size
+            except FileNotFoundError:
+                pass
+
+    def _disk_put(self, key: str, body: bytes) -> None:
+        path = self._disk_path(key)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(body)
+            with self._disk_lock:
+                try:
+                    self._disk_bytes -= os.stat(path).st_size
+                except FileNotFoundError:
+                    pass
+                os.replace(tmp, path)
+                self._disk_bytes += len(body)
+                if self._disk_bytes > self.cfg.disk_max_bytes:
+                    self._disk_evict()
+                CACHE_DISK_BYTES.set(self._disk_bytes)
+        except OSError as e:
+            log.warning("response cache disk write failed: %s", e)
+
+    def _disk_evict(self) -> None:
+        # 呼叫端已持有 _disk_lock；先砍過期的，再從最舊的砍到上限的 90%
+        entries = []
+        total = 0
+        for e in os.scandir(self._disk_dir):
+            if not e.is_file() or not e.name.endswith(".json"):
+                continue
+            st = e.stat()
+            entries.append((st.st_mtime, st.st_size, e.path))
+            total += st.st_size
+        entries.sort()
+        target = self.cfg.disk_max_bytes * 0.9
+        now = time.time()
+        for mtime, size, path in entries:
+            if total <= target and now - mtime <= self.cfg.ttl:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+        self._disk_bytes = total
+
+    # ---- public ----
+
+    async def get(self, key: str, max_age: Optional[float] = None) -> Tuple[Optional[bytes], str]:
+        """
+        回傳 (body, tier)；tier 為 "memory" / "disk" / ""（沒命中）。
+        """
+        limit = self.cfg.ttl if max_age is None else max_age
+        body = self._mem_get(key, limit)
+        if body is not None:
+            return body, "memory"
+        if self._disk_dir:
+            hit = await asyncio.to_thread(self._disk_get, key, limit)
+            if hit is not None:
+                created, body = hit
+                self._mem_put(key, created, body)
+                return body, "disk"
+        return None, ""
+
+    async def set(self, key: str, body: bytes) -> None:
+        self._mem_put(key, time.time(), body)
+        if self._disk_dir:
+            await asyncio.to_thread(self._disk_put, key, body)
+
+    def clear_memory(self) -> None:
+        self._mem.clear()
+        self._mem_bytes = 0
+        CACHE_MEMORY_ENTRIES.set(0)
+        CACHE_MEMORY_BYTES.set(0)
+
+
+@lru_cache(maxsize=1)
+def get_response_cache() -> ResponseCache:
+    return ResponseCache(get_cache_config())
+
+
+def _json_response(body: bytes, cache_status: str) -> Response:
+    return Response(content=body, media_type="application/json", headers={"X-Cache": cache_status})
+
+
+async def serve_cached(
+    route: str,
+    cache_control: Optional[str],
+    cacheable: bool,
+    key_parts: Dict[str, Any],
+    produce: Callable[[], Awaitable[Any]],
+) -> Response:
+    """
+    router 共用的快取流程：查快取 → 沒命中才 await produce() → 寫回快取。
+    produce() 回傳可 JSON 化的物件；例外直接往外拋，由 router 自己轉成 HTTP 錯誤。
+    """
+    cache = get_response_cache()
+    policy = parse_cache_control(cache_control)
+    if not cache.enabled or not cacheable or policy.no_store:
+        if cache.enabled:
+            CACHE_REQUESTS.labels(route, "bypass").inc()
+        body = json.dumps(await produce(), ensure_ascii=False).encode("utf-8")
+        return _json_response(body, "BYPASS")
+
+    key = make_key(route, key_parts)
+    if not policy.no_cache:
+        body, tier = await cache.get(key, policy.max_age)
+        if body is not None:
+            CACHE_REQUESTS.labels(route, f"hit_{tier}").inc()
+            return _json_response(body, "HIT")
+
+    body = json.dumps(await produce(), ensure_ascii=False).encode("utf-8")
+    await cache.set(key, body)
+    status = "REFRESH" if policy.no_cache else "MISS"
+    CACHE_REQUESTS.labels(route, status.lower()).inc()
+    return _json_response(body, status)
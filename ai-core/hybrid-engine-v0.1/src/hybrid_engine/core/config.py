@@ -1,4 +1,5 @@
 import os
+import json
 from pydantic import BaseModel, Field, ValidationError
 
 class LLMConfig(BaseModel):
@@ -13,3 +14,161 @@ def get_llm_config() -> LLMConfig:
         return LLMConfig()
     except ValidationError:
         return LLMConfig()
+
+
+class HTTPConfig(BaseModel):
+    """application 共用 httpx.AsyncClient 的連線設定（見 core/http.py）"""
+    max_connections: int = Field(default=int(os.getenv("HE_HTTP_MAX_CONNECTIONS", "100")))
+    max_keepalive_connections: int = Field(default=int(os.getenv("HE_HTTP_MAX_KEEPALIVE", "20")))
+    keepalive_expiry: float = Field(default=float(os.getenv("HE_HTTP_KEEPALIVE_EXPIRY", "30")))
+    connect_timeout: float = Field(default=float(os.getenv("HE_HTTP_CONNECT_TIMEOUT", "5")))
+    http2: bool = Field(default=os.getenv("HE_HTTP2", "0") == "1")
+
+def get_http_config() -> HTTPConfig:
+    try:
+        return HTTPConfig()
+    except ValidationError:
+        return HTTPConfig()
+
+
+class CacheConfig(BaseModel):
+    """/llm/complete、/llm/chat 的回應快取（見 core/cache.py）；預設關閉"""
+    enabled: bool = Field(default=os.getenv("HE_CACHE_ENABLED", "0") == "1")
+    ttl: float = Field(default=float(os.getenv("HE_CACHE_TTL", "3600")))
+    memory_max_entries: int = Field(default=int(os.getenv("HE_CACHE_MEMORY_MAX_ENTRIES", "1024")))
+    memory_max_bytes: int = Field(default=int(os.getenv("HE_CACHE_MEMORY_MAX_BYTES", str(32 * 1024 * 1024))))
+    # 空字串 = 不開 disk tier
+    disk_dir: str = Field(default=os.getenv("HE_CACHE_DIR", ""))
+    disk_max_bytes: int = Field(default=int(os.getenv("HE_CACHE_DISK_MAX_BYTES", str(512 * 1024 * 1024))))
+
+def get_cache_config() -> CacheConfig:
+    try:
+        return CacheConfig()
+    except ValidationError:
+        return CacheConfig()
+
+
+def _parse_map(raw: str, cast=float) -> dict:
+    """把 "a=1,b=2" 解析成 dict；model 名稱會有冒號，所以用 = 分隔"""
+    out = {}
+    for part in (raw or "").split(","):
+        if "=" not in part:
+            continue
+        k, v = part.rsplit("=", 1)
+        try:
+            out[k.strip()] = cast(v.strip())
+        except ValueError:
+            continue
+    return out
+
+
+class SchedulerConfig(BaseModel):
+    """Ollama 前面的 admission queue（見 core/scheduler.py）"""
+    enabled: bool = Field(default=os.getenv("HE_SCHEDULER_ENABLED", "1") == "1")
+    default_concurrency: int = Field(default=int(os.getenv("HE_MODEL_CONCURRENCY_DEFAULT", "2")))
+    model_concurrency: dict = Field(default_factory=lambda: _parse_map(os.getenv("HE_MODEL_CONCURRENCY", ""), int))
+    default_priority: str = Field(default=os.getenv("HE_DEFAULT_PRIORITY", "agent"))
+    weights: dict = Field(default_factory=lambda: {
+        "interactive": 8.0, "agent": 3.0, "batch": 1.0,
+        **_parse_map(os.getenv("HE_PRIORITY_WEIGHTS", "")),
+    })
+    queue_timeouts: dict = Field(default_factory=lambda: {
+        "interactive": 10.0, "agent": 60.0, "batch": 600.0,
+        **_parse_map(os.getenv("HE_QUEUE_TIMEOUTS", "")),
+    })
+    max_queue_depth: dict = Field(default_factory=lambda: {
+        "interactive": 64, "agent": 256, "batch": 1024,
+        **_parse_map(os.getenv("HE_QUEUE_MAX_DEPTH", ""), int),
+    })
+
+def get_scheduler_config() -> SchedulerConfig:
+    try:
+        return SchedulerConfig()
+    except ValidationError:
+        return SchedulerConfig()
+
+
+class BackendConfig(BaseModel):
+    """一個 Ollama 相容的後端節點；models 空 = 任何 model 都接"""
+    name: str
+    url: str
+    models: list = Field(default_factory=list)
+    weight: float = 1.0
+
+
+def _load_backends() -> list:
+    """
+    HE_BACKENDS（JSON 字串）或 HE_BACKENDS_FILE（JSON 檔）：
+      [{"name": "local", "url": "http://127.0.0.1:11434", "models": ["llama3.1:8b-instruct-q4_K_M"]},
+       {"name": "node2", "url": "http://10.0.0.12:11434", "models": ["phi3"], "weight": 2}]
+    都沒設時退回單一後端 LLM_BASE_URL。
+    有設但讀不到 / 解析不了就直接 raise ValueError：startup（routes.lifespan 建 backend pool）
+    就會失敗，不會默默只打 LLM_BASE_URL。
+    """
+    raw = os.getenv("HE_BACKENDS", "")
+    source = "HE_BACKENDS"
+    path = os.getenv("HE_BACKENDS_FILE", "")
+    if not raw.strip() and path:
+        source = f"HE_BACKENDS_FILE={path}"
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                raw = f.read()
+        except OSError as e:
+            raise ValueError(f"cannot read {source}: {e}") from e
+    if raw.strip():
+        try:
+            items = json.loads(raw)
+            if not isinstance(items, list) or not items:
+                raise TypeError("expected a non-empty JSON list of backends")
+            return [BackendConfig(**b) for b in items]
+        except (ValueError, TypeError, ValidationError) as e:
+            raise ValueError(f"invalid {source}: {e}") from e
+    return [BackendConfig(name="default", url=os.getenv("LLM_BASE_URL", "http://127.0.0.1:11434"))]
+
+
+class BackendPoolConfig(BaseModel):
+    """多後端路由（見 core/backends.py）"""
+    backends: list = Field(default_factory=_load_backends)
+    health_interval: float = Field(default=float(os.getenv("HE_BACKEND_HEALTH_INTERVAL", "10")))
+    health_timeout: float = Field(default=float(os.getenv("HE_BACKEND_HEALTH_TIMEOUT", "2")))
+    eject_after: int = Field(default=int(os.getenv("HE_BACKEND_EJECT_AFTER", "2")))
+    eject_seconds: float = Field(default=float(os.getenv("HE_BACKEND_EJECT_SECONDS", "30")))
+
+def get_backend_pool_config() -> BackendPoolConfig:
+    try:
+        return BackendPoolConfig()
+    except ValidationError:
+        return BackendPoolConfig()
+
+
+class ChatSessionConfig(BaseModel):
+    """/llm/chat 的 session（見 core/sessions.py）"""
+    max_sessions: int = Field(default=int(os.getenv("HE_CHAT_SESSIONS_MAX", "256")))
+    idle_seconds: float = Field(default=float(os.getenv("HE_CHAT_SESSION_IDLE", "1800")))
+
+def get_chat_session_config() -> ChatSessionConfig:
+    try:
+        return ChatSessionConfig()
+    except ValidationError:
+        return ChatSessionConfig()
+
+
+class RAGConfig(BaseModel):
+    """/bridge/ask 的 RAG pipeline（見 core/rag.py）"""
+    embed_model: str = Field(default=os.getenv("HE_RAG_EMBED_MODEL", "nomic-embed-text"))
+    embed_cache_size: int = Field(default=int(os.getenv("HE_RAG_EMBED_CACHE", "4096")))
+    top_k: int = Field(default=int(os.getenv("HE_RAG_TOP_K", "5")))
+    # 每個來源先撈幾筆候選，再用 embedding 重新排序
+    candidates: int = Field(default=int(os.getenv("HE_RAG_CANDIDATES", "12")))
+    context_tokens: int = Field(default=int(os.getenv("HE_RAG_CONTEXT_TOKENS", "1500")))
+    kc_enabled: bool = Field(default=os.getenv("HE_RAG_KC_ENABLED", "1") == "1")
+    # knowledge_center 套件所在的 ai-core 目錄（hybrid-engine 單獨部署時沒有就跳過 KC）
+    ai_core_dir: str = Field(default=os.getenv("HE_AI_CORE_DIR", "/srv/cockswain-core/ai-core"))
+    model: str = Field(default=os.getenv("HE_RAG_MODEL", os.getenv("LLM_MODEL", "llama3.1:8b-instruct-q4_K_M")))
+    max_tokens: int = Field(default=int(os.getenv("HE_RAG_MAX_TOKENS", "512")))
+
+def get_rag_config() -> RAGConfig:
+    try:
+        return RAGConfig()
+    except ValidationError:
+        return RAGConfig()
@@ -0,0 +1,69 @@
+"""
+application 共用的 httpx.AsyncClient。
+
+- 在 FastAPI lifespan 裡建立 / 關閉（routes.app 已掛好 lifespan）
+- 所有 router、OllamaClient、client_memory 都用 get_http_client() 拿同一個 client，
+  共用 connection pool 與 keep-alive，不再每個 request 重建 TCP 連線
+- 連線上限 / keep-alive / HTTP/2 由 HTTPConfig（HE_HTTP_*）控制；
+  HE_HTTP2=1 但沒裝 h2 套件時自動退回 HTTP/1.1
+- 預設 timeout 是 LLM_TIMEOUT（connect 另用 HE_HTTP_CONNECT_TIMEOUT）；
+  其他上游（例如 Memory Keeper 的 MK_TIMEOUT）由呼叫端自己帶 timeout=
+"""
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import httpx
+from fastapi import FastAPI
+
+from .config import get_http_config, get_llm_config
+
+log = logging.getLogger(__name__)
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _build_client() -> httpx.AsyncClient:
+    cfg = get_http_config()
+    http2 = cfg.http2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            log.warning("HE_HTTP2=1 but h2 is not installed; falling back to HTTP/1.1")
+            http2 = False
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=cfg.max_connections,
+            max_keepalive_connections=cfg.max_keepalive_connections,
+            keepalive_expiry=cfg.keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(get_llm_config().timeout, connect=cfg.connect_timeout),
+    )
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    回傳共用 client；lifespan 還沒跑（例如單獨 import 模組來用）時就地建一個。
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
+
+
+async def close_http_client() -> None:
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    get_http_client()
+    try:
+        yield
+    finally:
+        await close_http_client()
@@ -0,0 +1,163 @@
+"""
+LLM generation 的延遲 / 吞吐指標（/metrics），label 都是 (route, model)。
+
+- he_llm_ttft_seconds          ：送出請求到第一個 token（含排隊以外的後端挑選、failover、model 載入）
+- he_llm_inter_token_seconds   ：相鄰兩個 token 之間的間隔
+- he_llm_request_seconds       ：整個 generation 的 wall-clock
+- he_llm_load_seconds          ：Ollama 回報的 load_duration（冷啟動 model 的代價）
+- he_llm_tokens_per_second     ：eval_count / eval_duration（Ollama 沒給時用 wall-clock 估）
+- he_llm_tokens_total{kind}    ：prompt_eval_count / eval_count 累計
+- he_llm_cancelled_total       ：還沒生完就被取消的 generation（client 斷線，見 core/streaming.py）
+- he_llm_saved_tokens_total    ：取消時距離 num_predict 還剩幾個 token（省下的上限）
+
+Ollama 的 *_duration 單位是奈秒。
+
+model 是 request body 帶進來的，不能直接當 label（任意字串 = 無上限的 series）：
+只有設定裡出現過的 model（HE_BACKENDS 各後端的 models、LLM_MODEL、HE_RAG_MODEL、
+HE_MODEL_CONCURRENCY 的 key）照名字記，其他一律記成 "other"。
+
+用法（每個 generation 一個）：
+    timer = GenerationTimer("complete", model)
+    ... 每收到一段非空文字 timer.token()
+    ... 收到 done=true 那行 timer.finish(data)
+    ... 被取消（GeneratorExit / CancelledError）時 timer.cancel(num_predict)
+"""
+import time
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, Optional
+
+from prometheus_client import Counter, Histogram
+
+_LABELS = ["route", "model"]
+OTHER_MODEL = "other"
+
+LLM_TTFT = Histogram(
+    "he_llm_ttft_seconds",
+    "Time from sending the LLM request to the first generated token",
+    _LABELS,
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120),
+)
+LLM_INTER_TOKEN = Histogram(
+    "he_llm_inter_token_seconds",
+    "Gap between consecutive generated tokens",
+    _LABELS,
+    buckets=(0.005, 0.01, 0.02, 0.04, 0.06, 0.08, 0.1, 0.15, 0.25, 0.5, 1, 2.5),
+)
+LLM_LATENCY = Histogram(
+    "he_llm_request_seconds",
+    "Wall-clock duration of a complete LLM generation",
+    _LABELS,
+    buckets=(0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120, 300, 600),
+)
+LLM_LOAD = Histogram(
+    "he_llm_load_seconds",
+    "Model load time reported by Ollama (load_duration)",
+    _LABELS,
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60),
+)
+LLM_TOKENS_PER_SECOND = Histogram(
+    "he_llm_tokens_per_second",
+    "Generation throughput (eval_count / eval_duration)",
+    _LABELS,
+    buckets=(1, 2.5, 5, 10, 15, 20, 30, 45, 60, 90, 120, 200),
+)
+LLM_TOKENS = Counter(
+    "he_llm_tokens_total",
+    "Tokens processed by the LLM (kind=prompt|eval)",
+    _LABELS + ["kind"],
+)
+
+LLM_CANCELLED = Counter(
+    "he_llm_cancelled_total",
+    "LLM generations aborted before completion (client disconnected)",
+    _LABELS,
+)
+LLM_SAVED_TOKENS = Counter(
+    "he_llm_saved_tokens_total",
+    "Tokens not generated because the generation was cancelled (num_predict minus tokens so far)",
+    _LABELS,
+)
+
+_NS = 1e9
+
+
+@lru_cache(maxsize=1)
+def known_models() -> FrozenSet[str]:
+    from .backends import normalize_model
+    from .config import get_backend_pool_config, get_llm_config, get_rag_config, get_scheduler_config
+
+    names = {get_llm_config().model, get_rag_config().model}
+    names.update(get_scheduler_config().model_concurrency)
+    for b in get_backend_pool_config().backends:
+        names.update(b.models)
+    return frozenset(normalize_model(n) for n in names if n)
+
+
+def model_label(model: Optional[str]) -> str:
+    from .backends import normalize_model
+
+    if model and normalize_model(model) in known_models():
+        return model
+    return OTHER_MODEL
+
+
+class GenerationTimer:
+    __slots__ = ("route", "model", "_t0", "_last", "ttft", "tokens", "_finished")
+
+    def __init__(self, route: str, model: str):
+        self.route = route
+        self.model = model_label(model)
+        self._t0 = time.perf_counter()
+        self._last: Optional[float] = None
+        self.ttft: Optional[float] = None
+        self.tokens = 0
+        self._finished = False
+
+    def token(self) -> None:
+        now = time.perf_counter()
+        self.tokens += 1
+        if self._last is None:
+            self.ttft = now - self._t0
+            LLM_TTFT.labels(self.route, self.model).observe(self.ttft)
+        else:
+            LLM_INTER_TOKEN.labels(self.route, self.model).observe(now - self._last)
+        self._last = now
+
+    def finish(self, stats: Optional[Dict[str, Any]] = None) -> float:
+        """
+        記錄整體延遲與 Ollama 的 done 統計；回傳 wall-clock 秒數。重複呼叫只算第一次。
+        """
+        elapsed = time.perf_counter() - self._t0
+        if self._finished:
+            return elapsed
+        self._finished = True
+        labels = (self.route, self.model)
+        LLM_LATENCY.labels(*labels).observe(elapsed)
+        stats = stats or {}
+
+        load_ns = stats.get("load_duration")
+        if isinstance(load_ns, (int, float)):
+            LLM_LOAD.labels(*labels).observe(load_ns / _NS)
+
+        prompt_tokens = stats.get("prompt_eval_count")
+        if isinstance(prompt_tokens, int) and prompt_tokens > 0:
+            LLM_TOKENS.labels(*labels, "prompt").inc(prompt_tokens)
+
+        eval_tokens = stats.get("eval_count")
+        if isinstance(eval_tokens, int) and eval_tokens > 0:
+            LLM_TOKENS.labels(*labels, "eval").inc(eval_tokens)
+            eval_ns = stats.get("eval_duration")
+            if isinstance(eval_ns, (int, float)) and eval_ns > 0:
+                LLM_TOKENS_PER_SECOND.labels(*labels).observe(eval_tokens * _NS / eval_ns)
+            elif self.ttft is not None and elapsed > self.ttft:
+                LLM_TOKENS_PER_SECOND.labels(*labels).observe(eval_tokens / (elapsed - self.ttft))
+        return elapsed
+
+    def cancel(self, budget: Optional[int] = None) -> None:
+        """generation 沒跑完就被停掉；budget 是 num_predict（不知道就不算省下多少）"""
+        if self._finished:
+            return
+        self._finished = True
+        LLM_CANCELLED.labels(self.route, self.model).inc()
+        if isinstance(budget, int) and budget > self.tokens:
+            LLM_SAVED_TOKENS.labels(self.route, self.model).inc(budget - self.tokens)
@@ -0,0 +1,285 @@
+"""
+/bridge/ask 的 RAG pipeline：embed → retrieve → rerank → assemble，生成交給 router。
+
+- embed    ：問題用 HE_RAG_EMBED_MODEL 算 embedding（走 BackendPool 的 /api/embeddings）；
+             結果放 LRU（HE_RAG_EMBED_CACHE 筆），存正規化後的 array('f')，相似度只剩內積
+- retrieve ：notes 的 FTS5 關鍵字檢索（core/store.py）與 KC（knowledge_center.search_kc，
+             跟 ai-core 一起部署時才有；import 不到就跳過）同時跑，MySQL / SQLite 都丟 thread；
+             向量檢索（store.search_by_vector）v0.1 還是關著，介面先接上
+- rerank   ：候選的 embedding（一樣有快取）跟問題算 cosine 重新排序，取前 HE_RAG_TOP_K；
+             embedding 失敗（沒有 embed model、後端掛了）就退回關鍵字原本的順序
+- assemble ：依序塞進 context，估算 token 不超過 HE_RAG_CONTEXT_TOKENS（最後一段會被截斷）
+
+每個 stage 的秒數放在 timings（也記在 he_rag_stage_seconds{stage}），方便找最慢的那段。
+"""
+import asyncio
+import hashlib
+import logging
+import math
+import sys
+import time
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from prometheus_client import Counter, Histogram
+
+from .backends import get_backend_pool
+from .config import RAGConfig, get_llm_config, get_rag_config
+from .http import get_http_client
+from .store import search_by_vector, search_notes
+
+log = logging.getLogger(__name__)
+
+RAG_STAGE_SECONDS = Histogram(
+    "he_rag_stage_seconds",
+    "Time spent in each /bridge/ask pipeline stage",
+    ["stage"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+RAG_EMBED_CACHE = Counter("he_rag_embed_cache_total", "Embedding cache lookups", ["result"])
+
+_EMBED_CONCURRENCY = 4
+_EMBED_MAX_CHARS = 2000
+
+SYSTEM_PROMPT = (
+    "你是 Cockswain 的助理。優先根據「參考資料」回答，引用時標出編號，例如 [1]；"
+    "參考資料不足以回答時直接說不知道，不要編造。"
+)
+
+
+# ------------------------------------------------------------
+# token 估算
+# ------------------------------------------------------------
+def _is_cjk(ch: str) -> bool:
+    o = ord(ch)
+    return 0x3000 <= o <= 0x9FFF or 0xF900 <= o <= 0xFAFF or 0xFF00 <= o <= 0xFFEF
+
+
+def estimate_tokens(text: str) -> int:
+    """粗估：中日韓字約 1 字 1 token，其他約 4 字元 1 token"""
+    cjk = sum(1 for ch in text if _is_cjk(ch))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    if budget <= 0:
+        return ""
+    if estimate_tokens(text) <= budget:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid]) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo].rstrip() + "…"
+
+
+# ------------------------------------------------------------
+# embedding（含快取）
+# ------------------------------------------------------------
+def _normalize(vec: List[float]) -> Optional[array]:
+    norm = math.sqrt(sum(x * x for x in vec))
+    if not norm:
+        return None
+    return array("f", (x / norm for x in vec))
+
+
+def _dot(a: array, b: array) -> float:
+    return sum(x * y for x, y in zip(a, b))
+
+
+class EmbeddingCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max(0, max_entries)
+        self._items: "OrderedDict[Tuple[str, str], array]" = OrderedDict()
+
+    @staticmethod
+    def key(model: str, text: str) -> Tuple[str, str]:
+        return model, hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def get(self, key: Tuple[str, str]) -> Optional[array]:
+        vec = self._items.get(key)
+        if vec is not None:
+            self._items.move_to_end(key)
+        return vec
+
+    def put(self, key: Tuple[str, str], vec: array) -> None:
+        if not self.max_entries:
+            return
+        self._items[key] = vec
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_entries:
+            self._items.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+@lru_cache(maxsize=1)
+def get_embedding_cache() -> EmbeddingCache:
+    return EmbeddingCache(get_rag_config().embed_cache_size)
+
+
+async def embed(text: str, model: Optional[str] = None) -> Optional[array]:
+    """回傳正規化後的向量；快取命中就不打後端"""
+    model = model or get_rag_config().embed_model
+    text = text[:_EMBED_MAX_CHARS]
+    cache = get_embedding_cache()
+    key = cache.key(model, text)
+    vec = cache.get(key)
+    if vec is not None:
+        RAG_EMBED_CACHE.labels("hit").inc()
+        return vec
+    RAG_EMBED_CACHE.labels("miss").inc()
+
+    async def on_backend(b):
+        r = await get_http_client().post(f"{b.url}/api/embeddings", json={"model": model, "prompt": text})
+        r.raise_for_status()
+        return r.json().get("embedding") or []
+
+    vec = _normalize(await get_backend_pool().call(model, on_backend, get_llm_config().keep_alive))
+    if vec is not None:
+        cache.put(key, vec)
+    return vec
+
+
+# ------------------------------------------------------------
+# KC（optional）
+# ------------------------------------------------------------
+@lru_cache(maxsize=1)
+def _kc_search() -> Optional[Callable[..., List[Dict[str, Any]]]]:
+    cfg = get_rag_config()
+    if not cfg.kc_enabled:
+        return None
+    if cfg.ai_core_dir and cfg.ai_core_dir not in sys.path:
+        sys.path.append(cfg.ai_core_dir)
+    try:
+        from knowledge_center.search_kc import search_kc_basic  # type: ignore
+    except Exception as e:
+        log.info("knowledge_center not importable, /bridge/ask skips KC: %s", e)
+        return None
+    return search_kc_basic
+
+
+def _search_kc(question: str, limit: int) -> List[Dict[str, Any]]:
+    fn = _kc_search()
+    if fn is None:
+        return []
+    return [
+        {
+            "source": "kc",
+            "id": r.get("entry_id"),
+            "title": r.get("title") or "",
+            "text": r.get("snippet") or "",
+        }
+        for r in fn(question, limit=limit)
+    ]
+
+
+def _search_notes(question: str, limit: int) -> List[Dict[str, Any]]:
+    return [
+        {"source": "note", "id": n["id"], "title": n.get("role") or "", "text": n["text"], "keyword_score": n["score"]}
+        for n in search_notes(question, k=limit)
+    ]
+
+
+# ------------------------------------------------------------
+# pipeline
+# ------------------------------------------------------------
+@dataclass
+class Retrieval:
+    question: str
+    hits: List[Dict[str, Any]] = field(default_factory=list)
+    context: str = ""
+    context_tokens: int = 0
+    timings: Dict[str, float] = field(default_factory=dict)
+    degraded: List[str] = field(default_factory=list)
+
+    def prompt(self) -> str:
+        if not self.context:
+            return f"（沒有找到相關的參考資料）\n\n問題：{self.question}"
+        return f"參考資料：\n{self.context}\n\n問題：{self.question}"
+
+
+def _observe(timings: Dict[str, float], stage: str, t0: float) -> None:
+    elapsed = time.perf_counter() - t0
+    timings[f"{stage}_s"] = round(elapsed, 6)
+    RAG_STAGE_SECONDS.labels(stage).observe(elapsed)
+
+
+def assemble(hits: List[Dict[str, Any]], budget: int) -> Tuple[str, List[Dict[str, Any]], int]:
+    """依序放進 context，超過 token 預算就停（最後一段截斷）；回傳 (context, 實際用到的 hits, tokens)"""
+    blocks: List[str] = []
+    used: List[Dict[str, Any]] = []
+    total = 0
+    for h in hits:
+        header = f"[{len(used) + 1}] ({h['source']}) {h.get('title') or ''}".rstrip()
+        room = budget - total - estimate_tokens(header) - 1
+        if room < 16:
+            break
+        text = truncate_to_tokens(h.get("text") or "", room)
+        block = f"{header}\n{text}"
+        blocks.append(block)
+        used.append(h)
+        total += estimate_tokens(block) + 1
+    return "\n\n".join(blocks), used, total
+
+
+async def retrieve(question: str, k: Optional[int] = None, cfg: Optional[RAGConfig] = None) -> Retrieval:
+    cfg = cfg or get_rag_config()
+    k = k or cfg.top_k
+    out = Retrieval(question=question)
+    t = out.timings
+
+    async def timed(stage: str, coro):
+        t0 = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            _observe(t, stage, t0)
+
+    qvec, notes, kc = await asyncio.gather(
+        timed("embed", embed(question, cfg.embed_model)),
+        timed("retrieve_notes", asyncio.to_thread(_search_notes, question, cfg.candidates)),
+        timed("retrieve_kc", asyncio.to_thread(_search_kc, question, cfg.candidates)),
+        return_exceptions=True,
+    )
+    for stage, res in (("embed", qvec), ("retrieve_notes", notes), ("retrieve_kc", kc)):
+        if isinstance(res, BaseException):
+            log.warning("/bridge/ask %s failed: %r", stage, res)
+            out.degraded.append(stage)
+    qvec = None if isinstance(qvec, BaseException) else qvec
+    candidates: List[Dict[str, Any]] = []
+    for res in (notes, kc):
+        if not isinstance(res, BaseException):
+            candidates.extend(res)
+    if qvec is not None:
+        # v0.1 的向量檢索還是關的（回 []），之後 store 開了這裡就有結果
+        candidates.extend(search_by_vector(list(qvec), k=cfg.candidates))
+
+    t0 = time.perf_counter()
+    if qvec is not None and candidates:
+        sem = asyncio.Semaphore(_EMBED_CONCURRENCY)
+
+        async def score(h: Dict[str, Any]) -> None:
+            async with sem:
+                vec = await embed(f"{h.get('title') or ''}\n{h.get('text') or ''}", cfg.embed_model)
+            h["score"] = round(_dot(qvec, vec), 6) if vec is not None else 0.0
+
+        try:
+            await asyncio.gather(*(score(h) for h in candidates))
+            candidates.sort(key=lambda h: h["score"], reverse=True)
+        except Exception as e:
+            log.warning("/bridge/ask rerank failed: %r", e)
+            out.degraded.append("rerank")
+    _observe(t, "rerank", t0)
+
+    t0 = time.perf_counter()
+    out.context, out.hits, out.context_tokens = assemble(candidates[:k], cfg.context_tokens)
+    _observe(t, "assemble", t0)
+    return out
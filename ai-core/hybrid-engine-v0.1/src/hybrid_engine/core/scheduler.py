@@ -0,0 +1,278 @@
+"""
+Router 與 OllamaClient 之間的 admission queue / concurrency limiter。
+
+- 每個 model 一組 slot（HE_MODEL_CONCURRENCY / HE_MODEL_CONCURRENCY_DEFAULT），
+  同時打到 Ollama 的 generation 不超過上限，其餘排隊
+- 三個優先權類別：interactive / agent / batch（request header X-Priority，預設 HE_DEFAULT_PRIORITY）
+- 出隊用加權公平（stride scheduling）：每個類別有 virtual pass，每出隊一次 pass += 1/weight，
+  永遠挑 pass 最小且有人在排的類別；interactive 權重高，但 batch 不會完全餓死
+- 提早拒絕，而不是讓大家一起變慢：
+  - 該類別排隊人數已達 HE_QUEUE_MAX_DEPTH → 429
+  - 用 slot 平均佔用時間（EWMA）估算等待時間，預估會超過 HE_QUEUE_TIMEOUTS → 直接 503
+  - 實際等超過 HE_QUEUE_TIMEOUTS → 503
+  都帶 Retry-After
+- /metrics：he_scheduler_queue_depth、he_scheduler_in_flight、he_scheduler_wait_seconds、
+  he_scheduler_rejected_total
+
+用法：
+    async with get_scheduler().slot(model, priority):
+        ...                                 # 非串流
+    source = await admit_stream(model, priority, factory, fanout, key)   # 串流：slot 撐到最後一個 token
+"""
+import asyncio
+import math
+import time
+import weakref
+from collections import deque
+from contextlib import aclosing, asynccontextmanager
+from functools import lru_cache
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from .config import SchedulerConfig, get_scheduler_config
+
+PRIORITIES = ("interactive", "agent", "batch")
+
+QUEUE_DEPTH = Gauge("he_scheduler_queue_depth", "Requests waiting for an LLM slot", ["model", "priority"])
+IN_FLIGHT = Gauge("he_scheduler_in_flight", "LLM generations currently holding a slot", ["model"])
+WAIT_SECONDS = Histogram(
+    "he_scheduler_wait_seconds",
+    "Time spent in the admission queue before getting an LLM slot",
+    ["priority"],
+    buckets=(0.005, 0.05, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600),
+)
+REJECTED = Counter(
+    "he_scheduler_rejected_total",
+    "Requests rejected by the admission queue",
+    ["priority", "reason"],
+)
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code: int, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Retry-After": str(max(1, math.ceil(self.retry_after)))}
+
+
+class Ticket:
+    __slots__ = ("_scheduler", "model", "_released", "_granted_at")
+
+    def __init__(self, scheduler: "Scheduler", model: str):
+        self._scheduler = scheduler
+        self.model = model
+        self._released = False
+        self._granted_at = time.monotonic()
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        self._scheduler._release(self.model, time.monotonic() - self._granted_at)
+
+
+class _Waiter:
+    __slots__ = ("fut", "priority")
+
+    def __init__(self, fut: "asyncio.Future[None]", priority: str):
+        self.fut = fut
+        self.priority = priority
+
+
+class _ModelState:
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.active = 0
+        self.queues: Dict[str, Deque[_Waiter]] = {p: deque() for p in PRIORITIES}
+        self.passes: Dict[str, float] = {p: 0.0 for p in PRIORITIES}
+        self.vtime = 0.0
+        self.hold_ewma = 0.0
+
+    def queued(self) -> int:
+        return sum(len(q) for q in self.queues.values())
+
+
+class Scheduler:
+    def __init__(self, cfg: SchedulerConfig):
+        self.cfg = cfg
+        self._models: Dict[str, _ModelState] = {}
+
+    def normalize_priority(self, priority: Optional[str]) -> str:
+        p = (priority or "").strip().lower()
+        if p in PRIORITIES:
+            return p
+        return self.cfg.default_priority if self.cfg.default_priority in PRIORITIES else "agent"
+
+    def _state(self, model: str) -> _ModelState:
+        st = self._models.get(model)
+        if st is None:
+            limit = self.cfg.model_concurrency.get(model, self.cfg.default_concurrency)
+            st = self._models[model] = _ModelState(limit)
+        return st
+
+    def _weight(self, priority: str) -> float:
+        return max(float(self.cfg.weights.get(priority, 1.0)), 1e-6)
+
+    def _estimated_wait(self, st: _ModelState, priority: str) -> float:
+        # 只算「出隊時大致會排在我前面」的人：同類別 + 權重不比我低的類別
+        w = self._weight(priority)
+        ahead = sum(len(st.queues[p]) for p in PRIORITIES if self._weight(p) >= w)
+        return (ahead + 1) / st.limit * st.hold_ewma
+
+    def _reject(self, priority: str, status_code: int, reason: str, retry_after: float) -> AdmissionRejected:
+        REJECTED.labels(priority, reason.split(" ")[0]).inc()
+        return AdmissionRejected(status_code, reason, retry_after)
+
+    async def acquire(self, model: str, priority: Optional[str] = None) -> Ticket:
+        priority = self.normalize_priority(priority)
+        st = self._state(model)
+
+        if st.active < st.limit and st.queued() == 0:
+            st.active += 1
+            IN_FLIGHT.labels(model).set(st.active)
+            WAIT_SECONDS.labels(priority).observe(0.0)
+            return Ticket(self, model)
+
+        timeout = float(self.cfg.queue_timeouts.get(priority, 60.0))
+        queue = st.queues[priority]
+        if len(queue) >= int(self.cfg.max_queue_depth.get(priority, 256)):
+            raise self._reject(priority, 429, "full", self._estimated_wait(st, priority) or timeout)
+        estimate = self._estimated_wait(st, priority)
+        if st.hold_ewma > 0 and estimate > timeout:
+            raise self._reject(priority, 503, f"overloaded (estimated wait {estimate:.1f}s)", estimate)
+
+        if not queue:
+            # 閒置後重新進場的類別不能帶著以前累積的 credit 插隊
+            st.passes[priority] = max(st.passes[priority], st.vtime)
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), priority)
+        queue.append(waiter)
+        QUEUE_DEPTH.labels(model, priority).set(len(queue))
+        t0 = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter.fut, timeout)
+        except asyncio.TimeoutError:
+            self._drop_waiter(model, st, waiter)
+            raise self._reject(priority, 503, "timeout", estimate or timeout)
+        except asyncio.CancelledError:
+            if waiter.fut.done() and not waiter.fut.cancelled():
+                # slot 已經交過來了，但呼叫端走了：還回去
+                self._release(model, 0.0, observe=False)
+            else:
+                self._drop_waiter(model, st, waiter)
+            raise
+        WAIT_SECONDS.labels(priority).observe(time.monotonic() - t0)
+        return Ticket(self, model)
+
+    def _drop_waiter(self, model: str, st: _ModelState, waiter: _Waiter) -> None:
+        queue = st.queues[waiter.priority]
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            pass
+        QUEUE_DEPTH.labels(model, waiter.priority).set(len(queue))
+
+    def _release(self, model: str, held: float, observe: bool = True) -> None:
+        st = self._models[model]
+        st.active -= 1
+        if observe:
+            st.hold_ewma = held if st.hold_ewma == 0 else 0.8 * st.hold_ewma + 0.2 * held
+        self._dispatch(model, st)
+        IN_FLIGHT.labels(model).set(st.active)
+
+    def _dispatch(self, model: str, st: _ModelState) -> None:
+        while st.active < st.limit:
+            candidates = [p for p in PRIORITIES if st.queues[p]]
+            if not candidates:
+                return
+            p = min(candidates, key=lambda c: st.passes[c])
+            waiter = st.queues[p].popleft()
+            QUEUE_DEPTH.labels(model, p).set(len(st.queues[p]))
+            if waiter.fut.done():
+                continue  # 已經 timeout / cancel
+            st.vtime = st.passes[p]
+            st.passes[p] += 1.0 / self._weight(p)
+            st.active += 1
+            waiter.fut.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, model: str, priority: Optional[str] = None) -> AsyncIterator[Ticket]:
+        ticket = await self.acquire(model, priority)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            m: {"limit": st.limit, "active": st.active, **{p: len(q) for p, q in st.queues.items()}}
+            for m, st in self._models.items()
+        }
+
+
+class _Unlimited:
+    """HE_SCHEDULER_ENABLED=0 時用的空殼，介面一樣"""
+
+    def normalize_priority(self, priority: Optional[str]) -> str:
+        return (priority or "agent").strip().lower()
+
+    async def acquire(self, model: str, priority: Optional[str] = None) -> Ticket:
+        return _NoopTicket()
+
+    @asynccontextmanager
+    async def slot(self, model: str, priority: Optional[str] = None) -> AsyncIterator[Ticket]:
+        yield _NoopTicket()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {}
+
+
+class _NoopTicket:
+    model = ""
+
+    def release(self) -> None:
+        pass
+
+
+@lru_cache(maxsize=1)
+def get_scheduler():
+    cfg = get_scheduler_config()
+    return Scheduler(cfg) if cfg.enabled else _Unlimited()
+
+
+async def _release_after(source: AsyncIterator[Any], ticket: Ticket) -> AsyncIterator[Any]:
+    try:
+        async with aclosing(source) as items:
+            async for item in items:
+                yield item
+    finally:
+        ticket.release()
+
+
+async def admit_stream(
+    model: str,
+    priority: Optional[str],
+    factory: Callable[[], AsyncIterator[Any]],
+    fanout: Any = None,
+    key: Optional[str] = None,
+) -> AsyncIterator[Any]:
+    """
+    串流請求的 admission：在回應開始前先拿到 slot（拿不到就丟 AdmissionRejected，router 還能回 429/503），
+    slot 一直持有到串流結束。
+    有傳 fanout（core/singleflight.StreamFanout）時，已經有相同 generation 在跑就直接訂閱、不佔 slot。
+    """
+    if fanout is not None and fanout.has(key):
+        return fanout.subscribe(key, factory)
+    ticket = await get_scheduler().acquire(model, priority)
+    if fanout is not None:
+        # 排隊期間別人可能已經開了同一個 generation：subscribe 會判斷，follower 立刻還 slot
+        return fanout.subscribe(key, factory, on_done=ticket.release)
+    stream = _release_after(factory(), ticket)
+    # 回應還沒開始 client 就斷線時 generator 不會被 iterate，finally 不會跑；GC 時補還 slot
+    weakref.finalize(stream, ticket.release)
+    return stream
@@ -0,0 +1,125 @@
+"""
+/llm/chat 的多輪 session：重用 Ollama 已經 evaluate 過的 context，不再每輪重送整段歷史。
+
+- client 照舊送完整 messages，另外帶 session_id
+- session 記住：上一輪結束時 Ollama 回的 context（token ids）、已涵蓋幾則 message、
+  那段 message 的 digest，以及上一輪跑在哪個後端（KV cache 在那台上，見 core/backends.py 的 prefer）
+- 下一輪 messages 的前綴 digest 對得上 → 只把新增的 turn 折成 prompt，連同 context 往上送（incremental）；
+  對不上（歷史被改過、換 model、session 過期）→ 整段重送並重建 session（full）
+- 同一個 session 的 turn 用 asyncio.Lock 串起來，context 不會被兩個並行的 turn 互相覆蓋
+- 上限 HE_CHAT_SESSIONS_MAX 筆 LRU，閒置超過 HE_CHAT_SESSION_IDLE 秒就丟
+- context 用 array('i') 存（每個 token 4 bytes），不是 Python int list
+
+/metrics：he_chat_sessions、he_chat_session_turns_total{mode}
+"""
+import asyncio
+import hashlib
+import json
+import time
+from array import array
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from prometheus_client import Counter, Gauge
+
+from .config import ChatSessionConfig, get_chat_session_config
+
+CHAT_SESSIONS = Gauge("he_chat_sessions", "Chat sessions currently held in memory")
+CHAT_SESSION_TURNS = Counter(
+    "he_chat_session_turns_total",
+    "Session chat turns (incremental = only the new turn was sent upstream)",
+    ["mode"],
+)
+
+
+def messages_digest(msgs: Sequence[Dict[str, Any]]) -> str:
+    h = hashlib.sha256()
+    for m in msgs:
+        h.update(json.dumps([m.get("role"), m.get("content")], ensure_ascii=False).encode("utf-8"))
+        h.update(b"\n")
+    return h.hexdigest()
+
+
+class Session:
+    __slots__ = ("id", "model", "context", "consumed", "digest", "backend", "last_used", "turns", "lock")
+
+    def __init__(self, session_id: str):
+        self.id = session_id
+        self.model: Optional[str] = None
+        self.context = array("i")
+        self.consumed = 0
+        self.digest = ""
+        self.backend: Optional[str] = None
+        self.last_used = time.monotonic()
+        self.turns = 0
+        self.lock = asyncio.Lock()
+
+    def plan(self, model: str, msgs: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Optional[List[int]]]:
+        """
+        回傳 (這輪要送的 messages, 要帶的 context)；context 是 None 表示整段重送。
+        """
+        if (
+            self.model == model
+            and self.context
+            and 0 < self.consumed < len(msgs)
+            and messages_digest(msgs[: self.consumed]) == self.digest
+        ):
+            return msgs[self.consumed:], self.context.tolist()
+        return msgs, None
+
+    def commit(self, model: str, msgs: List[Dict[str, Any]], reply: str,
+               context: Optional[Sequence[int]], backend: Optional[str]) -> None:
+        """這輪成功後更新；模型的回覆也算進前綴（client 下一輪會把它當 assistant message 送回來）"""
+        covered = list(msgs) + [{"role": "assistant", "content": reply}]
+        self.model = model
+        self.context = array("i", context or ())
+        self.consumed = len(covered)
+        self.digest = messages_digest(covered)
+        self.backend = backend
+        self.turns += 1
+
+
+class SessionStore:
+    def __init__(self, cfg: ChatSessionConfig):
+        self.cfg = cfg
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _evict(self) -> None:
+        # OrderedDict 的順序就是 last_used 由舊到新，過期的只會在最前面
+        cutoff = time.monotonic() - self.cfg.idle_seconds
+        for _ in range(len(self._sessions)):
+            oldest = next(iter(self._sessions.values()))
+            if len(self._sessions) <= self.cfg.max_sessions and oldest.last_used >= cutoff:
+                break
+            if oldest.lock.locked():
+                # 正在跑的 turn 不要丟；移到後面，下次再看
+                self._sessions.move_to_end(oldest.id)
+                continue
+            self._sessions.popitem(last=False)
+        CHAT_SESSIONS.set(len(self._sessions))
+
+    def get(self, session_id: str) -> Session:
+        """拿到（或建立）session，順便更新 LRU 順序"""
+        self._evict()
+        s = self._sessions.get(session_id)
+        if s is None:
+            s = self._sessions[session_id] = Session(session_id)
+        else:
+            self._sessions.move_to_end(session_id)
+        s.last_used = time.monotonic()
+        self._evict()
+        return s
+
+    def drop(self, session_id: str) -> bool:
+        found = self._sessions.pop(session_id, None) is not None
+        CHAT_SESSIONS.set(len(self._sessions))
+        return found
+
+
+@lru_cache(maxsize=1)
+def get_session_store() -> SessionStore:
+    return SessionStore(get_chat_session_config())
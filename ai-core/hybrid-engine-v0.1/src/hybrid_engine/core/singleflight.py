@@ -0,0 +1,223 @@
+"""
+相同 LLM 請求的 single-flight 合併（HE_SINGLEFLIGHT_ENABLED，預設開）。
+
+多個 agent 同時問一模一樣的東西時，只有第一個（leader）真的去打 Ollama，
+後到的（follower）直接掛在同一個 generation 上：
+- SingleFlight（非串流）：大家 await 同一個 task，拿到同一份結果 / 同一個例外
+- StreamFanout（串流）：leader 的 token 串流由背景 task 抽取，每個訂閱者從頭 replay 已產生的
+  token 再接著收新的；晚到的訂閱者也拿得到完整輸出
+- 所有訂閱者都離開（client 斷線 / cancel）時才取消底層 generation；訂閱者在 subscribe() 當下就算數，
+  還沒開始讀就斷線（aclose 或被 GC）一樣會離開
+- backpressure：最慢的訂閱者落後超過 HE_SINGLEFLIGHT_MAX_LAG 個 token 時，抽取 task 停下來不讀 Ollama，
+  讓 client 端的慢速（core/streaming.py 的 send timeout）一路傳回 upstream
+- 請求帶 Cache-Control: no-store 時不合併（跟 core/cache.py 同一套語意：要一份全新的）
+- key 用 core/cache.make_key，跟回應快取同一套正規化
+
+結果物件是共用的，呼叫端不要就地修改。
+"""
+import asyncio
+import itertools
+import os
+import weakref
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from prometheus_client import Counter
+
+from .cache import parse_cache_control
+
+SINGLEFLIGHT_ENABLED = os.getenv("HE_SINGLEFLIGHT_ENABLED", "1") == "1"
+SINGLEFLIGHT_MAX_LAG = int(os.getenv("HE_SINGLEFLIGHT_MAX_LAG", "256"))
+
+SINGLEFLIGHT_REQUESTS = Counter(
+    "he_singleflight_requests_total",
+    "LLM requests by coalescing role (leader starts a generation, follower joins one)",
+    ["route", "role"],
+)
+
+
+def should_coalesce(cache_control: Optional[str]) -> bool:
+    return SINGLEFLIGHT_ENABLED and not parse_cache_control(cache_control).no_store
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Task[Any]"):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, route: str):
+        self.route = route
+        self._calls: Dict[str, _Call] = {}
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _t, k=key, c=call: self._forget(k, c))
+            SINGLEFLIGHT_REQUESTS.labels(self.route, "leader").inc()
+        else:
+            SINGLEFLIGHT_REQUESTS.labels(self.route, "follower").inc()
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            # 最後一個等待者也走了，底層 generation 就沒人要了
+            if call.waiters == 1 and not call.task.done():
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _forget(self, key: str, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+
+class _Stream:
+    __slots__ = ("items", "done", "error", "cond", "positions", "task")
+
+    def __init__(self) -> None:
+        self.items: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.cond = asyncio.Condition()
+        # 訂閱者 id → 已讀到的位置
+        self.positions: Dict[int, int] = {}
+        self.task: Optional["asyncio.Task[None]"] = None
+
+    @property
+    def subscribers(self) -> int:
+        return len(self.positions)
+
+    def lag(self) -> int:
+        return len(self.items) - min(self.positions.values()) if self.positions else 0
+
+
+async def _notify(st: _Stream) -> None:
+    async with st.cond:
+        st.cond.notify_all()
+
+
+def _detach(st: _Stream, sid: int) -> None:
+    """訂閱者離開（同步，GC 的 finalizer 也會呼叫）；最後一個走了就取消 generation"""
+    if st.positions.pop(sid, None) is None:
+        return
+    if not st.positions and not st.done and st.task is not None:
+        st.task.cancel()
+    elif not st.done:
+        # 抽取 task 可能正因為這個訂閱者落後而停著
+        try:
+            asyncio.get_running_loop().create_task(_notify(st))
+        except RuntimeError:
+            pass
+
+
+_sub_ids = itertools.count()
+
+
+class _Subscription:
+    """
+    訂閱者的 token iterator。不用 async generator：還沒 iterate 就被 aclose / 丟掉時，
+    generator 的 finally 不會跑，訂閱者就永遠不會離開。
+    """
+
+    __slots__ = ("_st", "_sid", "_finalizer", "__weakref__")
+
+    def __init__(self, st: _Stream):
+        self._st = st
+        self._sid = next(_sub_ids)
+        st.positions[self._sid] = 0
+        self._finalizer = weakref.finalize(self, _detach, st, self._sid)
+
+    def __aiter__(self) -> "_Subscription":
+        return self
+
+    async def __anext__(self) -> Any:
+        st = self._st
+        if self._sid not in st.positions:
+            raise StopAsyncIteration
+        async with st.cond:
+            while st.positions.get(self._sid, 0) >= len(st.items) and not st.done:
+                await st.cond.wait()
+            pos = st.positions.get(self._sid)
+            if pos is not None and pos < len(st.items):
+                st.positions[self._sid] = pos + 1
+                st.cond.notify_all()
+                return st.items[pos]
+            error = st.error
+        await self.aclose()
+        if error is not None:
+            raise error
+        raise StopAsyncIteration
+
+    async def aclose(self) -> None:
+        self._finalizer()
+
+
+class StreamFanout:
+    def __init__(self, route: str, max_lag: int = SINGLEFLIGHT_MAX_LAG):
+        self.route = route
+        self.max_lag = max(1, max_lag)
+        self._streams: Dict[str, _Stream] = {}
+    def in_flight(self) -> int:
+        return len(self._streams)
+
+    def has(self, key: str) -> bool:
+        return key in self._streams
+
+    def subscribe(
+        self,
+        key: str,
+        factory: Callable[[], AsyncIterator[Any]],
+        on_done: Optional[Callable[[], None]] = None,
+    ) -> AsyncIterator[Any]:
+        """
+        同步決定 leader / follower（中間沒有 await），回傳這個訂閱者的 token iterator。
+        on_done 只在自己是 leader 時使用：底層 generation 結束（含失敗 / 取消）時呼叫一次；
+        follower 的 on_done 會立刻被呼叫（例如把事先拿的 scheduler slot 還回去）。
+        """
+        st = self._streams.get(key)
+        if st is None:
+            st = _Stream()
+            self._streams[key] = st
+            st.task = asyncio.ensure_future(self._pump(key, st, factory))
+            if on_done is not None:
+                # 用 done callback：就算 task 還沒開始跑就被 cancel 也保證會呼叫
+                st.task.add_done_callback(lambda _t: on_done())
+            SINGLEFLIGHT_REQUESTS.labels(self.route, "leader").inc()
+        else:
+            SINGLEFLIGHT_REQUESTS.labels(self.route, "follower").inc()
+            if on_done is not None:
+                on_done()
+        return _Subscription(st)
+
+    async def _pump(self, key: str, st: _Stream, factory: Callable[[], AsyncIterator[Any]]) -> None:
+        try:
+            async with aclosing(factory()) as items:
+                async for item in items:
+                    async with st.cond:
+                        # 最慢的訂閱者追上來之前不再讀 upstream
+                        while st.positions and st.lag() >= self.max_lag:
+                            await st.cond.wait()
+                        st.items.append(item)
+                        st.cond.notify_all()
+        except asyncio.CancelledError:
+            st.error = asyncio.CancelledError()
+        except Exception as e:
+            st.error = e
+        finally:
+            # 先從表上拿掉：之後進來的同樣請求會開新的 generation
+            if self._streams.get(key) is st:
+                del self._streams[key]
+            async with st.cond:
+                st.done = True
+                st.cond.notify_all()
@@ -1,91 +1,233 @@
 from __future__ import annotations
 
+import os
+import re
 import sqlite3
 import json
+import threading
 import time
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterable, Optional, Tuple
 
 # ============================================================
-# v0.1 過渡版的 store.py
-# 目標：避免 hybrid-engine 因向量庫 schema 不完整而 500
-#       → 暫時不啟用 RAG，只存單純 notes 記錄
+# notes store：/bridge 的筆記，也是 /bridge/ask RAG（core/rag.py）的關鍵字檢索來源
+# - 只存單純 notes 記錄，不放向量；向量檢索（search_by_vector）v0.1 還沒有 schema，
+#   先回空 list，RAG 會只用 FTS5 + KC 的候選
+#
+# - 每個 thread 一條長駐連線（threading.local），PRAGMA 只在開連線時下一次
+# - schema 在 process 第一次連線時建立（含 FTS5 全文索引 notes_fts 與同步用 trigger）
+# - SQLite 沒編 FTS5 時 search_notes 退回 LIKE
+# - list_notes 用 keyset 分頁（before_id），不用 OFFSET
 # ============================================================
 
-DB_PATH = Path("/srv/cockswain-core/var/knowledge/notes.sqlite3")
+DB_PATH = Path(os.getenv("HE_NOTES_DB", "/srv/cockswain-core/var/knowledge/notes.sqlite3"))
 DB_PATH.parent.mkdir(parents=True, exist_ok=True)
 
+# unicode61 以空白 / 標點斷詞；中文筆記多的話用 trigram（任意 3 字以上的子字串都查得到）
+FTS_TOKENIZER = os.getenv("HE_NOTES_FTS_TOKENIZER", "unicode61")
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = False
+_fts_enabled = False
+
 
 # ------------------------------------------------------------
 # Internal: get sqlite connection
 # ------------------------------------------------------------
-def _get_conn():
-    conn = sqlite3.connect(str(DB_PATH))
+def _get_conn() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        return conn
+    # check_same_thread=False：FastAPI 的 async endpoint 都在 event loop thread，
+    # sync endpoint 在 threadpool；每條連線還是只給建立它的 thread 用
+    conn = sqlite3.connect(str(DB_PATH), check_same_thread=False)
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA journal_mode=WAL")
     conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    _ensure_schema(conn)
+    _local.conn = conn
     return conn
 
 
+def close_conn() -> None:
+    """關掉目前 thread 的連線（測試 / 換 DB_PATH 時用）"""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
 # ------------------------------------------------------------
 # Init DB
 # ------------------------------------------------------------
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
+    text, content='notes', content_rowid='id', tokenize='{tokenizer}'
+);
+CREATE TRIGGER IF NOT EXISTS notes_ai AFTER INSERT ON notes BEGIN
+    INSERT INTO notes_fts(rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS notes_ad AFTER DELETE ON notes BEGIN
+    INSERT INTO notes_fts(notes_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+CREATE TRIGGER IF NOT EXISTS notes_au AFTER UPDATE OF text ON notes BEGIN
+    INSERT INTO notes_fts(notes_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    INSERT INTO notes_fts(rowid, text) VALUES (new.id, new.text);
+END;
+"""
+
+
+def _ensure_schema(conn: sqlite3.Connection) -> None:
+    global _schema_ready, _fts_enabled
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        with conn:
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS notes (
+                    id   INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ts   INTEGER NOT NULL,
+                    role TEXT    NOT NULL,
+                    text TEXT    NOT NULL,
+                    meta TEXT    NULL
+                );
+                """
+            )
+        try:
+            existed = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='notes_fts'"
+            ).fetchone()
+            with conn:
+                conn.executescript(_FTS_SCHEMA.format(tokenizer=FTS_TOKENIZER))
+                if not existed:
+                    # 既有的 notes 補進索引
+                    conn.execute("INSERT INTO notes_fts(notes_fts) VALUES ('rebuild')")
+            _fts_enabled = True
+        except sqlite3.OperationalError:
+            # SQLite 沒有 FTS5（或不認得 tokenizer）：照樣可以存，只是搜尋退回 LIKE
+            _fts_enabled = False
+        _schema_ready = True
+
+
 def init_db():
-    with _get_conn() as c:
-        c.executescript(
-            """
-            CREATE TABLE IF NOT EXISTS notes (
-                id   INTEGER PRIMARY KEY AUTOINCREMENT,
-                ts   INTEGER NOT NULL,
-                role TEXT    NOT NULL,
-                text TEXT    NOT NULL,
-                meta TEXT    NULL
-            );
-            """
-        )
+    _get_conn()
 
 
 # ------------------------------------------------------------
 # Add note
 # ------------------------------------------------------------
+def _row(role: str, text: str, meta: Optional[Dict[str, Any]], ts: int) -> Tuple[int, str, str, str]:
+    return (ts, role, text, json.dumps(meta or {}, ensure_ascii=False))
+
+
 def add_note(role: str, text: str, meta: Optional[Dict[str, Any]] = None) -> int:
-    ts = int(time.time())
-    meta_json = json.dumps(meta or {}, ensure_ascii=False)
-    with _get_conn() as c:
+    c = _get_conn()
+    with c:
         cur = c.execute(
             "INSERT INTO notes (ts, role, text, meta) VALUES (?, ?, ?, ?)",
-            (ts, role, text, meta_json),
+            _row(role, text, meta, int(time.time())),
         )
         return int(cur.lastrowid)
 
 
+def add_notes(notes: Iterable[Tuple[str, str, Optional[Dict[str, Any]]]]) -> List[int]:
+    """
+    一次寫多筆（同一個 transaction、一次 commit）；回傳依序的 note id。
+    notes 是 (role, text, meta) 的序列。
+    """
+    ts = int(time.time())
+    c = _get_conn()
+    ids: List[int] = []
+    with c:
+        for role, text, meta in notes:
+            cur = c.execute(
+                "INSERT INTO notes (ts, role, text, meta) VALUES (?, ?, ?, ?)",
+                _row(role, text, meta, ts),
+            )
+            ids.append(int(cur.lastrowid))
+    return ids
+
+
 # ------------------------------------------------------------
 # Query notes (simple)
 # ------------------------------------------------------------
-def list_notes(limit: int = 50) -> List[Dict[str, Any]]:
-    with _get_conn() as c:
+def _to_dict(r: sqlite3.Row) -> Dict[str, Any]:
+    try:
+        meta_obj = json.loads(r["meta"]) if r["meta"] else {}
+    except Exception:
+        meta_obj = {}
+    return {
+        "id": r["id"],
+        "ts": r["ts"],
+        "role": r["role"],
+        "text": r["text"],
+        "meta": meta_obj,
+    }
+
+
+def list_notes(limit: int = 50, before_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    新到舊；下一頁把這頁最後一筆的 id 當 before_id 傳回來（keyset，走 PK 不掃前面的列）
+    """
+    c = _get_conn()
+    if before_id is None:
         rows = c.execute(
             "SELECT id, ts, role, text, meta FROM notes ORDER BY id DESC LIMIT ?",
             (limit,),
         ).fetchall()
+    else:
+        rows = c.execute(
+            "SELECT id, ts, role, text, meta FROM notes WHERE id < ? ORDER BY id DESC LIMIT ?",
+            (before_id, limit),
+        ).fetchall()
+    return [_to_dict(r) for r in rows]
 
-        out: List[Dict[str, Any]] = []
-        for r in rows:
-            try:
-                meta_obj = json.loads(r["meta"]) if r["meta"] else {}
-            except Exception:
-                meta_obj = {}
-
-            out.append(
-                {
-                    "id": r["id"],
-                    "ts": r["ts"],
-                    "role": r["role"],
-                    "text": r["text"],
-                    "meta": meta_obj,
-                }
-            )
-        return out
+
+# ------------------------------------------------------------
+# Keyword search (FTS5)
+# ------------------------------------------------------------
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _fts_query(text: str) -> str:
+    # 使用者輸入不直接當 FTS5 語法：每個詞加引號再 OR 起來，排名交給 bm25
+    terms = _TERM_RE.findall(text)
+    if FTS_TOKENIZER.startswith("trigram"):
+        terms = [t for t in terms if len(t) >= 3]
+    return " OR ".join('"' + t.replace('"', '""') + '"' for t in terms)
+
+
+def search_notes(query: str, k: int = 5) -> List[Dict[str, Any]]:
+    c = _get_conn()
+    match = _fts_query(query) if _fts_enabled else ""
+    if match:
+        rows = c.execute(
+            """
+            SELECT n.id, n.ts, n.role, n.text, n.meta, bm25(notes_fts) AS score
+            FROM notes_fts JOIN notes n ON n.id = notes_fts.rowid
+            WHERE notes_fts MATCH ?
+            ORDER BY score
+            LIMIT ?
+            """,
+            (match, k),
+        ).fetchall()
+        # bm25 越小越相關；對外給「越大越好」
+        return [{**_to_dict(r), "score": -float(r["score"])} for r in rows]
+
+    terms = _TERM_RE.findall(query)[:8]
+    if not terms:
+        return []
+    where = " OR ".join("text LIKE ?" for _ in terms)
+    rows = c.execute(
+        f"SELECT id, ts, role, text, meta FROM notes WHERE {where} ORDER BY id DESC LIMIT ?",
+        [f"%{t}%" for t in terms] + [k],
+    ).fetchall()
+    return [{**_to_dict(r), "score": 0.0} for r in rows]
 
 
 # ------------------------------------------------------------
@@ -93,8 +235,7 @@ def list_notes(limit: int = 50) -> List[Dict[str, Any]]:
 # ------------------------------------------------------------
 def search_by_vector(vec, k: int = 5) -> List[Dict[str, Any]]:
     """
-    v0.1 暫時關閉 RAG：
-    - 不使用向量資料庫
-    - 直接回傳空陣列，避免 schema 問題 (v.vec_json not exists)
+    v0.1 還沒有向量資料表（v.vec_json 不存在）：
+    - 直接回傳空陣列；RAG 的候選只來自 search_notes 與 KC，rerank 時才算 embedding
     """
     return []
@@ -0,0 +1,98 @@
+"""
+LLM 串流回應：client 斷線就立刻停掉上游 generation。
+
+Starlette 的 StreamingResponse 在 ASGI spec 2.4（新版 uvicorn）下只有「寫下一個 chunk 失敗」
+才會發現 client 走了，而且不會 aclose() body iterator，上游的 Ollama 串流要等 GC 才關。
+prompt eval 很久還沒吐第一個 token 時，斷線的 client 還會白白佔著 scheduler slot。
+
+CancellableStreamingResponse：
+- 另開一個 task 聽 http.disconnect，一收到就 cancel 正在跑的串流
+- 每次 send 最多等 HE_STREAM_SEND_TIMEOUT 秒；client 讀太慢（socket buffer 滿、uvicorn flow control
+  卡住）就當成斷線，不讓一個慢 client 無限期佔著 slot（0 = 不限）
+- 一次只往下拉一個 chunk：上游只在前一個 chunk 送出去之後才會被讀，token 不會在記憶體裡堆積
+- 結束時一定 aclose() body iterator，整條 generator 鏈的 finally（還 slot、關上游連線）馬上跑
+
+/metrics：he_stream_aborted_total{route, reason}；上游實際被取消的 generation 與省下的 token
+記在 core/llm_metrics（he_llm_cancelled_total、he_llm_saved_tokens_total）。
+"""
+import asyncio
+import os
+from typing import Any, Optional
+
+from prometheus_client import Counter
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+STREAM_SEND_TIMEOUT = float(os.getenv("HE_STREAM_SEND_TIMEOUT", "30"))
+
+STREAM_ABORTED = Counter(
+    "he_stream_aborted_total",
+    "Streaming responses stopped early because the client went away",
+    ["route", "reason"],
+)
+
+
+class _SlowClient(Exception):
+    pass
+
+
+class CancellableStreamingResponse(StreamingResponse):
+    def __init__(self, content: Any, *, route: str, send_timeout: Optional[float] = None, **kwargs: Any):
+        super().__init__(content, **kwargs)
+        self.route = route
+        self.send_timeout = STREAM_SEND_TIMEOUT if send_timeout is None else send_timeout
+
+    async def _send(self, send: Send, message: dict) -> None:
+        if self.send_timeout <= 0:
+            await send(message)
+            return
+        try:
+            await asyncio.wait_for(send(message), self.send_timeout)
+        except asyncio.TimeoutError:
+            raise _SlowClient() from None
+
+    async def stream_response(self, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        async for chunk in self.body_iterator:
+            if not isinstance(chunk, (bytes, memoryview)):
+                chunk = chunk.encode(self.charset)
+            await self._send(send, {"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await super().__call__(scope, receive, send)
+            return
+
+        streaming = asyncio.ensure_future(self.stream_response(send))
+        watcher = asyncio.ensure_future(self.listen_for_disconnect(receive))
+        reason = None
+        try:
+            await asyncio.wait({streaming, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if not streaming.done():
+                reason = "disconnect"
+                streaming.cancel()
+            try:
+                await streaming
+            except asyncio.CancelledError:
+                if reason is None:
+                    raise
+            except _SlowClient:
+                reason = "slow_client"
+            except OSError:
+                reason = "disconnect"
+        finally:
+            watcher.cancel()
+            if not streaming.done():
+                # 自己被 cancel（例如 server 關機）：先等串流 task 收完，才能 aclose generator
+                streaming.cancel()
+                await asyncio.wait({streaming})
+            aclose = getattr(self.body_iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+        if reason is not None:
+            STREAM_ABORTED.labels(self.route, reason).inc()
+            return
+        if self.background is not None:
+            await self.background()
@@ -1,10 +1,22 @@
 from __future__ import annotations
 
-from fastapi import APIRouter
-from pydantic import BaseModel
+import json
+import logging
+import time
+from contextlib import aclosing
+
+from fastapi import APIRouter, Header, HTTPException, Query
+from pydantic import BaseModel, Field
 from typing import Any, Dict, List, Optional
 
-from hybrid_engine.core.store import add_note, list_notes, search_by_vector
+from hybrid_engine.clients.ollama_client import OllamaClient
+from hybrid_engine.core import rag
+from hybrid_engine.core.config import get_rag_config
+from hybrid_engine.core.scheduler import AdmissionRejected, admit_stream, get_scheduler
+from hybrid_engine.core.store import add_note, add_notes, list_notes
+from hybrid_engine.core.streaming import CancellableStreamingResponse
+
+log = logging.getLogger(__name__)
 
 # 這個 router 會掛在 /bridge 底下
 router = APIRouter(prefix="/bridge", tags=["bridge"])
@@ -19,8 +31,14 @@ class NoteBody(BaseModel):
     meta: Optional[Dict[str, Any]] = None
 
 
+class NotesBatchBody(BaseModel):
+    notes: List[NoteBody] = Field(..., min_length=1, max_length=1000)
+
+
 class AskBody(BaseModel):
     msg: str
+    stream: bool = False
+    k: Optional[int] = Field(default=None, ge=1, le=50)
 
 
 # ------------------------------
@@ -33,30 +51,87 @@ async def note(body: NoteBody) -> Dict[str, Any]:
 
 
 # ------------------------------
-# /bridge/ask : v0.1 測試版
+# /bridge/notes:batch : 一次記多筆（單一 transaction）
 # ------------------------------
-@router.post("/ask")
-async def ask(body: AskBody) -> Dict[str, Any]:
-    """
-    v0.1 過渡版：
+@router.post("/notes:batch")
+async def notes_batch(body: NotesBatchBody) -> Dict[str, Any]:
+    ids = add_notes((n.role, n.text, n.meta or {}) for n in body.notes)
+    return {"ok": True, "note_ids": ids}
 
-    - 不啟用真正的 RAG
-    - 不一定要呼叫本地 LLM（之後再接 Ollama / 其他微服務）
-    - 目前只回一段 echo-style 回覆，確認整條 HTTP 管線正常
-    """
 
-    text = body.msg
+# ------------------------------
+# /bridge/notes : 新到舊分頁（keyset：下一頁帶 before=next_before）
+# ------------------------------
+@router.get("/notes")
+async def notes(
+    limit: int = Query(default=50, ge=1, le=500),
+    before: Optional[int] = Query(default=None, ge=1),
+) -> Dict[str, Any]:
+    items = list_notes(limit=limit, before_id=before)
+    next_before = items[-1]["id"] if len(items) == limit else None
+    return {"ok": True, "notes": items, "next_before": next_before}
 
-    # 目前 search_by_vector 會直接回 []
-    hits: List[Dict[str, Any]] = search_by_vector([], k=5)
 
-    answer = (
-        f"【混合引擎 v0.1 測試回應】已收到訊息：「{text}」。"
-        f"目前先確認服務管線正常，RAG 與本地模型之後再啟用。"
-    )
+# ------------------------------
+# /bridge/ask : RAG（檢索 notes / KC → 組 context → 本地模型回答）
+# ------------------------------
+@router.post("/ask")
+async def ask(
+    body: AskBody,
+    x_priority: Optional[str] = Header(default=None),
+):
+    """
+    pipeline 見 core/rag.py；每個 stage 的秒數放在 timings。
 
-    return {
-        "ok": True,
-        "answer": answer,
-        "hits": hits,
+    - stream=false（預設）：{"ok", "answer", "hits", "timings"}
+    - stream=true：NDJSON，第一行 {"type": "context", "hits", "timings"}，
+      接著每個 token 一行 {"type": "token", "text"}，最後 {"type": "done", "timings"}
+    """
+    cfg = get_rag_config()
+    t_start = time.perf_counter()
+    r = await rag.retrieve(body.msg, k=body.k, cfg=cfg)
+    timings = r.timings
+    meta = {"hits": r.hits, "context_tokens": r.context_tokens, "degraded": r.degraded}
+    client = OllamaClient(route="ask")
+    gen_kwargs = {
+        "prompt": r.prompt(), "model": cfg.model, "system": rag.SYSTEM_PROMPT, "max_tokens": cfg.max_tokens,
     }
+
+    if not body.stream:
+        t0 = time.perf_counter()
+        try:
+            async with get_scheduler().slot(cfg.model, x_priority):
+                out = await client.generate(**gen_kwargs)
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            log.exception("ask error: %s", e)
+            raise HTTPException(status_code=502, detail=f"LLM backend error: {type(e).__name__}")
+        timings["ttft_s"] = out["stats"].get("ttft_s")
+        timings["generate_s"] = round(time.perf_counter() - t0, 6)
+        timings["total_s"] = round(time.perf_counter() - t_start, 6)
+        return {"ok": True, "answer": out["text"], **meta, "timings": timings}
+
+    async def lines():
+        yield json.dumps({"type": "context", **meta, "timings": timings}, ensure_ascii=False) + "\n"
+        t0 = time.perf_counter()
+        first = None
+        try:
+            async with aclosing(client.stream_generate(**gen_kwargs)) as tokens:
+                async for token in tokens:
+                    if first is None:
+                        first = time.perf_counter() - t0
+                    yield json.dumps({"type": "token", "text": token}, ensure_ascii=False) + "\n"
+        except Exception as e:
+            log.exception("ask stream error: %s", e)
+            yield json.dumps({"type": "error", "error": type(e).__name__}) + "\n"
+        done = {
+            **timings,
+            "ttft_s": None if first is None else round(first, 6),
+            "generate_s": round(time.perf_counter() - t0, 6),
+            "total_s": round(time.perf_counter() - t_start, 6),
+        }
+        yield json.dumps({"type": "done", "timings": done}, ensure_ascii=False) + "\n"
+
+    source = await admit_stream(cfg.model, x_priority, lines)
+    return CancellableStreamingResponse(source, route="ask", media_type="application/x-ndjson")
@@ -1,6 +1,7 @@
 from fastapi import APIRouter
-import httpx
 from ..core.config import get_llm_config
+from ..core.http import get_http_client
+from ..core.backends import get_backend_pool
 
 router = APIRouter(prefix="/embeddings", tags=["embeddings"])
 
@@ -8,8 +9,10 @@ router = APIRouter(prefix="/embeddings", tags=["embeddings"])
 async def embed(body: dict):
     text = body["text"]
     model = body.get("model", "nomic-embed-text")
-    cfg = get_llm_config()
-    async with httpx.AsyncClient(timeout=cfg.timeout) as client:
-        r = await client.post(f"{cfg.base_url}/api/embeddings", json={"model": model, "prompt": text})
+
+    async def on_backend(b):
+        r = await get_http_client().post(f"{b.url}/api/embeddings", json={"model": model, "prompt": text})
         r.raise_for_status()
         return r.json()
+
+    return await get_backend_pool().call(model, on_backend, get_llm_config().keep_alive)
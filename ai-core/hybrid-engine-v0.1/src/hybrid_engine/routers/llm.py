@@ -1,13 +1,21 @@
 from typing import Optional, Dict, Any
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException
 from pydantic import BaseModel, Field, constr
-from fastapi.responses import StreamingResponse, JSONResponse
+from contextlib import aclosing
 import logging
 from hybrid_engine.clients.ollama_client import OllamaClient
+from hybrid_engine.core.cache import is_deterministic, make_key, serve_cached
+from hybrid_engine.core.singleflight import SingleFlight, StreamFanout, should_coalesce
+from hybrid_engine.core.scheduler import AdmissionRejected, admit_stream, get_scheduler
+from hybrid_engine.core.streaming import CancellableStreamingResponse
 
 log = logging.getLogger(__name__)
 router = APIRouter(prefix="/llm", tags=["llm"])
 
+# 同時進來的相同請求共用一次 generation（見 core/singleflight.py）
+_flights = SingleFlight("complete")
+_stream_flights = StreamFanout("complete_stream")
+
 PromptStr = constr(strip_whitespace=True, min_length=1, max_length=10000)
 
 class CompleteRequest(BaseModel):
@@ -26,22 +34,57 @@ class CompleteResponse(BaseModel):
     stats: Dict[str, Any]
 
 @router.post("/complete", response_model=CompleteResponse)
-async def complete(req: CompleteRequest):
-    client = OllamaClient()
+async def complete(
+    req: CompleteRequest,
+    cache_control: Optional[str] = Header(default=None),
+    x_priority: Optional[str] = Header(default=None),
+):
+    client = OllamaClient()  # 共用 application 的 httpx client，不需要每次關
+    model = req.model or client.cfg.model
+    key_parts = {
+        "model": model,
+        "prompt": req.prompt,
+        "system": req.system,
+        "temperature": req.temperature,
+        "max_tokens": req.max_tokens or client.cfg.max_tokens,
+        "options": req.options,
+    }
+    coalesce = should_coalesce(cache_control)
     try:
         if not req.stream:
-            result = await client.generate(**req.dict())
-            return JSONResponse(result)
+            async def run():
+                # 排隊拿 model slot（X-Priority: interactive / agent / batch，見 core/scheduler.py）
+                async with get_scheduler().slot(model, x_priority):
+                    return await client.generate(**req.dict())
+
+            async def generate():
+                if not coalesce:
+                    return await run()
+                return await _flights.do(make_key("complete", key_parts), run)
+
+            # temperature=0 的請求可命中回應快取（HE_CACHE_ENABLED=1，見 core/cache.py）
+            return await serve_cached(
+                "complete", cache_control, is_deterministic(req.temperature, req.options),
+                key_parts, generate,
+            )
+        source = await admit_stream(
+            model, x_priority, lambda: client.stream_generate(**req.dict(exclude={"stream"})),
+            _stream_flights if coalesce else None, make_key("complete_stream", key_parts),
+        )
         async def token_stream():
             try:
-                async for token in client.stream_generate(**req.dict()):
-                    yield token
+                async with aclosing(source) as tokens:
+                    async for token in tokens:
+                        yield token
             except Exception as e:
                 log.exception("stream error: %s", e)
                 yield "\n[STREAM_ERROR]\n"
-        return StreamingResponse(token_stream(), media_type="text/plain; charset=utf-8")
+        # client 斷線就停掉上游 generation（見 core/streaming.py）
+        return CancellableStreamingResponse(
+            token_stream(), route="complete", media_type="text/plain; charset=utf-8"
+        )
+    except AdmissionRejected:
+        raise
     except Exception as e:
         log.exception("complete error: %s", e)
         raise HTTPException(status_code=502, detail=f"LLM backend error: {type(e).__name__}")
-    finally:
-        await client.close()
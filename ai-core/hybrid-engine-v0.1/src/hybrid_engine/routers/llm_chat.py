@@ -1,7 +1,14 @@
-from fastapi import APIRouter
-import httpx
-from typing import List, Literal, TypedDict
+from fastapi import APIRouter, Header
+from typing import List, Literal, Optional, TypedDict
 from ..core.config import get_llm_config
+from ..core.http import get_http_client
+from ..core.backends import get_backend_pool
+from ..core.llm_metrics import GenerationTimer
+from ..clients.ndjson import aiter_ndjson
+from ..core.cache import is_deterministic, make_key, serve_cached
+from ..core.singleflight import SingleFlight, should_coalesce
+from ..core.scheduler import get_scheduler
+from ..core.sessions import CHAT_SESSION_TURNS, get_session_store
 
 class Msg(TypedDict):
     role: Literal["system","user","assistant"]
@@ -9,22 +16,85 @@ class Msg(TypedDict):
 
 router = APIRouter(prefix="/llm", tags=["llm"])
 
+# 同時進來的相同對話共用一次 generation（見 core/singleflight.py）
+_flights = SingleFlight("chat")
+
 def fold_messages(msgs: List[Msg]) -> str:
     tags = {"system":"[SYS]", "user":"[USER]", "assistant":"[ASSIST]"}
     return "\n".join(f"{tags[m['role']]} {m['content']}" for m in msgs)
 
+async def _generate_on(b, payload: dict) -> dict:
+    # 內部用串流收，才量得到 TTFT / token 間隔（core/llm_metrics.py）；回給呼叫端的還是整段文字
+    timer = GenerationTimer("chat", payload["model"])
+    chunks, context = [], None
+    async with get_http_client().stream("POST", f"{b.url}/api/generate", json=payload) as r:
+        r.raise_for_status()
+        async for data in aiter_ndjson(r):
+            if not isinstance(data, dict): continue
+            if data.get("response"):
+                timer.token()
+                chunks.append(data["response"])
+            if data.get("done"):
+                timer.finish(data)
+                context = data.get("context")
+                break
+    return {"text": "".join(chunks), "context": context, "backend": b.name}
+
+async def _session_turn(session_id: str, msgs: List[Msg], payload: dict, x_priority: Optional[str]) -> dict:
+    """
+    有 session_id 的對話：只把新的 turn 連同上一輪的 context 送上去（見 core/sessions.py）。
+    有狀態，所以不走回應快取 / single-flight。
+    """
+    session = get_session_store().get(session_id)
+    async with session.lock:
+        send, context = session.plan(payload["model"], msgs)
+        upstream = {**payload, "prompt": fold_messages(send)}
+        if context is not None:
+            upstream["context"] = context
+        async with get_scheduler().slot(payload["model"], x_priority):
+            out = await get_backend_pool().call(
+                payload["model"], lambda b: _generate_on(b, upstream), payload["keep_alive"], prefer=session.backend
+            )
+        session.commit(payload["model"], msgs, out["text"], out["context"], out["backend"])
+    mode = "full" if context is None else "incremental"
+    CHAT_SESSION_TURNS.labels(mode).inc()
+    return {"model": payload["model"], "text": out["text"], "session_id": session_id, "session_mode": mode}
+
 @router.post("/chat")
-async def chat(body: dict):
+async def chat(
+    body: dict,
+    cache_control: Optional[str] = Header(default=None),
+    x_priority: Optional[str] = Header(default=None),
+):
     cfg = get_llm_config()
     msgs: List[Msg] = body["messages"]
     payload = {
         "model": body.get("model", cfg.model),
-        "prompt": fold_messages(msgs),
         "keep_alive": cfg.keep_alive,
-        "options": body.get("options", {"temperature":0.2, "num_predict":512})
+        "options": body.get("options", {"temperature":0.2, "num_predict":512}),
     }
-    async with httpx.AsyncClient(timeout=cfg.timeout) as client:
-        r = await client.post(f"{cfg.base_url}/api/generate", json=payload)
-        r.raise_for_status()
-        data = r.json()
-        return {"model": payload["model"], "text": data.get("response", data)}
+
+    if body.get("session_id"):
+        return await _session_turn(str(body["session_id"]), msgs, payload, x_priority)
+    payload["prompt"] = fold_messages(msgs)
+
+    async def call_ollama():
+        async with get_scheduler().slot(payload["model"], x_priority):
+            out = await get_backend_pool().call(payload["model"], lambda b: _generate_on(b, payload), payload["keep_alive"])
+        return {"model": payload["model"], "text": out["text"]}
+
+    key_parts = {"model": payload["model"], "prompt": payload["prompt"], "options": payload["options"]}
+
+    async def generate():
+        if not should_coalesce(cache_control):
+            return await call_ollama()
+        return await _flights.do(make_key("chat", key_parts), call_ollama)
+
+    return await serve_cached(
+        "chat", cache_control, is_deterministic(None, payload["options"]), key_parts, generate
+    )
+
+
+@router.delete("/chat/sessions/{session_id}")
+async def drop_session(session_id: str):
+    return {"session_id": session_id, "dropped": get_session_store().drop(session_id)}
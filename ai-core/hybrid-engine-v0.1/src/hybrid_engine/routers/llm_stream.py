@@ -1,12 +1,27 @@
-from fastapi import APIRouter
-from fastapi.responses import StreamingResponse
-import httpx, json
+from fastapi import APIRouter, Header
+from typing import Optional
+import asyncio
+import json
 from ..core.config import get_llm_config
+from ..core.http import get_http_client
+from ..core.backends import get_backend_pool
+from ..core.llm_metrics import GenerationTimer
+from ..core.streaming import CancellableStreamingResponse
+from ..core.cache import make_key
+from ..core.singleflight import StreamFanout, should_coalesce
+from ..core.scheduler import admit_stream
 
 router = APIRouter(prefix="/llm", tags=["llm"])
 
+# 同時進來的相同串流請求共用一次 generation，token 扇出給每個訂閱者
+_flights = StreamFanout("stream")
+
 @router.post("/stream")
-async def llm_stream(body: dict):
+async def llm_stream(
+    body: dict,
+    cache_control: Optional[str] = Header(default=None),
+    x_priority: Optional[str] = Header(default=None),
+):
     cfg = get_llm_config()
     payload = {
         "model": body.get("model", cfg.model),
@@ -16,9 +31,10 @@ async def llm_stream(body: dict):
         "stream": True
     }
 
-    async def gen():
-        async with httpx.AsyncClient(timeout=cfg.timeout) as client:
-            async with client.stream("POST", f"{cfg.base_url}/api/generate", json=payload) as r:
+    async def on_backend(b, timer):
+        try:
+            async with get_http_client().stream("POST", f"{b.url}/api/generate", json=payload) as r:
+                r.raise_for_status()
                 async for line in r.aiter_lines():
                     if not line:
                         continue
@@ -27,9 +43,24 @@ async def llm_stream(body: dict):
                         data = json.loads(line)
                         chunk = data.get("response") or data.get("message", {}).get("content") or ""
                         if chunk:
+                            timer.token()
                             yield json.dumps({"text": chunk}, ensure_ascii=False) + "\n"
+                        if data.get("done"):
+                            timer.finish(data)
                     except json.JSONDecodeError:
                         # 保底直接透傳原始行
                         yield line + "\n"
+        except (asyncio.CancelledError, GeneratorExit):
+            # client 斷線：離開 async with 就關掉上游連線
+            timer.cancel(payload["options"].get("num_predict"))
+            raise
+
+    def gen():
+        # 拿到 slot 之後才開始計時：TTFT 不含排隊時間（排隊另有 he_scheduler_wait_seconds）
+        timer = GenerationTimer("stream", payload["model"])
+        # 第一個 token 之前連不上 / 5xx 會換下一個後端（見 core/backends.py）
+        return get_backend_pool().stream(payload["model"], lambda b: on_backend(b, timer), payload["keep_alive"])
 
-    return StreamingResponse(gen(), media_type="application/x-ndjson")
+    fanout = _flights if should_coalesce(cache_control) else None
+    source = await admit_stream(payload["model"], x_priority, gen, fanout, make_key("stream", payload))
+    return CancellableStreamingResponse(source, route="stream", media_type="application/x-ndjson")
@@ -1,9 +1,35 @@
 from fastapi import FastAPI
 from typing import Optional, List
 from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
-from fastapi.responses import Response
+from fastapi.responses import JSONResponse, Response
+from contextlib import asynccontextmanager
+from hybrid_engine.core.http import lifespan as http_lifespan
+from hybrid_engine.core.backends import get_backend_pool
+from hybrid_engine.core.scheduler import AdmissionRejected
+from hybrid_engine.client_memory import get_memory_sink
 
-app = FastAPI(title="Cockswain Hybrid Engine", version="0.1.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 共用的 httpx.AsyncClient（core/http.py）+ LLM 後端的背景 health check（core/backends.py）
+    # + Memory Keeper 的背景 append buffer（client_memory.py）
+    async with http_lifespan(app):
+        pool = get_backend_pool()
+        pool.start()
+        try:
+            yield
+        finally:
+            await pool.stop()
+            # Memory Keeper 背景 buffer 裡還沒送的，關 http client 之前送完
+            await get_memory_sink().close()
+
+app = FastAPI(title="Cockswain Hybrid Engine", version="0.1.0", lifespan=lifespan)
+
+@app.exception_handler(AdmissionRejected)
+async def _admission_rejected(request, exc: AdmissionRejected):
+    # LLM 排隊被拒：429（隊伍滿）/ 503（等太久或預估等太久），帶 Retry-After
+    return JSONResponse(
+        status_code=exc.status_code, content={"detail": f"LLM queue: {exc.reason}"}, headers=exc.headers
+    )
 
 @app.get("/health")
 def health():
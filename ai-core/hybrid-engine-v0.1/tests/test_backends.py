@@ -0,0 +1,137 @@
+import asyncio
+
+import httpx
+import pytest
+
+from hybrid_engine.core.backends import BackendPool
+from hybrid_engine.core.config import BackendConfig, BackendPoolConfig
+
+
+def _pool(*names, **kw):
+    backends = [BackendConfig(name=n, url=f"http://{n}:11434") for n in names]
+    return BackendPool(BackendPoolConfig(backends=backends, health_interval=0, **kw))
+
+
+def _fake_ollama(down=()):
+    """每個 host 一台假的 Ollama；down 裡的 host 連不上"""
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.url.host)
+        if request.url.host in down:
+            raise httpx.ConnectError("connection refused", request=request)
+        return httpx.Response(200, json={"response": request.url.host, "done": True})
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler)), calls
+
+
+async def _generate(client, b):
+    r = await client.post(f"{b.url}/api/generate", json={"model": "m"})
+    r.raise_for_status()
+    return r.json()["response"]
+
+
+def test_fails_over_and_ejects_unreachable_backend():
+    async def main():
+        pool = _pool("a", "b", eject_after=1)
+        client, calls = _fake_ollama(down={"a"})
+        first = await pool.call("m", lambda b: _generate(client, b))
+        second = await pool.call("m", lambda b: _generate(client, b))
+        return first, second, calls, pool.stats()
+
+    first, second, calls, stats = asyncio.run(main())
+    assert first == second == "b"
+    # a 失敗一次就被踢出，第二次直接走 b
+    assert calls == ["a", "b", "b"]
+    assert [s["available"] for s in stats] == [False, True]
+
+
+def test_prefers_warm_backend_then_least_in_flight():
+    pool = _pool("a", "b", "c")
+    a, b, c = pool.backends
+    pool.mark_success(c, "llama3", "5m")
+    assert pool.pick("llama3") is c
+    assert pool.pick("llama3:latest") is c
+
+    # 其他 model 沒有 warm 的後端：挑 in-flight 最少的
+    a.in_flight, b.in_flight, c.in_flight = 2, 0, 1
+    assert pool.pick("phi3") is b
+    # warm 優先於負載
+    assert pool.pick("llama3") is c
+
+
+def test_model_list_restricts_candidates():
+    pool = BackendPool(BackendPoolConfig(
+        backends=[
+            BackendConfig(name="big", url="http://big:11434", models=["llama3.1:70b"]),
+            BackendConfig(name="small", url="http://small:11434", models=["phi3"]),
+        ],
+        health_interval=0,
+    ))
+    assert pool.pick("phi3").name == "small"
+    assert pool.pick("llama3.1:70b").name == "big"
+
+
+def test_stream_fails_over_only_before_first_item():
+    async def main():
+        pool = _pool("a", "b", eject_after=5)
+
+        def fn(b):
+            async def gen():
+                if b.name == "a":
+                    raise httpx.ConnectError("refused")
+                yield "x"
+                if b.name == "b":
+                    raise httpx.RemoteProtocolError("peer closed")
+            return gen()
+
+        got = []
+        with pytest.raises(httpx.RemoteProtocolError):
+            async for item in pool.stream("m", fn):
+                got.append(item)
+        return got, pool.backends
+
+    got, (a, b) = asyncio.run(main())
+    assert got == ["x"]
+    assert a.failures == 1 and b.failures == 1
+    assert a.in_flight == b.in_flight == 0
+
+
+def test_health_check_reads_loaded_models_and_restores_backend(monkeypatch):
+    async def main():
+        pool = _pool("a", eject_after=1)
+        a = pool.backends[0]
+        pool.mark_failure(a, RuntimeError("boom"))
+        assert a.ejected_until > 0
+
+        def handler(request):
+            return httpx.Response(200, json={"models": [{"name": "phi3:latest"}]})
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        monkeypatch.setattr("hybrid_engine.core.backends.get_http_client", lambda: client)
+        ok = await pool.check(a)
+        return ok, pool.stats()[0]
+
+    ok, stats = asyncio.run(main())
+    assert ok and stats["available"]
+    assert stats["warm"] == ["phi3:latest"]
+
+
+def test_backends_from_env(monkeypatch):
+    monkeypatch.setenv("HE_BACKENDS", '[{"name": "a", "url": "http://a:11434", "models": ["m"]}]')
+    (b,) = BackendPoolConfig().backends
+    assert (b.name, b.url, b.models) == ("a", "http://a:11434", ["m"])
+
+
+@pytest.mark.parametrize("raw", ["not json", "{}", "[]", '[{"url": "http://a:11434"}]', "[1]"])
+def test_bad_backends_env_fails_fast(monkeypatch, raw):
+    monkeypatch.setenv("HE_BACKENDS", raw)
+    with pytest.raises(ValueError, match="invalid HE_BACKENDS"):
+        BackendPoolConfig()
+
+
+def test_missing_backends_file_fails_fast(monkeypatch, tmp_path):
+    monkeypatch.delenv("HE_BACKENDS", raising=False)
+    monkeypatch.setenv("HE_BACKENDS_FILE", str(tmp_path / "nope.json"))
+    with pytest.raises(ValueError, match="cannot read HE_BACKENDS_FILE"):
+        BackendPoolConfig()
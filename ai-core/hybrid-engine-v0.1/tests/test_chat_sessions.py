@@ -0,0 +1,67 @@
+import json
+
+import httpx
+from fastapi.testclient import TestClient
+
+from hybrid_engine.core import http
+from hybrid_engine.core.config import ChatSessionConfig
+from hybrid_engine.core.sessions import SessionStore
+from hybrid_engine.routes import app
+
+
+class FakeOllama:
+    """context 就是「已經 evaluate 過的 token」：每個字一個 token，prompt_eval_count 只算新送的 prompt"""
+
+    def __init__(self):
+        self.requests = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        self.requests.append(body)
+        reply = f"reply{len(self.requests)}"
+        context = list(body.get("context") or []) + [ord(c) for c in body["prompt"] + reply]
+        done = {"response": "", "done": True, "context": context, "prompt_eval_count": len(body["prompt"])}
+        lines = [{"response": reply}, done]
+        return httpx.Response(200, content="".join(json.dumps(x) + "\n" for x in lines).encode())
+
+
+def test_session_sends_only_new_turn_with_previous_context():
+    fake = FakeOllama()
+    history = [{"role": "system", "content": "be brief"}]
+    modes, prompt_tokens = [], []
+    with TestClient(app) as c:
+        http._client = httpx.AsyncClient(transport=httpx.MockTransport(fake))
+        for turn in range(4):
+            history.append({"role": "user", "content": f"question {turn}"})
+            r = c.post("/llm/chat", json={"model": "m", "session_id": "s1", "messages": history}).json()
+            assert r["session_id"] == "s1"
+            modes.append(r["session_mode"])
+            prompt_tokens.append(len(fake.requests[-1]["prompt"]))
+            history.append({"role": "assistant", "content": r["text"]})
+
+        # 改過歷史 → 對不上前綴，整段重送
+        edited = history[:2] + [{"role": "user", "content": "something else"}]
+        assert c.post("/llm/chat", json={"model": "m", "session_id": "s1", "messages": edited}).json()["session_mode"] == "full"
+        assert c.delete("/llm/chat/sessions/s1").json()["dropped"] is True
+
+    assert modes == ["full", "incremental", "incremental", "incremental"]
+    assert fake.requests[1]["prompt"] == "[USER] question 1"
+    assert fake.requests[3]["context"][-len("reply3"):] == [ord(ch) for ch in "reply3"]
+    # 每輪送上去的 prompt 不隨對話長度成長
+    assert len(set(prompt_tokens[1:])) == 1
+    assert "context" not in fake.requests[4]
+
+
+def test_store_is_bounded_lru_with_idle_eviction(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("hybrid_engine.core.sessions.time.monotonic", lambda: now[0])
+    store = SessionStore(ChatSessionConfig(max_sessions=2, idle_seconds=60))
+    store.get("a")
+    store.get("b")
+    store.get("a")
+    store.get("c")  # 超過上限：丟最久沒用的 b
+    assert sorted(store._sessions) == ["a", "c"]
+
+    now[0] += 61
+    store.get("d")  # a、c 都閒置太久
+    assert list(store._sessions) == ["d"]
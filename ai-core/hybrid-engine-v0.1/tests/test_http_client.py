@@ -0,0 +1,14 @@
+from fastapi.testclient import TestClient
+
+from hybrid_engine.core import http
+from hybrid_engine.routes import app
+
+
+def test_lifespan_shares_and_closes_client():
+    with TestClient(app) as c:
+        assert c.get("/health").status_code == 200
+        client = http._client
+        assert client is not None and not client.is_closed
+        assert http.get_http_client() is client
+    assert client.is_closed
+    assert http._client is None
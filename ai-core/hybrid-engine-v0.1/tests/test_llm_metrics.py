@@ -0,0 +1,68 @@
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from hybrid_engine.core import http, llm_metrics
+from hybrid_engine.core.llm_metrics import GenerationTimer
+from hybrid_engine.routes import app
+
+_DONE = (
+    b'{"response":"","done":true,"load_duration":2500000000,"prompt_eval_count":7,'
+    b'"eval_count":20,"eval_duration":500000000}\n'
+)
+
+
+def _sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+@pytest.fixture(autouse=True)
+def configured_models(monkeypatch):
+    monkeypatch.setattr(llm_metrics, "known_models", lambda: frozenset({"m:latest"}))
+
+
+def test_timer_records_ttft_gaps_and_ollama_stats():
+    labels = {"route": "unit", "model": "m"}
+    timer = GenerationTimer("unit", "m")
+    for _ in range(3):
+        timer.token()
+    timer.finish({"load_duration": 2_000_000_000, "prompt_eval_count": 5,
+                  "eval_count": 40, "eval_duration": 1_000_000_000})
+    timer.finish({"eval_count": 40})  # 重複呼叫不重算
+
+    assert _sample("he_llm_ttft_seconds_count", **labels) == 1
+    assert _sample("he_llm_inter_token_seconds_count", **labels) == 2
+    assert _sample("he_llm_request_seconds_count", **labels) == 1
+    assert _sample("he_llm_load_seconds_sum", **labels) == 2.0
+    assert _sample("he_llm_tokens_per_second_sum", **labels) == 40.0
+    assert _sample("he_llm_tokens_total", kind="eval", **labels) == 40
+    assert _sample("he_llm_tokens_total", kind="prompt", **labels) == 5
+
+
+def test_all_llm_routes_export_latency_metrics():
+    def handler(request):
+        return httpx.Response(200, content=b'{"response":"a"}\n{"response":"b"}\n' + _DONE)
+
+    with TestClient(app) as c:
+        http._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        before = {r: _sample("he_llm_ttft_seconds_count", route=r, model="m") for r in ("complete", "stream", "chat")}
+        assert c.post("/llm/complete", json={"prompt": "x", "model": "m"}).json()["text"] == "ab"
+        assert c.post("/llm/stream", json={"prompt": "x", "model": "m"}).status_code == 200
+        assert c.post("/llm/chat", json={"model": "m", "messages": [{"role": "user", "content": "x"}]}).json()["text"] == "ab"
+        text = c.get("/metrics").text
+
+    for route in ("complete", "stream", "chat"):
+        assert _sample("he_llm_ttft_seconds_count", route=route, model="m") == before[route] + 1
+        assert _sample("he_llm_load_seconds_count", route=route, model="m") >= 1
+    assert 'he_llm_tokens_per_second_bucket{le="45.0",model="m",route="chat"}' in text
+
+
+def test_unconfigured_models_share_one_label():
+    before = _sample("he_llm_request_seconds_count", route="unit", model="other")
+    for name in ("attacker-1", "attacker-2", ""):
+        GenerationTimer("unit", name).finish()
+
+    assert _sample("he_llm_request_seconds_count", route="unit", model="other") == before + 3
+    assert _sample("he_llm_request_seconds_count", route="unit", model="attacker-1") == 0
+    assert GenerationTimer("unit", "m:latest").model == "m:latest"
@@ -0,0 +1,54 @@
+import asyncio
+import json
+
+import httpx
+from prometheus_client import REGISTRY
+
+from hybrid_engine import client_memory
+from hybrid_engine.client_memory import MemorySink
+from hybrid_engine.core import http
+
+
+def _count(result):
+    return REGISTRY.get_sample_value("he_memory_sink_items_total", {"result": result}) or 0.0
+
+
+def test_enqueue_returns_immediately_and_flushes_in_batches(monkeypatch):
+    posts = []
+
+    def handler(request):
+        posts.append((request.url.path, json.loads(request.content)))
+        return httpx.Response(200, json={"ok": True})
+
+    async def main():
+        http._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        sink = MemorySink("http://mk", flush_size=3, flush_interval=10, batch_path="/append_batch")
+        monkeypatch.setattr(client_memory, "get_memory_sink", lambda: sink)
+        for i in range(7):
+            assert await client_memory.append_memory("user", f"m{i}") is True
+        assert posts == []  # 呼叫端路徑上沒有任何 I/O
+        await asyncio.sleep(0.05)  # 湊滿 flush_size 的兩批先送
+        sizes = [len(body["items"]) for _, body in posts]
+        await sink.close()  # 剩下不滿一批的在關閉時送完
+        await http.close_http_client()
+        return sizes
+
+    before = _count("flushed")
+    assert asyncio.run(main()) == [3, 3]
+    assert [len(body["items"]) for _, body in posts] == [3, 3, 1]
+    assert posts[-1][1]["items"][0]["content"] == "m6"
+    assert _count("flushed") == before + 7
+
+
+def test_full_buffer_drops_oldest():
+    async def main():
+        sink = MemorySink("http://mk", max_buffer=3, flush_size=100, flush_interval=10)
+        for i in range(5):
+            sink.enqueue({"content": f"m{i}"})
+        kept = [item["content"] for item in sink._buf]
+        sink._task.cancel()
+        return kept
+
+    before = _count("dropped")
+    assert asyncio.run(main()) == ["m2", "m3", "m4"]
+    assert _count("dropped") == before + 2
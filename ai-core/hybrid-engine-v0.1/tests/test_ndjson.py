@@ -0,0 +1,37 @@
+import json
+
+import pytest
+
+from hybrid_engine.clients import ndjson
+
+
+@pytest.fixture(params=["default", "stdlib"])
+def decoder(request, monkeypatch):
+    if request.param == "stdlib":
+        monkeypatch.setattr(ndjson, "_loads", json.loads)
+        monkeypatch.setattr(ndjson, "_ZERO_COPY", False)
+    return ndjson.NDJSONDecoder()
+
+
+def _stream():
+    lines = [{"response": "舵"}, {"response": "手"}, {"response": "", "done": True, "eval_count": 2}]
+    return "\n".join(json.dumps(x, ensure_ascii=False) for x in lines).encode("utf-8")
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 4096])
+def test_any_chunking_yields_same_objects(decoder, size):
+    data = _stream()
+    out = []
+    for i in range(0, len(data), size):
+        out.extend(decoder.feed(data[i:i + size]))
+    out.extend(decoder.flush())
+    assert [o.get("response") for o in out] == ["舵", "手", ""]
+    assert out[-1]["done"] is True
+
+
+def test_bad_and_blank_lines_are_skipped(decoder):
+    out = decoder.feed(b'{"a": 1}\n\nnot json\r\n{"b"')
+    out += decoder.feed(b': 2}\n')
+    assert out == [{"a": 1}, {"b": 2}]
+    assert decoder.bad_lines == 1
+    assert decoder.flush() == []
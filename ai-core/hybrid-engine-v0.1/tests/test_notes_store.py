@@ -0,0 +1,48 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from hybrid_engine.core import store
+from hybrid_engine.routes import app
+
+
+@pytest.fixture
+def notes_db(tmp_path, monkeypatch):
+    store.close_conn()
+    monkeypatch.setattr(store, "DB_PATH", tmp_path / "notes.sqlite3")
+    monkeypatch.setattr(store, "_schema_ready", False)
+    yield
+    store.close_conn()
+
+
+def test_connection_is_reused_per_thread(notes_db):
+    store.add_note("user", "first")
+    conn = store._get_conn()
+    store.add_note("user", "second")
+    assert store._get_conn() is conn
+    assert [n["text"] for n in store.list_notes()] == ["second", "first"]
+
+
+def test_batch_insert_keyset_pages_and_fts_search(notes_db):
+    with TestClient(app) as c:
+        notes = [{"text": f"note {i} about " + ("ollama gpu" if i % 3 == 0 else "mysql index")} for i in range(10)]
+        ids = c.post("/bridge/notes:batch", json={"notes": notes}).json()["note_ids"]
+        assert ids == sorted(ids) and len(ids) == 10
+
+        seen, before = [], None
+        while True:
+            params = {"limit": 4} if before is None else {"limit": 4, "before": before}
+            page = c.get("/bridge/notes", params=params).json()
+            seen += [n["id"] for n in page["notes"]]
+            before = page["next_before"]
+            if before is None:
+                break
+        assert seen == ids[::-1]
+
+    hits = store.search_notes("which GPU does ollama use?", k=5)
+    assert hits and all("ollama gpu" in h["text"] for h in hits)
+
+    # trigger 維持索引同步：刪掉的 note 搜不到
+    conn = store._get_conn()
+    with conn:
+        conn.execute("DELETE FROM notes WHERE text LIKE '%ollama%'")
+    assert store.search_notes("ollama") == []
@@ -0,0 +1,84 @@
+import json
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from hybrid_engine.core import http, rag, store
+from hybrid_engine.routes import app
+
+_VOCAB = ["ollama", "gpu", "mysql", "index", "backup"]
+
+
+def _vector(text):
+    words = text.lower()
+    return [float(words.count(w)) + 0.01 for w in _VOCAB]
+
+
+class FakeOllama:
+    def __init__(self):
+        self.embeds = 0
+        self.prompts = []
+
+    def __call__(self, request):
+        body = json.loads(request.content)
+        if request.url.path == "/api/embeddings":
+            self.embeds += 1
+            return httpx.Response(200, json={"embedding": _vector(body["prompt"])})
+        self.prompts.append(body["prompt"])
+        lines = [{"response": "Use "}, {"response": "the GPU [1]."}, {"response": "", "done": True}]
+        return httpx.Response(200, content="".join(json.dumps(x) + "\n" for x in lines).encode())
+
+
+@pytest.fixture
+def fake(tmp_path, monkeypatch):
+    store.close_conn()
+    monkeypatch.setattr(store, "DB_PATH", tmp_path / "notes.sqlite3")
+    monkeypatch.setattr(store, "_schema_ready", False)
+    monkeypatch.setattr(rag, "_search_kc", lambda q, limit: [
+        {"source": "kc", "id": 7, "title": "mysql", "text": "mysql index backup policy"},
+    ])
+    rag.get_embedding_cache.cache_clear()
+    store.add_notes([
+        ("user", "ollama uses the gpu when available", None),
+        ("user", "mysql index on tasks(status)", None),
+        ("user", "ollama keep_alive is 5m", None),
+    ])
+    f = FakeOllama()
+    yield f
+    store.close_conn()
+
+
+def test_ask_retrieves_reranks_and_answers(fake):
+    with TestClient(app) as c:
+        http._client = httpx.AsyncClient(transport=httpx.MockTransport(fake))
+        r = c.post("/bridge/ask", json={"msg": "ollama gpu?", "k": 2}).json()
+        embeds_first = fake.embeds
+        again = c.post("/bridge/ask", json={"msg": "ollama gpu?", "k": 2}).json()
+
+    assert r["ok"] and r["answer"] == "Use the GPU [1]."
+    assert [h["text"] for h in r["hits"]][0] == "ollama uses the gpu when available"
+    assert len(r["hits"]) == 2
+    for stage in ("embed_s", "retrieve_notes_s", "retrieve_kc_s", "rerank_s", "assemble_s", "generate_s", "total_s"):
+        assert stage in r["timings"]
+    assert "[1] (note)" in fake.prompts[0] and "ollama gpu?" in fake.prompts[0]
+    # 問題與候選的 embedding 都有快取：第二次完全不打 /api/embeddings
+    assert fake.embeds == embeds_first
+    assert again["hits"] == r["hits"]
+
+
+def test_ask_streams_context_tokens_and_timings(fake):
+    with TestClient(app) as c:
+        http._client = httpx.AsyncClient(transport=httpx.MockTransport(fake))
+        resp = c.post("/bridge/ask", json={"msg": "mysql index", "stream": True})
+    events = [json.loads(line) for line in resp.text.splitlines()]
+    assert [e["type"] for e in events] == ["context", "token", "token", "done"]
+    assert events[0]["hits"] and "embed_s" in events[0]["timings"]
+    assert events[-1]["timings"]["ttft_s"] is not None
+
+
+def test_context_respects_token_budget():
+    hits = [{"source": "note", "title": "", "text": "字" * 400} for _ in range(5)]
+    context, used, tokens = rag.assemble(hits, budget=600)
+    assert tokens <= 600
+    assert len(used) == 2 and context.endswith("…")
@@ -0,0 +1,59 @@
+import asyncio
+import json
+
+import httpx
+from fastapi.testclient import TestClient
+
+from hybrid_engine.core import cache as cache_mod
+from hybrid_engine.core import http
+from hybrid_engine.core.config import CacheConfig
+from hybrid_engine.routes import app
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_memory_lru_respects_byte_limit():
+    c = cache_mod.ResponseCache(CacheConfig(enabled=True, memory_max_bytes=10, disk_dir=""))
+    _run(c.set("a", b"12345"))
+    _run(c.set("b", b"12345"))
+    _run(c.get("a"))  # a 變成最近使用
+    _run(c.set("c", b"12345"))
+    assert _run(c.get("a"))[0] == b"12345"
+    assert _run(c.get("b")) == (None, "")
+
+
+def test_disk_tier_survives_restart_and_honours_max_age(tmp_path):
+    cfg = CacheConfig(enabled=True, disk_dir=str(tmp_path))
+    _run(cache_mod.ResponseCache(cfg).set("k", b'{"text":"x"}'))
+    fresh = cache_mod.ResponseCache(cfg)
+    assert _run(fresh.get("k")) == (b'{"text":"x"}', "disk")
+    assert _run(fresh.get("k")) == (b'{"text":"x"}', "memory")
+    assert _run(cache_mod.ResponseCache(cfg).get("k", max_age=-1)) == (None, "")
+
+
+def test_complete_hits_cache_for_temperature_zero(monkeypatch):
+    calls = []
+
+    def upstream(req):
+        calls.append(req)
+        return httpx.Response(200, text=json.dumps({"response": "hi", "done": True}) + "\n")
+
+    shared = cache_mod.ResponseCache(CacheConfig(enabled=True))
+    monkeypatch.setattr(cache_mod, "get_response_cache", lambda: shared)
+
+    with TestClient(app) as c:
+        http._client = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+        body = {"prompt": "ping", "temperature": 0}
+        first = c.post("/llm/complete", json=body)
+        second = c.post("/llm/complete", json=body)
+        refreshed = c.post("/llm/complete", json=body, headers={"Cache-Control": "no-cache"})
+        warm = c.post("/llm/complete", json={"prompt": "ping", "temperature": 0.7})
+
+    assert first.headers["X-Cache"] == "MISS"
+    assert second.headers["X-Cache"] == "HIT"
+    assert second.json()["text"] == "hi"
+    assert refreshed.headers["X-Cache"] == "REFRESH"
+    assert warm.headers["X-Cache"] == "BYPASS"
+    assert len(calls) == 3
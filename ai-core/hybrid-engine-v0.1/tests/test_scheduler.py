@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from hybrid_engine.core.config import SchedulerConfig
+from hybrid_engine.core.scheduler import AdmissionRejected, Scheduler
+
+
+def _scheduler(**kw):
+    return Scheduler(SchedulerConfig(default_concurrency=1, **kw))
+
+
+def test_weighted_fair_dequeue_prefers_interactive_without_starving_batch():
+    async def main():
+        s = _scheduler(weights={"interactive": 3.0, "agent": 1.0, "batch": 1.0})
+        order = []
+        holder = await s.acquire("m", "interactive")
+
+        async def job(prio, i):
+            async with s.slot("m", prio):
+                order.append(f"{prio[0]}{i}")
+                await asyncio.sleep(0)
+
+        tasks = [asyncio.create_task(job("batch", i)) for i in range(4)]
+        tasks += [asyncio.create_task(job("interactive", i)) for i in range(6)]
+        await asyncio.sleep(0)
+        holder.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    # 權重 3:1 → 每個 batch 之間放行 3 個 interactive；batch 不會等到 interactive 全部跑完
+    assert asyncio.run(main()) == ["i0", "b0", "i1", "i2", "i3", "b1", "i4", "i5", "b2", "b3"]
+
+
+def test_full_queue_returns_429_and_timeout_returns_503():
+    async def main():
+        s = _scheduler(max_queue_depth={"batch": 1}, queue_timeouts={"batch": 0.05})
+        await s.acquire("m", "batch")
+        waiter = asyncio.create_task(s.acquire("m", "batch"))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as full:
+            await s.acquire("m", "batch")
+        with pytest.raises(AdmissionRejected) as timeout:
+            await waiter
+        return full.value, timeout.value, s.stats()["m"]
+
+    full, timeout, stats = asyncio.run(main())
+    assert full.status_code == 429
+    assert timeout.status_code == 503 and "Retry-After" in timeout.headers
+    assert stats["batch"] == 0 and stats["active"] == 1
+
+
+def test_cancelled_waiter_does_not_leak_slot():
+    async def main():
+        s = _scheduler()
+        first = await s.acquire("m")
+        waiter = asyncio.create_task(s.acquire("m"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        first.release()
+        second = await asyncio.wait_for(s.acquire("m"), 1)
+        second.release()
+        return s.stats()["m"]
+
+    assert asyncio.run(main())["active"] == 0
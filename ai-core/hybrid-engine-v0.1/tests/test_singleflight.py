@@ -0,0 +1,136 @@
+import asyncio
+
+
+from hybrid_engine.core.singleflight import SingleFlight, StreamFanout
+
+
+def test_concurrent_identical_calls_share_one_generation():
+    calls = 0
+
+    async def generate():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return {"text": "hi"}
+
+    async def main():
+        sf = SingleFlight("t")
+        results = await asyncio.gather(*(sf.do("k", generate) for _ in range(5)))
+        assert sf.in_flight() == 0
+        return results
+
+    results = asyncio.run(main())
+    assert calls == 1
+    assert all(r == {"text": "hi"} for r in results)
+
+
+def test_errors_propagate_to_every_waiter():
+    async def boom():
+        await asyncio.sleep(0)
+        raise RuntimeError("backend down")
+
+    async def main():
+        sf = SingleFlight("t")
+        return await asyncio.gather(sf.do("k", boom), sf.do("k", boom), return_exceptions=True)
+
+    assert all(isinstance(r, RuntimeError) for r in asyncio.run(main()))
+
+
+def test_stream_fanout_replays_for_late_subscriber():
+    started = 0
+
+    async def tokens():
+        nonlocal started
+        started += 1
+        for t in ["a", "b", "c"]:
+            await asyncio.sleep(0.01)
+            yield t
+
+    async def collect(fan, delay):
+        await asyncio.sleep(delay)
+        return [t async for t in fan.subscribe("k", tokens)]
+
+    async def main():
+        fan = StreamFanout("t")
+        return await asyncio.gather(collect(fan, 0), collect(fan, 0.015))
+
+    assert asyncio.run(main()) == [["a", "b", "c"], ["a", "b", "c"]]
+    assert started == 1
+
+
+def test_stream_cancelled_when_last_subscriber_leaves():
+    state = {"cancelled": False}
+
+    async def tokens():
+        try:
+            while True:
+                await asyncio.sleep(0.005)
+                yield "x"
+        except asyncio.CancelledError:
+            state["cancelled"] = True
+            raise
+
+    async def main():
+        fan = StreamFanout("t")
+        agen = fan.subscribe("k", tokens)
+        assert await agen.__anext__() == "x"
+        await agen.aclose()
+        await asyncio.sleep(0.01)
+        assert fan.in_flight() == 0
+
+    asyncio.run(main())
+    assert state["cancelled"]
+
+
+def test_slow_subscriber_stalls_upstream():
+    produced = 0
+
+    async def tokens():
+        nonlocal produced
+        for i in range(1000):
+            produced += 1
+            yield i
+            await asyncio.sleep(0)
+
+    async def main():
+        fan = StreamFanout("t", max_lag=8)
+        sub = fan.subscribe("k", tokens)
+        assert await sub.__anext__() == 0
+        await asyncio.sleep(0.05)  # client 不讀
+        stalled_at = produced
+        got = [t async for t in sub]
+        return stalled_at, got
+
+    stalled_at, got = asyncio.run(main())
+    assert stalled_at <= 10
+    assert got == list(range(1, 1000))
+
+
+def test_subscriber_leaving_before_first_read_cancels_upstream():
+    state = {"cancelled": 0}
+
+    async def tokens():
+        try:
+            while True:
+                await asyncio.sleep(0.005)
+                yield "x"
+        except asyncio.CancelledError:
+            state["cancelled"] += 1
+            raise
+
+    async def main():
+        fan = StreamFanout("t")
+        sub = fan.subscribe("k", tokens)
+        await asyncio.sleep(0.02)
+        await sub.aclose()  # 還沒讀過就斷線
+        await asyncio.sleep(0.01)
+        assert fan.in_flight() == 0
+
+        sub = fan.subscribe("k2", tokens)
+        await asyncio.sleep(0.02)
+        del sub  # 連 aclose 都沒有（回應還沒開始就被丟掉）
+        await asyncio.sleep(0.01)
+        assert fan.in_flight() == 0
+
+    asyncio.run(main())
+    assert state["cancelled"] == 2
@@ -0,0 +1,110 @@
+import asyncio
+import json
+
+import httpx
+from prometheus_client import REGISTRY
+
+from hybrid_engine.core import http, llm_metrics
+from hybrid_engine.core.scheduler import get_scheduler
+from hybrid_engine.core.streaming import CancellableStreamingResponse
+from hybrid_engine.routes import app
+
+
+def _sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def _endless_ollama(state):
+    async def body():
+        try:
+            while True:
+                state["sent"] += 1
+                yield b'{"response":"t"}\n'
+                await asyncio.sleep(0.01)
+        finally:
+            state["closed"] = True
+
+    return lambda request: httpx.Response(200, content=body())
+
+
+async def _call(path, payload, disconnect_after):
+    """直接打 ASGI app；收到 disconnect_after 個 body chunk 後模擬 client 斷線"""
+    gone = asyncio.Event()
+    chunks = []
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": json.dumps(payload).encode(), "more_body": False}
+        await gone.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            chunks.append(message["body"])
+            if len(chunks) >= disconnect_after:
+                gone.set()
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "root_path": "", "headers": [(b"content-type", b"application/json")],
+        "client": ("test", 1), "server": ("test", 80),
+    }
+    await asyncio.wait_for(app(scope, receive, send), 5)
+    return chunks
+
+
+def test_disconnect_closes_upstream_and_counts_saved_tokens(monkeypatch):
+    monkeypatch.setattr(llm_metrics, "known_models", lambda: frozenset({"cancel-m:latest"}))
+
+    async def main():
+        state = {"sent": 0, "closed": False}
+        http._client = httpx.AsyncClient(transport=httpx.MockTransport(_endless_ollama(state)))
+        try:
+            payload = {"prompt": "x", "model": "cancel-m", "options": {"num_predict": 1000}}
+            chunks = await _call("/llm/stream", payload, disconnect_after=3)
+            await asyncio.sleep(0.05)
+            return state, chunks
+        finally:
+            await http.close_http_client()
+
+    before = _sample("he_stream_aborted_total", route="stream", reason="disconnect")
+    state, chunks = asyncio.run(main())
+    assert state["closed"] is True
+    assert state["sent"] < 10
+    assert len(chunks) >= 3
+    assert _sample("he_stream_aborted_total", route="stream", reason="disconnect") == before + 1
+    assert _sample("he_llm_cancelled_total", route="stream", model="cancel-m") == 1
+    assert _sample("he_llm_saved_tokens_total", route="stream", model="cancel-m") >= 990
+    # slot 已經還回去
+    assert get_scheduler().stats()["cancel-m"]["active"] == 0
+
+
+def test_slow_client_is_cut_off():
+    async def main():
+        closed = []
+
+        async def body():
+            try:
+                for _ in range(100):
+                    yield "t"
+            finally:
+                closed.append(True)
+
+        async def receive():
+            await asyncio.sleep(10)
+
+        async def send(message):
+            if message["type"] == "http.response.body" and message.get("body"):
+                await asyncio.sleep(10)  # client 完全不讀
+
+        resp = CancellableStreamingResponse(body(), route="unit", send_timeout=0.05)
+        await asyncio.wait_for(resp({"type": "http"}, receive, send), 2)
+        return closed
+
+    before = _sample("he_stream_aborted_total", route="unit", reason="slow_client")
+    assert asyncio.run(main()) == [True]
+    assert _sample("he_stream_aborted_total", route="unit", reason="slow_client") == before + 1
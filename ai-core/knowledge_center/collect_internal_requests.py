@@ -1,126 +1,444 @@
 """
-Collect Internal KC Requests v1.0
+Collect Internal KC Requests v1.1
 - 掃描 tempstore/kc_internal_requests
-- 讀取每一個 JSON request
-- 寫入 DB: kc_internal_requests
-- 將 JSON 移到 kc_internal_processed 並更新 status
+- 分批（chunk）讀取 JSON request
+- 每個 chunk 用一次 executemany 的 INSERT ... ON DUPLICATE KEY UPDATE 寫入 DB: kc_internal_requests
+- commit 成功後才把 JSON 移到 kc_internal_processed 並更新 status
+- 收過的檔名跟 upsert 在同一個 transaction 記到 kc_internal_collected_files，
+  commit 後、搬檔前中斷再重跑時不會重複累加 hit_count
+- hit_count 以累加方式 upsert（配合 internal_bridge 的 coalescing），可用來排最常被問的問題
+- --watch：常駐模式，用 inotify（inotifywait）即時接新檔，不再依賴 cron 掃描
+
+用法：
+    python3 -m knowledge_center.collect_internal_requests           # 掃一次就結束
+    python3 -m knowledge_center.collect_internal_requests --watch   # 常駐模式
 """
 
 import os
+import sys
 import json
+import time
+import select
 import shutil
 import datetime
-from typing import Any, Dict
+import subprocess
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 from knowledge_center.db import get_connection
+from knowledge_center.internal_bridge import coalesce_lock
 
 REQUEST_DIR = "/srv/cockswain-core/ai-core/tempstore/kc_internal_requests"
 PROCESSED_DIR = "/srv/cockswain-core/ai-core/tempstore/kc_internal_processed"
+FAILED_DIR = "/srv/cockswain-core/ai-core/tempstore/kc_internal_failed"
 
+# 認領中的檔案後綴：collector 先 rename 再讀，internal_bridge 就不會再往上 +1
+CLAIM_SUFFIX = ".claimed"
 
-def store_request_in_db(data: Dict[str, Any]) -> None:
-    conn = get_connection()
-    cursor = conn.cursor()
+CHUNK_SIZE = int(os.getenv("KC_INTERNAL_CHUNK_SIZE", "500"))
 
-    sql = """
-    INSERT INTO kc_internal_requests
-      (request_uuid, question, intent, parsed_json, status, source, created_at, processed_at)
-    VALUES
-      (%s, %s, %s, %s, %s, %s, %s, %s)
-    ON DUPLICATE KEY UPDATE
-      question = VALUES(question),
-      intent = VALUES(intent),
-      parsed_json = VALUES(parsed_json),
-      status = VALUES(status),
-      processed_at = VALUES(processed_at)
-    """
+# --watch 模式：收到事件後最多等多久就先 flush 一批
+WATCH_FLUSH_SECONDS = float(os.getenv("KC_INTERNAL_FLUSH_SECONDS", "1.0"))
+# 沒有 inotifywait 時的 fallback 掃描間隔
+WATCH_POLL_SECONDS = float(os.getenv("KC_INTERNAL_POLL_SECONDS", "5.0"))
+
+# 收檔紀錄保留天數：留下來的 *.claimed 超過這麼久還沒搬走，就不再保證不重複累加
+COLLECTED_RETENTION_DAYS = int(os.getenv("KC_INTERNAL_COLLECTED_RETENTION_DAYS", "30"))
 
+UPSERT_SQL = """
+INSERT INTO kc_internal_requests
+  (request_uuid, question, intent, parsed_json, status, source, created_at, processed_at,
+   dedup_key, hit_count, last_hit_at)
+VALUES
+  (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE
+  question = VALUES(question),
+  intent = VALUES(intent),
+  parsed_json = VALUES(parsed_json),
+  status = VALUES(status),
+  processed_at = VALUES(processed_at),
+  dedup_key = VALUES(dedup_key),
+  hit_count = hit_count + VALUES(hit_count),
+  last_hit_at = GREATEST(COALESCE(last_hit_at, VALUES(last_hit_at)), VALUES(last_hit_at))
+"""
+
+# 故意不用 INSERT IGNORE：同一個檔案被兩邊同時收時，後 commit 的那邊撞 PRIMARY KEY 整批 rollback
+MARK_COLLECTED_SQL = """
+INSERT INTO kc_internal_collected_files (file_name, request_uuid, collected_at)
+VALUES (%s, %s, %s)
+"""
+
+PRUNE_COLLECTED_SQL = "DELETE FROM kc_internal_collected_files WHERE collected_at < %s"
+
+
+def _parse_ts(value: Any) -> datetime.datetime:
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except Exception:
+        return datetime.datetime.utcnow()
+
+
+def _row_from_request(data: Dict[str, Any], processed_at: datetime.datetime) -> Tuple[Any, ...]:
     request_uuid = data.get("request_id")
     question = data.get("question", "")
     intent = data.get("intent", "")
     parsed = data.get("parsed", {}) or {}
     source = data.get("source", "internal_dialogue")
 
-    created_at_str = data.get("created_at")
+    created_at = _parse_ts(data.get("created_at"))
+    last_hit_at = _parse_ts(data.get("last_hit_at") or data.get("created_at"))
+
+    return (
+        request_uuid,
+        question,
+        intent,
+        json.dumps(parsed, ensure_ascii=False),
+        "stored",
+        source,
+        created_at.strftime("%Y-%m-%d %H:%M:%S"),
+        processed_at.strftime("%Y-%m-%d %H:%M:%S"),
+        data.get("dedup_key"),
+        int(data.get("hit_count") or 1),
+        last_hit_at.strftime("%Y-%m-%d %H:%M:%S"),
+    )
+
+
+def store_requests_in_db(
+    requests: List[Dict[str, Any]],
+    files: Optional[List[Tuple[str, Dict[str, Any]]]] = None,
+) -> None:
+    """
+    一個 chunk 一次 executemany + 一次 commit。
+    files 是這批 request 來自的 (檔名, request)，跟 upsert 一起記進 kc_internal_collected_files。
+    失敗時 rollback 並把例外往上丟，呼叫端就不會移動檔案。
+    """
+    if not requests:
+        return
+
+    processed_at = datetime.datetime.utcnow()
+    ts = processed_at.strftime("%Y-%m-%d %H:%M:%S")
+    rows = [_row_from_request(data, processed_at) for data in requests]
+
+    conn = get_connection()
+    # db.get_connection() 預設 autocommit=True，這裡要整批一個 transaction
+    conn.autocommit = False
+    cursor = conn.cursor()
     try:
-        created_at = datetime.datetime.fromisoformat(created_at_str)
+        cursor.executemany(UPSERT_SQL, rows)
+        if files:
+            cursor.executemany(
+                MARK_COLLECTED_SQL,
+                [(_original_name(path), data.get("request_id"), ts) for path, data in files],
+            )
+            cutoff = processed_at - datetime.timedelta(days=COLLECTED_RETENTION_DAYS)
+            cursor.execute(PRUNE_COLLECTED_SQL, (cutoff.strftime("%Y-%m-%d %H:%M:%S"),))
+        conn.commit()
     except Exception:
-        created_at = datetime.datetime.utcnow()
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
 
-    processed_at = datetime.datetime.utcnow()
-    status = "stored"
-
-    cursor.execute(
-        sql,
-        (
-            request_uuid,
-            question,
-            intent,
-            json.dumps(parsed, ensure_ascii=False),
-            status,
-            source,
-            created_at.strftime("%Y-%m-%d %H:%M:%S"),
-            processed_at.strftime("%Y-%m-%d %H:%M:%S"),
-        ),
-    )
-    conn.commit()
-    cursor.close()
-    conn.close()
 
+def store_request_in_db(data: Dict[str, Any]) -> None:
+    store_requests_in_db([data])
 
-def process_request_file(path: str) -> None:
-    with open(path, "r", encoding="utf-8") as f:
-        data = json.load(f)
 
-    request_id = data.get("request_id", "unknown")
-    question = data.get("question", "")
-    intent = data.get("intent", "")
-    parsed = data.get("parsed", {})
+def _already_collected(names: List[str]) -> Set[str]:
+    """
+    回傳 names 裡已經在 kc_internal_collected_files 的檔名。
+    """
+    if not names:
+        return set()
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        placeholders = ", ".join(["%s"] * len(names))
+        cursor.execute(
+            f"SELECT file_name FROM kc_internal_collected_files WHERE file_name IN ({placeholders})",
+            names,
+        )
+        return {row[0] for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def _load_request_file(path: str) -> Optional[Dict[str, Any]]:
+    """
+    讀不到 / 壞掉的 JSON 移到 FAILED_DIR，避免每一輪都卡在同一個檔案。
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, dict) or not data.get("request_id"):
+            raise ValueError("missing request_id")
+        return data
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"[WARN] 無法解析 {path}: {e!r}，移到 {FAILED_DIR}")
+        os.makedirs(FAILED_DIR, exist_ok=True)
+        try:
+            shutil.move(path, os.path.join(FAILED_DIR, _original_name(path)))
+        except Exception:
+            pass
+        return None
 
-    print("=== 處理 internal KC request ===")
-    print(f"request_id: {request_id}")
-    print(f"intent    : {intent}")
-    print(f"question  : {question}")
-    print(f"parsed    : {parsed.get('tokens') or parsed.get('raw')}")
-    print("=== 寫入 DB: kc_internal_requests ===")
 
-    # 寫入資料庫
-    store_request_in_db(data)
+def _original_name(path: str) -> str:
+    name = os.path.basename(path)
+    if name.endswith(CLAIM_SUFFIX):
+        name = name[: -len(CLAIM_SUFFIX)]
+    return name
 
-    # 更新 status
+
+def _mark_processed(path: str, data: Dict[str, Any]) -> str:
+    """
+    把更新後的 JSON 寫到 PROCESSED_DIR（先寫暫存檔再 rename），再刪掉原始檔。
+    比「先 move 再覆寫」少一次檔案搬移，也不會留下寫一半的檔案。
+    """
     data["status"] = "stored"
 
+    dest_path = os.path.join(PROCESSED_DIR, _original_name(path))
+    tmp_path = dest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, dest_path)
+
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    return dest_path
+
+
+def _claim(paths: List[str]) -> List[str]:
+    """
+    在 coalesce_lock 底下把檔案 rename 成 *.claimed。
+    之後 internal_bridge 找不到原檔，就會另開增量檔，不會把 hit 加在我們正在收的檔案上。
+    已經是 *.claimed 的（上次跑到一半中斷留下的）直接沿用。
+    """
+    claimed: List[str] = []
+    with coalesce_lock():
+        for path in paths:
+            if path.endswith(CLAIM_SUFFIX):
+                claimed.append(path)
+                continue
+            try:
+                os.rename(path, path + CLAIM_SUFFIX)
+                claimed.append(path + CLAIM_SUFFIX)
+            except FileNotFoundError:
+                continue
+    return claimed
+
+
+def _unclaim(paths: List[str]) -> None:
+    for path in paths:
+        try:
+            os.rename(path, os.path.join(REQUEST_DIR, _original_name(path)))
+        except FileNotFoundError:
+            pass
+
+
+def _merge_by_request_id(loaded: List[Tuple[str, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    同一個 chunk 內可能有同一 request_id 的原始檔與增量檔：
+    hit_count 相加、last_hit_at 取最大，其他欄位以最後一份為準。
+    """
+    by_id: Dict[str, Dict[str, Any]] = {}
+    for _, data in loaded:
+        rid = data["request_id"]
+        prev = by_id.get(rid)
+        if prev is None:
+            by_id[rid] = dict(data)
+            continue
+        merged = dict(data)
+        merged["hit_count"] = int(prev.get("hit_count") or 1) + int(data.get("hit_count") or 1)
+        merged["last_hit_at"] = max(
+            str(prev.get("last_hit_at") or ""), str(data.get("last_hit_at") or "")
+        ) or None
+        merged["created_at"] = prev.get("created_at") or data.get("created_at")
+        by_id[rid] = merged
+    return list(by_id.values())
+
+
+def process_chunk(paths: List[str]) -> int:
+    """
+    處理一批檔案，回傳成功寫入的 request 筆數。
+    """
+    claimed = _claim(paths)
+
+    loaded: List[Tuple[str, Dict[str, Any]]] = []
+    for path in claimed:
+        data = _load_request_file(path)
+        if data is not None:
+            loaded.append((path, data))
+
+    if not loaded:
+        return 0
+
+    try:
+        # 上次 commit 了但還沒搬檔就中斷的：只補搬檔，不再寫一次
+        done = _already_collected([_original_name(path) for path, _ in loaded])
+        fresh = [(path, data) for path, data in loaded if _original_name(path) not in done]
+        merged = _merge_by_request_id(fresh)
+        store_requests_in_db(merged, fresh)
+    except Exception:
+        _unclaim([path for path, _ in loaded])
+        raise
+
+    # commit 成功後才動檔案
     os.makedirs(PROCESSED_DIR, exist_ok=True)
-    filename = os.path.basename(path)
-    dest_path = os.path.join(PROCESSED_DIR, filename)
+    for path, data in loaded:
+        _mark_processed(path, data)
 
-    # 移動檔案
-    shutil.move(path, dest_path)
+    return len(merged)
 
-    # 覆寫為更新後的 JSON
-    with open(dest_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
 
-    print(f"=== 已移動到: {dest_path} 並標記為 stored ===\n")
+def process_request_file(path: str) -> None:
+    process_chunk([path])
 
 
-def main() -> None:
-    if not os.path.isdir(REQUEST_DIR):
-        print(f"[INFO] 無資料夾: {REQUEST_DIR}")
-        return
+def _pending_files() -> List[str]:
+    return sorted(
+        os.path.join(REQUEST_DIR, f)
+        for f in os.listdir(REQUEST_DIR)
+        if f.endswith(".json") or f.endswith(".json" + CLAIM_SUFFIX)
+    )
 
-    files = sorted(
-        f for f in os.listdir(REQUEST_DIR)
-        if f.endswith(".json")
+
+def sweep(chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    把 REQUEST_DIR 內目前所有的 request 以 chunk 為單位處理完，回傳總筆數。
+    """
+    files = _pending_files()
+    total = 0
+    for i in range(0, len(files), chunk_size):
+        chunk = files[i:i + chunk_size]
+        n = process_chunk(chunk)
+        total += n
+        print(f"=== chunk {i // chunk_size + 1}: {n} 筆寫入 kc_internal_requests ===")
+    return total
+
+
+def _try_sweep(chunk_size: int) -> bool:
+    """
+    sweep 一次；失敗（通常是 DB 暫時掛掉）只記 log 回傳 False，讓常駐模式稍後重試而不是整個結束。
+    process_chunk 失敗時已經把檔案放回 REQUEST_DIR，下次 sweep 會再撿到。
+    """
+    try:
+        sweep(chunk_size)
+        return True
+    except Exception as e:
+        print(f"[ERROR] sweep 失敗: {e!r}，{WATCH_POLL_SECONDS}s 後重掃")
+        return False
+
+
+def watch(chunk_size: int = CHUNK_SIZE) -> None:
+    """
+    常駐模式：
+    - 先啟動 inotifywait 監看 close_write / moved_to，再 sweep 一次既有檔案
+      （順序反過來的話，兩者之間寫進來的檔案會被漏掉）
+    - 累積到 chunk_size，或 WATCH_FLUSH_SECONDS 內沒有新事件，就 flush 一批
+    - flush / sweep 失敗時每 WATCH_POLL_SECONDS 重掃整個目錄，直到成功為止；
+      這段期間收到的檔案照樣排著，重掃成功才清掉
+    - 沒裝 inotifywait（inotify-tools）時退回定期 sweep
+    """
+    if shutil.which("inotifywait") is None:
+        print(f"[WARN] 找不到 inotifywait，改用每 {WATCH_POLL_SECONDS}s 掃描一次")
+        while True:
+            _try_sweep(chunk_size)
+            time.sleep(WATCH_POLL_SECONDS)
+
+    proc = subprocess.Popen(
+        [
+            "inotifywait", "-m", "-q",
+            "-e", "close_write", "-e", "moved_to",
+            "--format", "%f",
+            REQUEST_DIR,
+        ],
+        stdout=subprocess.PIPE,
     )
+    print(f"[INFO] watching {REQUEST_DIR}")
 
-    if not files:
-        print("[INFO] 沒有待處理的 internal KC requests。")
+    fd = proc.stdout.fileno()
+    buf = b""
+    pending: List[str] = []
+    seen = set()
+    # 下一次重掃的時間；None 表示目前沒有失敗待重試
+    retry_at: Optional[float] = None
+    if not _try_sweep(chunk_size):
+        retry_at = time.monotonic() + WATCH_POLL_SECONDS
+    try:
+        while True:
+            if retry_at is not None:
+                timeout: Optional[float] = max(0.0, retry_at - time.monotonic())
+            elif pending:
+                timeout = WATCH_FLUSH_SECONDS
+            else:
+                timeout = None
+            ready, _, _ = select.select([fd], [], [], timeout)
+            if ready:
+                data = os.read(fd, 65536)
+                if not data:
+                    raise RuntimeError("inotifywait exited")
+                buf += data
+                *lines, buf = buf.split(b"\n")
+                for raw in lines:
+                    name = raw.decode("utf-8", errors="replace").strip()
+                    if name.endswith(".json") and name not in seen:
+                        seen.add(name)
+                        pending.append(os.path.join(REQUEST_DIR, name))
+
+            if retry_at is not None:
+                if time.monotonic() < retry_at:
+                    continue
+                # 重掃涵蓋整個目錄（含 pending 裡的檔案），成功了 pending 才能清
+                if _try_sweep(chunk_size):
+                    retry_at = None
+                    pending = []
+                    seen.clear()
+                else:
+                    retry_at = time.monotonic() + WATCH_POLL_SECONDS
+                continue
+
+            if ready and len(pending) < chunk_size:
+                continue
+
+            if pending:
+                try:
+                    n = process_chunk(pending)
+                    print(f"=== watch flush: {n} 筆寫入 kc_internal_requests ===")
+                except Exception as e:
+                    # DB 暫時掛掉：檔案還留在 REQUEST_DIR，稍後整個目錄重掃一次
+                    print(f"[ERROR] flush 失敗: {e!r}，{WATCH_POLL_SECONDS}s 後重掃")
+                    retry_at = time.monotonic() + WATCH_POLL_SECONDS
+                    continue
+                pending = []
+                seen.clear()
+    finally:
+        proc.terminate()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    argv = sys.argv[1:] if argv is None else argv
+
+    if not os.path.isdir(REQUEST_DIR):
+        if "--watch" not in argv:
+            print(f"[INFO] 無資料夾: {REQUEST_DIR}")
+            return
+        os.makedirs(REQUEST_DIR, exist_ok=True)
+
+    if "--watch" in argv:
+        watch()
         return
 
-    for name in files:
-        path = os.path.join(REQUEST_DIR, name)
-        process_request_file(path)
+    total = sweep()
+    if not total:
+        print("[INFO] 沒有待處理的 internal KC requests。")
+        return
+    print(f"[INFO] 共寫入 {total} 筆 internal KC requests。")
 
 
 if __name__ == "__main__":
@@ -5,8 +5,16 @@ collect_api_changes.py
 
 用途：
 - 定期抓取「外部 / 內部 API 的版本資訊」
-- 目前先實作 Meilisearch 本地節點的 version 追蹤
-- 偵測版本變更後，寫入 MySQL 資料表 kc_api_changes
+- 以 asyncio + 共用連線池的 httpx.AsyncClient 併發輪詢所有 source
+- 支援 ETag / If-Modified-Since 條件式請求（沒變就只花一個 304）
+- 每個 source 失敗時各自做指數退避（exponential backoff）
+- 依照 source 的 freq 排程，不再每次 cron 都全部打一輪
+- 偵測到的版本變更一次批次寫入 MySQL 資料表 kc_api_changes
+
+執行方式：
+    python3 collect_api_changes.py            # 只輪詢「已到期」的 source，跑一輪就結束（適合 cron）
+    python3 collect_api_changes.py --force    # 忽略排程，全部輪詢一次
+    python3 collect_api_changes.py --daemon   # 常駐模式，由 freq 驅動排程
 
 相依：
 - /srv/cockswain-core/.env 內需包含：
@@ -25,31 +33,60 @@ collect_api_changes.py
           - "version"
         api_key_env: "MEILI_MASTER_KEY"
         tags: ["internal", "infra"]
+
+  其他可選欄位：
+    version_fields: ["pkgVersion", "info.version"]   # JSON 取版本的欄位（可用點號路徑）
+    auth_scheme: "Bearer"                            # Authorization 前綴
+    headers: {"X-Foo": "bar"}                        # 額外 header
+  track 為 "content" 時，不解析版本欄位，而是以 body 的 sha256 當作版本。
 """
 
 import os
 import sys
 import json
+import time
+import asyncio
+import hashlib
 import datetime
-import pathlib
 from typing import Any, Dict, List, Optional, Tuple
 
+import httpx
 import mysql.connector
 import yaml
 
-from urllib.request import Request, urlopen
-from urllib.error import URLError, HTTPError
-
 # ------------------------------------------------------------
 # 基本路徑設定
 # ------------------------------------------------------------
 
 BASE_DIR = "/srv/cockswain-core/ai-core/knowledge-center"
 CONFIG_PATH = os.path.join(BASE_DIR, "config", "sources_api.yaml")
+STATE_PATH = os.path.join(BASE_DIR, "state", "api_changes_state.json")
 
 CORE_ROOT = "/srv/cockswain-core"
 DOT_ENV_PATH = os.path.join(CORE_ROOT, ".env")
 
+# ------------------------------------------------------------
+# 輪詢 / 排程參數
+# ------------------------------------------------------------
+
+HTTP_TIMEOUT = 5.0
+MAX_CONCURRENCY = 16
+
+BACKOFF_BASE_SECONDS = 60
+BACKOFF_MAX_SECONDS = 6 * 3600
+
+# daemon 模式下，最多睡多久就重新讀一次設定
+DAEMON_MAX_SLEEP_SECONDS = 300
+
+FREQ_SECONDS: Dict[str, int] = {
+    "minutely": 60,
+    "hourly": 3600,
+    "daily": 86400,
+    "weekly": 7 * 86400,
+    "monthly": 30 * 86400,
+}
+DEFAULT_FREQ_SECONDS = FREQ_SECONDS["daily"]
+
 
 # ------------------------------------------------------------
 # 小工具：log, env, YAML
@@ -111,6 +148,116 @@ def load_sources(config_path: str) -> List[Dict[str, Any]]:
         return []
 
 
+# ------------------------------------------------------------
+# 輪詢狀態（ETag / Last-Modified / 排程 / 退避）
+# ------------------------------------------------------------
+
+def load_state(state_path: str) -> Dict[str, Dict[str, Any]]:
+    """
+    讀取每個 source 的輪詢狀態：
+        {
+          "<source_id>": {
+            "etag": "...", "last_modified": "...",
+            "last_version": "...", "last_polled_at": 1700000000.0,
+            "next_due_at": 1700003600.0, "failures": 0
+          }
+        }
+    """
+    if not os.path.exists(state_path):
+        return {}
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except Exception as e:
+        log(f"failed to load state {state_path}: {e!r}, start fresh")
+        return {}
+
+
+def save_state(state_path: str, state: Dict[str, Dict[str, Any]]) -> None:
+    """
+    先寫暫存檔再 rename，避免 cron 與 daemon 同時跑時寫壞檔案。
+    """
+    try:
+        os.makedirs(os.path.dirname(state_path), exist_ok=True)
+        tmp_path = state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, state_path)
+    except Exception as e:
+        log(f"failed to save state {state_path}: {e!r}")
+
+
+def freq_to_seconds(freq: Any) -> int:
+    """
+    freq 可以是 "hourly" / "daily" / "weekly" ... 或直接給秒數。
+    """
+    if isinstance(freq, (int, float)) and freq > 0:
+        return int(freq)
+    if isinstance(freq, str):
+        key = freq.strip().lower()
+        if key in FREQ_SECONDS:
+            return FREQ_SECONDS[key]
+        if key.isdigit() and int(key) > 0:
+            return int(key)
+    return DEFAULT_FREQ_SECONDS
+
+
+def backoff_seconds(failures: int) -> int:
+    """
+    指數退避：60s, 120s, 240s ... 最多 6 小時。
+    """
+    if failures <= 0:
+        return 0
+    return min(BACKOFF_BASE_SECONDS * (2 ** (failures - 1)), BACKOFF_MAX_SECONDS)
+
+
+def is_pollable(source: Dict[str, Any]) -> bool:
+    """
+    目前處理的 source：
+    - type 為 http / http_json
+    - track 包含 "version" / "content" 或未設定 track
+    """
+    if not source.get("enabled", True):
+        return False
+    src_type = source.get("type", "http")
+    track = source.get("track") or []
+    if src_type not in ("http", "http_json"):
+        return False
+    return not track or "version" in track or "content" in track
+
+
+def due_sources(
+    sources: List[Dict[str, Any]],
+    state: Dict[str, Dict[str, Any]],
+    now: float,
+    force: bool = False,
+) -> List[Dict[str, Any]]:
+    due: List[Dict[str, Any]] = []
+    for src in sources:
+        if not src.get("enabled", True):
+            continue
+        if not is_pollable(src):
+            log(f"[{src.get('id', 'unknown')}] skip type={src.get('type', 'http')}, track={src.get('track') or []}")
+            continue
+        st = state.get(src.get("id", "unknown")) or {}
+        if force or float(st.get("next_due_at") or 0) <= now:
+            due.append(src)
+    return due
+
+
+def next_wakeup(sources: List[Dict[str, Any]], state: Dict[str, Dict[str, Any]]) -> float:
+    """
+    回傳最早到期的 source 時間點（epoch 秒）；沒有 source 則回傳 0。
+    """
+    times = [
+        float((state.get(src.get("id", "unknown")) or {}).get("next_due_at") or 0)
+        for src in sources
+        if is_pollable(src)
+    ]
+    return min(times) if times else 0.0
+
+
 # ------------------------------------------------------------
 # MySQL 連線與版本紀錄操作
 # ------------------------------------------------------------
@@ -146,24 +293,28 @@ def get_db_connection(env: Dict[str, str]):
     return conn
 
 
-def get_last_version(conn, source_id: str) -> Optional[str]:
+def get_last_versions(conn, source_ids: List[str]) -> Dict[str, Optional[str]]:
     """
-    從 kc_api_changes 取出最新一筆 new_version。
+    一次從 kc_api_changes 取出多個 source 最新一筆 new_version。
     """
-    sql = """
-        SELECT new_version
-        FROM kc_api_changes
-        WHERE source_id = %s
-        ORDER BY detected_at DESC, id DESC
-        LIMIT 1
+    if not source_ids:
+        return {}
+
+    placeholders = ", ".join(["%s"] * len(source_ids))
+    sql = f"""
+        SELECT c.source_id, c.new_version
+        FROM kc_api_changes c
+        JOIN (
+            SELECT source_id, MAX(id) AS max_id
+            FROM kc_api_changes
+            WHERE source_id IN ({placeholders})
+            GROUP BY source_id
+        ) m ON m.max_id = c.id
     """
     cur = conn.cursor()
     try:
-        cur.execute(sql, (source_id,))
-        row = cur.fetchone()
-        if not row:
-            return None
-        return row[0]
+        cur.execute(sql, tuple(source_ids))
+        return {row[0]: row[1] for row in cur.fetchall()}
     finally:
         cur.close()
 
@@ -204,24 +355,13 @@ def classify_change(prev_version: Optional[str], new_version: Optional[str]) ->
     return "unknown"
 
 
-def record_version_change(
-    conn,
-    source_id: str,
-    prev_version: Optional[str],
-    new_version: str,
-    change_type: str,
-    raw_json: Dict[str, Any],
-) -> None:
+def record_version_changes(conn, changes: List[Dict[str, Any]]) -> None:
     """
-    寫入 kc_api_changes。
+    以單一 executemany + 單一 commit 批次寫入 kc_api_changes。
+    changes 每筆包含：source_id, prev_version, new_version, change_type, detected_at, raw_json
     """
-    detected_at = datetime.datetime.utcnow()
-    raw_diff_obj = {
-        "prev_version": prev_version,
-        "new_version": new_version,
-        "raw": raw_json,
-    }
-    raw_diff_json = json.dumps(raw_diff_obj, ensure_ascii=False)
+    if not changes:
+        return
 
     sql = """
         INSERT INTO kc_api_changes
@@ -231,147 +371,293 @@ def record_version_change(
     """
     note = "auto-detected by collect_api_changes"
 
-    cur = conn.cursor()
-    try:
-        cur.execute(
-            sql,
+    rows = []
+    for ch in changes:
+        raw_diff_obj = {
+            "prev_version": ch["prev_version"],
+            "new_version": ch["new_version"],
+            "raw": ch["raw_json"],
+        }
+        rows.append(
             (
-                source_id,
-                prev_version,
-                new_version,
-                change_type,
-                detected_at,
-                raw_diff_json,
+                ch["source_id"],
+                ch["prev_version"],
+                ch["new_version"],
+                ch["change_type"],
+                ch["detected_at"],
+                json.dumps(raw_diff_obj, ensure_ascii=False),
                 note,
-            ),
+            )
         )
+
+    cur = conn.cursor()
+    try:
+        cur.executemany(sql, rows)
         conn.commit()
     except Exception as e:
         conn.rollback()
-        log(f"[{source_id}] failed to insert kc_api_changes: {e!r}")
+        log(f"failed to insert {len(rows)} rows into kc_api_changes: {e!r}")
         raise
     finally:
         cur.close()
 
 
 # ------------------------------------------------------------
-# Meilisearch 版本抓取
+# HTTP 版本抓取（非同步）
 # ------------------------------------------------------------
 
-def fetch_meili_version(source: Dict[str, Any], env: Dict[str, str]) -> Tuple[str, Dict[str, Any]]:
-    """
-    呼叫 Meilisearch /version，回傳 (version_str, raw_json)。
-    - 會依照 source["api_key_env"] 或 env["MEILI_MASTER_KEY"] 設定 Authorization header。
-    - version 主要取 pkgVersion，備援用 version 或 commitSha。
-    """
+def build_url(source: Dict[str, Any]) -> str:
     base_url = source.get("base_url", "http://127.0.0.1:7700").rstrip("/")
     version_path = source.get("version_path", "/version")
     if not version_path.startswith("/"):
         version_path = "/" + version_path
+    return base_url + version_path
 
-    url = base_url + version_path
-
-    # 取得 API key env 變數名稱
-    api_key_env = source.get("api_key_env") or "MEILI_MASTER_KEY"
-    api_key = env.get(api_key_env) or env.get("MEILI_MASTER_KEY")
 
+def build_headers(source: Dict[str, Any], env: Dict[str, str], st: Dict[str, Any]) -> Dict[str, str]:
+    """
+    - 依照 source["api_key_env"] 設定 Authorization header
+      （未設定時沿用 MEILI_MASTER_KEY，維持舊行為）
+    - 帶上前一次的 ETag / Last-Modified 做條件式請求
+    """
     headers = {
         "Accept": "application/json",
     }
+    headers.update(source.get("headers") or {})
+
+    api_key_env = source.get("api_key_env") or "MEILI_MASTER_KEY"
+    api_key = env.get(api_key_env) or env.get("MEILI_MASTER_KEY")
     if api_key:
-        headers["Authorization"] = f"Bearer {api_key}"
+        scheme = source.get("auth_scheme", "Bearer")
+        headers["Authorization"] = f"{scheme} {api_key}".strip()
 
-    log(f"[{source.get('id','unknown')}] fetching {url} with Authorization: {'yes' if api_key else 'no'}")
+    if st.get("etag"):
+        headers["If-None-Match"] = st["etag"]
+    if st.get("last_modified"):
+        headers["If-Modified-Since"] = st["last_modified"]
+    return headers
 
-    req = Request(url, headers=headers, method="GET")
 
-    try:
-        with urlopen(req, timeout=5) as resp:
-            status = resp.getcode()
-            body = resp.read().decode("utf-8", errors="replace")
-    except HTTPError as e:
-        log(
-            f"[{source.get('id','unknown')}] HTTPError while fetching version: "
-            f"status={e.code}, reason={getattr(e, 'reason', '')}"
-        )
-        raise
-    except URLError as e:
-        log(f"[{source.get('id','unknown')}] URLError while fetching version: {e.reason}")
-        raise
-    except Exception as e:
-        log(f"[{source.get('id','unknown')}] unexpected error while fetching version: {e!r}")
-        raise
+def _dig(data: Any, dotted: str) -> Any:
+    cur = data
+    for part in dotted.split("."):
+        if not isinstance(cur, dict):
+            return None
+        cur = cur.get(part)
+    return cur
 
-    if status != 200:
-        log(f"[{source.get('id','unknown')}] non-200 status: {status}, body={body[:200]}")
-        raise RuntimeError(f"non-200 status: {status}")
 
-    try:
-        data = json.loads(body)
-    except Exception as e:
-        log(f"[{source.get('id','unknown')}] failed to parse JSON: {e!r}, body={body[:200]}")
-        raise
+def extract_version(source: Dict[str, Any], body: bytes) -> Tuple[str, Dict[str, Any]]:
+    """
+    從 response body 取出 (version_str, raw_json)。
+    - track 含 "content"：以 body 的 sha256 當版本
+    - 否則依 version_fields 依序找第一個有值的欄位
+      （預設為 Meilisearch 的 pkgVersion → version → commitSha）
+    """
+    track = source.get("track") or []
+    if "content" in track and "version" not in track:
+        digest = hashlib.sha256(body).hexdigest()
+        return f"sha256:{digest[:16]}", {"sha256": digest, "size": len(body)}
+
+    data = json.loads(body.decode("utf-8", errors="replace"))
+    if not isinstance(data, dict):
+        raise RuntimeError("response JSON is not an object")
 
     # Meilisearch v1.11 會回傳：
     # {"commitSha": "...", "commitDate": "...", "pkgVersion":"1.11.0"}
-    version = (
-        data.get("pkgVersion")
-        or data.get("version")
-        or data.get("commitSha")
-        or ""
-    )
+    fields = source.get("version_fields") or ["pkgVersion", "version", "commitSha"]
+    for field in fields:
+        value = _dig(data, field)
+        if value:
+            return str(value), data
+
+    raise RuntimeError(f"version field missing in response (tried {fields})")
+
+
+async def poll_source(
+    client: httpx.AsyncClient,
+    sem: asyncio.Semaphore,
+    source: Dict[str, Any],
+    env: Dict[str, str],
+    st: Dict[str, Any],
+) -> Dict[str, Any]:
+    """
+    輪詢單一 source，回傳結果：
+        {"status": "changed" | "not_modified" | "error", "version": ..., "raw": ..., "headers": ...}
+    不在這裡碰 DB，也不在這裡改 state。
+    """
+    source_id = source.get("id", "unknown")
+    url = build_url(source)
+    headers = build_headers(source, env, st)
+
+    async with sem:
+        try:
+            resp = await client.get(url, headers=headers)
+        except httpx.HTTPError as e:
+            log(f"[{source_id}] request error while fetching {url}: {e!r}")
+            return {"status": "error", "error": repr(e)}
 
-    if not version:
-        log(f"[{source.get('id','unknown')}] version field missing in response JSON: {data}")
-        raise RuntimeError("version field missing in Meilisearch response")
+    if resp.status_code == 304:
+        return {"status": "not_modified"}
 
-    return version, data
+    if resp.status_code != 200:
+        log(f"[{source_id}] non-200 status: {resp.status_code}, body={resp.text[:200]}")
+        return {"status": "error", "error": f"non-200 status: {resp.status_code}"}
+
+    try:
+        version, raw = extract_version(source, resp.content)
+    except Exception as e:
+        log(f"[{source_id}] failed to parse response: {e!r}, body={resp.text[:200]}")
+        return {"status": "error", "error": repr(e)}
+
+    return {
+        "status": "changed",
+        "version": version,
+        "raw": raw,
+        "etag": resp.headers.get("ETag"),
+        "last_modified": resp.headers.get("Last-Modified"),
+    }
 
 
-def process_meili_source(conn, source: Dict[str, Any], env: Dict[str, str]) -> None:
+async def poll_all(
+    sources: List[Dict[str, Any]],
+    env: Dict[str, str],
+    state: Dict[str, Dict[str, Any]],
+) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
     """
-    處理單一 Meilisearch source：
-    - 讀取上一個版本
-    - 抓取現在版本
-    - 若有變化則寫入 kc_api_changes
+    以一個共用連線池的 AsyncClient 併發輪詢所有 sources。
     """
-    source_id = source.get("id", "unknown")
+    limits = httpx.Limits(max_connections=MAX_CONCURRENCY, max_keepalive_connections=MAX_CONCURRENCY)
+    sem = asyncio.Semaphore(MAX_CONCURRENCY)
+    async with httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=limits) as client:
+        results = await asyncio.gather(
+            *[
+                poll_source(client, sem, src, env, state.get(src.get("id", "unknown")) or {})
+                for src in sources
+            ]
+        )
+    return list(zip(sources, results))
 
-    try:
-        last_version = get_last_version(conn, source_id)
-    except Exception as e:
-        log(f"[{source_id}] failed to get last_version: {e!r}")
-        last_version = None
 
-    try:
-        current_version, raw_json = fetch_meili_version(source, env)
-    except Exception as e:
-        log(f"[{source_id}] failed to fetch current version: {e!r}")
-        return
+# ------------------------------------------------------------
+# 一輪：輪詢 → 比對 → 批次寫入 → 更新 state
+# ------------------------------------------------------------
 
-    if current_version == last_version and last_version is not None:
-        log(f"[{source_id}] version unchanged: {current_version}")
-        return
+def run_cycle(
+    sources: List[Dict[str, Any]],
+    env: Dict[str, str],
+    state: Dict[str, Dict[str, Any]],
+    force: bool = False,
+) -> int:
+    """
+    跑一輪已到期的 sources，回傳 exit code（0 = OK, 1 = DB 失敗）。
+    state 會被就地更新（DB 失敗時也一樣，呼叫端照常 save_state）。
+    """
+    now = time.time()
+    due = due_sources(sources, state, now, force=force)
+    if not due:
+        log("no api sources due, skip")
+        return 0
 
-    change_type = classify_change(last_version, current_version)
+    log(f"polling {len(due)} api sources concurrently")
+    results = asyncio.run(poll_all(due, env, state))
 
-    log(
-        f"[{source_id}] version changed: {last_version} -> {current_version} "
-        f"(type={change_type})"
-    )
+    fetched = [(src, res) for src, res in results if res["status"] == "changed"]
 
-    try:
-        record_version_change(
-            conn=conn,
-            source_id=source_id,
-            prev_version=last_version,
-            new_version=current_version,
-            change_type=change_type,
-            raw_json=raw_json,
+    rc = 0
+    last_versions: Dict[str, Optional[str]] = {}
+    conn = None
+    if fetched:
+        try:
+            conn = get_db_connection(env)
+            last_versions = get_last_versions(conn, [src.get("id", "unknown") for src, _ in fetched])
+        except Exception as e:
+            log(f"failed to read last versions from DB: {e!r}")
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            conn = None
+            rc = 1
+            results = _db_failed(results)
+            fetched = []
+
+    changes: List[Dict[str, Any]] = []
+    detected_at = datetime.datetime.utcnow()
+    for src, res in fetched:
+        source_id = src.get("id", "unknown")
+        last_version = last_versions.get(source_id)
+        current_version = res["version"]
+        if current_version == last_version and last_version is not None:
+            log(f"[{source_id}] version unchanged: {current_version}")
+            continue
+
+        change_type = classify_change(last_version, current_version)
+        log(
+            f"[{source_id}] version changed: {last_version} -> {current_version} "
+            f"(type={change_type})"
+        )
+        changes.append(
+            {
+                "source_id": source_id,
+                "prev_version": last_version,
+                "new_version": current_version,
+                "change_type": change_type,
+                "detected_at": detected_at,
+                "raw_json": res["raw"],
+            }
         )
-    except Exception:
-        # record_version_change 已經 log & rollback，這裡再補一行
-        log(f"[{source_id}] failed to record version change in kc_api_changes")
+
+    if conn is not None:
+        try:
+            record_version_changes(conn, changes)
+            if changes:
+                log(f"recorded {len(changes)} api changes in kc_api_changes")
+        except Exception:
+            rc = 1
+            results = _db_failed(results)
+        finally:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    for src, res in results:
+        source_id = src.get("id", "unknown")
+        st = state.setdefault(source_id, {})
+        st["last_polled_at"] = now
+        if res["status"] == "error":
+            st["failures"] = int(st.get("failures") or 0) + 1
+            delay = backoff_seconds(st["failures"])
+            st["next_due_at"] = now + delay
+            log(f"[{source_id}] poll failed ({st['failures']}x), retry in {delay}s")
+            continue
+
+        st["failures"] = 0
+        st["next_due_at"] = now + freq_to_seconds(src.get("freq"))
+        if res["status"] == "not_modified":
+            log(f"[{source_id}] not modified (304)")
+            continue
+        st["etag"] = res.get("etag")
+        st["last_modified"] = res.get("last_modified")
+        st["last_version"] = res.get("version")
+
+    return rc
+
+
+def _db_failed(
+    results: List[Tuple[Dict[str, Any], Dict[str, Any]]],
+) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """
+    DB 讀 / 寫失敗時，抓到新版本的 source 當成這輪失敗：不推進 ETag / last_version，
+    照退避排下一次（不然 next_due_at 一直是過去，daemon 會每秒重打一次）；
+    其他 source（304 / 失敗）的排程照常更新。
+    """
+    return [
+        (src, {"status": "error", "error": "db unavailable"} if res["status"] == "changed" else res)
+        for src, res in results
+    ]
 
 
 # ------------------------------------------------------------
@@ -379,46 +665,44 @@ def process_meili_source(conn, source: Dict[str, Any], env: Dict[str, str]) -> N
 # ------------------------------------------------------------
 
 def main(argv: List[str]) -> int:
-    # 載 env（給 MySQL & Meili API key 用）
-    env = load_env(DOT_ENV_PATH)
-
-    # 載 sources_api.yaml
-    sources = load_sources(CONFIG_PATH)
+    force = "--force" in argv
+    daemon = "--daemon" in argv
 
-    if not sources:
-        log("no api sources configured, exit")
-        return 0
-
-    # 建立 DB 連線
-    try:
-        conn = get_db_connection(env)
-    except Exception as e:
-        log(f"failed to connect DB: {e!r}")
-        return 1
+    # 載 env（給 MySQL & API key 用）
+    env = load_env(DOT_ENV_PATH)
 
-    try:
-        for src in sources:
-            if not src.get("enabled", True):
-                continue
-
-            src_id = src.get("id", "unknown")
-            src_type = src.get("type", "http")
-            track = src.get("track") or []
-
-            # 目前僅處理 Meilisearch 類型：
-            # - type 為 http / http_json
-            # - track 包含 "version" 或未設定 track
-            if src_type in ("http", "http_json") and ("version" in track or not track):
-                process_meili_source(conn, src, env)
-            else:
-                log(f"[{src_id}] skip type={src_type}, track={track}")
-    finally:
+    if not daemon:
+        sources = load_sources(CONFIG_PATH)
+        if not sources:
+            log("no api sources configured, exit")
+            return 0
+        state = load_state(STATE_PATH)
         try:
-            conn.close()
-        except Exception:
-            pass
+            return run_cycle(sources, env, state, force=force)
+        finally:
+            save_state(STATE_PATH, state)
 
-    return 0
+    log("daemon mode: scheduling by source freq")
+    try:
+        while True:
+            # 每輪重讀設定，改 yaml 不用重啟
+            sources = load_sources(CONFIG_PATH)
+            state = load_state(STATE_PATH)
+            try:
+                run_cycle(sources, env, state, force=force)
+            finally:
+                # 輪詢到一半被 Ctrl-C 也把已經更新的排程寫回去
+                save_state(STATE_PATH, state)
+            force = False
+
+            wake_at = next_wakeup(sources, state)
+            sleep_s = DAEMON_MAX_SLEEP_SECONDS
+            if wake_at:
+                sleep_s = max(1.0, min(wake_at - time.time(), DAEMON_MAX_SLEEP_SECONDS))
+            time.sleep(sleep_s)
+    except KeyboardInterrupt:
+        log("daemon stopped")
+        return 0
 
 
 if __name__ == "__main__":
@@ -1,11 +1,13 @@
 """
 Knowledge Center DB utilities
 提供 get_connection() 給各種 collector 使用。
+連線從 ai-core 共用的 db_pool 借（pool 名稱 "knowledge_center"），用完 close() 即還回 pool。
 """
 
 import os
+import sys
+from pathlib import Path
 from typing import Any
-import mysql.connector
 
 try:
     from dotenv import load_dotenv
@@ -15,31 +17,44 @@ except Exception:
     # 沒裝也沒關係，當作環境變數已經由 systemd 載好了
     pass
 
+# ---- 讓我們可以從 ai-core 根目錄匯入 db_pool ----
+AI_CORE_DIR = Path(__file__).resolve().parents[1]  # /srv/cockswain-core/ai-core
+if str(AI_CORE_DIR) not in sys.path:
+    sys.path.insert(0, str(AI_CORE_DIR))
+
+from db_pool import get_pool  # type: ignore  # noqa: E402
+
 
 def get_connection() -> Any:
     """
-    建立一個 MySQL 連線。
+    從 knowledge_center 連線池借一條 MySQL 連線。
 
     預設：
       host    = localhost
+      port    = 3306
       user    = cockswain_core
       db_name = cockswain
       password 從環境變數 DB_PASSWORD（或 MYSQL_PASSWORD）取
 
     並且強制關閉 SSL（ssl_disabled=True），避免本機連線踩 SSL handshaking 的雷。
+    借出時一律 autocommit=True；需要整批 transaction 的呼叫端自己改成 False，
+    還回 pool 時未 commit 的交易會被 rollback。
     """
     host = os.getenv("DB_HOST", "localhost")
+    port = int(os.getenv("DB_PORT", "3306"))
     user = os.getenv("DB_USER", "cockswain_core")
     password = os.getenv("DB_PASSWORD") or os.getenv("MYSQL_PASSWORD")
     database = os.getenv("DB_NAME", "cockswain")
 
-    conn = mysql.connector.connect(
+    pool = get_pool(
+        "knowledge_center",
         host=host,
+        port=port,
         user=user,
         password=password,
         database=database,
         charset="utf8mb4",
-        autocommit=True,
         ssl_disabled=True,
+        autocommit=True,
     )
-    return conn
+    return pool.acquire()
@@ -5,7 +5,8 @@ from pathlib import Path
 from typing import List, Dict, Any, Optional
 
 from decimal import Decimal
-import mysql.connector
+
+from knowledge_center.db import get_connection
 
 
 # --- 基本路徑與 .env 載入 ---
@@ -41,26 +42,10 @@ def get_db_conn():
     """
     依照母機 .env 連線 MySQL。
     重點：禁用 SSL，走本機 plain 連線，避免 do_handshake 那個 bug。
+    連線與 knowledge_center.db 共用同一個 pool。
     """
     load_env(ENV_FILE)
-
-    host = os.getenv("DB_HOST", "localhost")
-    user = os.getenv("DB_USER", "cockswain_core")
-    password = os.getenv("DB_PASSWORD", "")
-    database = os.getenv("DB_NAME", "cockswain")
-    port = int(os.getenv("DB_PORT", "3306"))
-
-    cfg = {
-        "host": host,
-        "user": user,
-        "password": password,
-        "database": database,
-        "port": port,
-        # 關鍵：明確要求不要走 SSL
-        "ssl_disabled": True,
-    }
-
-    return mysql.connector.connect(**cfg)
+    return get_connection()
 
 
 # --- JSON 正規化工具 ---
@@ -1,28 +1,94 @@
 """
-Internal → Knowledge Center Bridge v1
+Internal → Knowledge Center Bridge v1.1
 - 負責把「舵手內部對話」產生的知識查詢需求，丟到 tempstore。
 - 之後可以由獨立的 collector 腳本去處理這些 JSON 任務。
+- 合併（coalescing）：同一個正規化後的 (question, intent) 在時間窗內重複出現時，
+  不再產生新的 request / 檔案，而是把既有 pending request 的 hit_count +1。
+  collector 會把 hit_count 以「累加」方式 upsert 進 kc_internal_requests，
+  所以 hit_count 也可以直接拿來排「最常被問的問題」。
 """
 
 import os
+import re
 import json
 import uuid
+import fcntl
+import hashlib
 import datetime
-from typing import Any, Dict
+import unicodedata
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator
 
 BASE_DIR = "/srv/cockswain-core/ai-core/tempstore/kc_internal_requests"
+COALESCE_INDEX_PATH = "/srv/cockswain-core/ai-core/tempstore/kc_internal_coalesce.json"
 
+# 同一個問題在多少秒內重複出現會被合併；0 表示關閉合併
+COALESCE_WINDOW_SECONDS = float(os.getenv("KC_INTERNAL_COALESCE_WINDOW", "600"))
 
-def queue_internal_knowledge_request(
+_WS_RE = re.compile(r"\s+")
+_TRAILING_PUNCT = " \t\r\n?？!！。.,，、~～"
+
+
+def normalize_question(text: str) -> str:
+    """
+    正規化問題文字：NFKC（全形轉半形）、casefold、壓縮空白、去掉結尾標點。
+    """
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    text = _WS_RE.sub(" ", text).strip()
+    return text.rstrip(_TRAILING_PUNCT)
+
+
+def coalesce_key(question: str, intent: str) -> str:
+    raw = normalize_question(question) + "\x1f" + (intent or "").strip().casefold()
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+@contextmanager
+def coalesce_lock() -> Iterator[None]:
+    """
+    跨 process 的檔案鎖，保護 coalesce index 與 pending 檔案的 read-modify-write。
+    collector 認領（claim）檔案時也會拿同一把鎖，避免 +1 寫到正要被收走的檔案上。
+    """
+    os.makedirs(os.path.dirname(COALESCE_INDEX_PATH), exist_ok=True)
+    with open(COALESCE_INDEX_PATH + ".lock", "a") as lock_f:
+        fcntl.flock(lock_f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_f, fcntl.LOCK_UN)
+
+
+def _load_index() -> Dict[str, Dict[str, Any]]:
+    try:
+        with open(COALESCE_INDEX_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _write_json_atomic(path: str, payload: Dict[str, Any]) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _write_request_file(payload: Dict[str, Any]) -> str:
+    ts = datetime.datetime.utcnow().isoformat()
+    filename = f"{ts.replace(':', '').replace('-', '')}_{payload['request_id']}.json"
+    filepath = os.path.join(BASE_DIR, filename)
+    # tmp + rename：collector 的 --watch 模式收到 moved_to 時，檔案一定是完整的
+    _write_json_atomic(filepath, payload)
+    return filepath
+
+
+def _queue_new_request(
     question: str,
     intent: str,
     parsed: Dict[str, Any],
+    key: Any,
 ) -> Dict[str, Any]:
-    """
-    建立一個知識查詢請求 JSON 檔，回傳 request_id 與檔案路徑。
-    """
-    os.makedirs(BASE_DIR, exist_ok=True)
-
     request_id = str(uuid.uuid4())
     ts = datetime.datetime.utcnow().isoformat()
 
@@ -34,15 +100,96 @@ def queue_internal_knowledge_request(
         "parsed": parsed,
         "status": "queued",
         "source": "internal_dialogue",
+        "dedup_key": key,
+        "hit_count": 1,
+        "last_hit_at": ts,
     }
 
-    filename = f"{ts.replace(':', '').replace('-', '')}_{request_id}.json"
-    filepath = os.path.join(BASE_DIR, filename)
-
-    with open(filepath, "w", encoding="utf-8") as f:
-        json.dump(payload, f, ensure_ascii=False, indent=2)
+    filepath = _write_request_file(payload)
 
     return {
         "request_id": request_id,
         "path": filepath,
+        "created_at": ts,
+        "coalesced": False,
+        "hit_count": 1,
+    }
+
+
+def queue_internal_knowledge_request(
+    question: str,
+    intent: str,
+    parsed: Dict[str, Any],
+) -> Dict[str, Any]:
+    """
+    建立（或合併進既有的）知識查詢請求 JSON 檔，回傳 request_id、檔案路徑、
+    是否為合併（coalesced）以及目前這個檔案累積的 hit_count。
+    """
+    os.makedirs(BASE_DIR, exist_ok=True)
+
+    if COALESCE_WINDOW_SECONDS <= 0:
+        return _queue_new_request(question, intent, parsed, key=None)
+
+    key = coalesce_key(question, intent)
+    now = datetime.datetime.utcnow()
+
+    with coalesce_lock():
+        index = _load_index()
+
+        # 順手清掉過期的 entry，index 大小只跟時間窗內的不同問題數有關
+        cutoff = now.timestamp() - COALESCE_WINDOW_SECONDS
+        index = {k: v for k, v in index.items() if v.get("first_seen", 0) >= cutoff}
+
+        entry = index.get(key)
+        if entry is None:
+            result = _queue_new_request(question, intent, parsed, key=key)
+            index[key] = {
+                "request_id": result["request_id"],
+                "created_at": result["created_at"],
+                "path": result["path"],
+                "first_seen": now.timestamp(),
+            }
+            _write_json_atomic(COALESCE_INDEX_PATH, index)
+            return result
+
+        path = entry["path"]
+        payload = None
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    payload = json.load(f)
+            except (FileNotFoundError, ValueError):
+                payload = None
+
+        if payload is not None:
+            # 還沒被 collector 收走：直接在同一個檔案上 +1
+            payload["hit_count"] = int(payload.get("hit_count") or 1) + 1
+            payload["last_hit_at"] = now.isoformat()
+            _write_json_atomic(path, payload)
+        else:
+            # 已經被 collector 收進 DB：開一個同 request_id 的「增量」檔，
+            # collector 會把 hit_count 累加到既有那一列上
+            payload = {
+                "request_id": entry["request_id"],
+                "created_at": entry["created_at"],
+                "question": question,
+                "intent": intent,
+                "parsed": parsed,
+                "status": "queued",
+                "source": "internal_dialogue",
+                "dedup_key": key,
+                "hit_count": 1,
+                "last_hit_at": now.isoformat(),
+            }
+            path = _write_request_file(payload)
+            entry["path"] = path
+
+        _write_json_atomic(COALESCE_INDEX_PATH, index)
+
+    return {
+        "request_id": entry["request_id"],
+        "path": path,
+        "created_at": entry["created_at"],
+        "coalesced": True,
+        "hit_count": payload["hit_count"],
     }
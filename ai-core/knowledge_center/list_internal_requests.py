@@ -2,8 +2,14 @@
 List Internal KC Requests v1.0
 - 從 kc_internal_requests 列出最近 N 筆 internal 工單
 - 方便你檢查舵手都在對自己提什麼問題
+- top：依 hit_count 排出「最常被問的問題」
+
+用法：
+    python3 -m knowledge_center.list_internal_requests          # 最近 20 筆
+    python3 -m knowledge_center.list_internal_requests top [N]  # 最常被問的 N 個問題
 """
 
+import sys
 from typing import Any
 import datetime
 
@@ -41,7 +47,38 @@ def list_recent_internal_requests(limit: int = 20) -> None:
         print(f"processed_at: {row['processed_at']}")
 
 
+def list_top_internal_requests(limit: int = 20) -> None:
+    conn = get_connection()
+    cursor = conn.cursor(dictionary=True)
+
+    sql = """
+    SELECT question, intent, hit_count, last_hit_at, status
+    FROM kc_internal_requests
+    ORDER BY hit_count DESC, last_hit_at DESC
+    LIMIT %s
+    """
+
+    cursor.execute(sql, (limit,))
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.close()
+
+    if not rows:
+        print("[INFO] 目前 kc_internal_requests 是空的。")
+        return
+
+    print(f"=== 最常被問的 {len(rows)} 個問題 ===")
+    for rank, row in enumerate(rows, start=1):
+        print(f"{rank:>3}. [{row['hit_count']}x] ({row['intent']}) {row['question']}")
+        print(f"     last_hit_at: {row['last_hit_at']}  status: {row['status']}")
+
+
 def main() -> None:
+    args = sys.argv[1:]
+    if args and args[0] == "top":
+        limit = int(args[1]) if len(args) > 1 else 20
+        list_top_internal_requests(limit=limit)
+        return
     list_recent_internal_requests(limit=20)
 
 
@@ -19,7 +19,7 @@ import time
 from pathlib import Path
 from datetime import datetime
 
-import mysql.connector
+from db_pool import get_connection
 
 # ====== MySQL 設定（跟你現有服務一樣）======
 MYSQL_DB = "cockswain"
@@ -37,12 +37,15 @@ BATCH_SIZE = 50    # 一次吃多少筆 task_runs
 
 
 def get_db():
-    return mysql.connector.connect(
+    """從共用連線池借 DB 連線；close() 即還回 pool"""
+    return get_connection(
+        "l5_reflect",
         user=MYSQL_USER,
         password=MYSQL_PASSWORD,
         database=MYSQL_DB,
         unix_socket=MYSQL_SOCKET,
         ssl_disabled=True,
+        autocommit=False,
     )
 
 
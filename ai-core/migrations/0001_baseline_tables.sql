@@ -0,0 +1,38 @@
+-- 0001_baseline_tables - 原本散在程式裡 CREATE TABLE IF NOT EXISTS 的表，集中到這裡
+--   task_runs    : orchestrator 每次執行寫一筆，l5_reflect 依 id 往後掃
+--   agent_stats  : l5_reflect 彙整的 agent 成功 / 失敗統計
+--   agent_deltas : services/sync_gateway 的雙舵手同步紀錄（原本每個 request 都 CREATE 一次）
+-- 索引 / unique key 一律放在 0002，讓「已存在的舊表」與「新建的表」走同一條路。
+
+CREATE TABLE IF NOT EXISTS task_runs (
+  id INT AUTO_INCREMENT PRIMARY KEY,
+  task_id INT,
+  agent VARCHAR(64),
+  backend VARCHAR(64),
+  status VARCHAR(32),
+  result_text TEXT,
+  started_at DATETIME,
+  ended_at DATETIME,
+  cost_token INT NULL,
+  cost_ms INT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS agent_stats (
+  id INT AUTO_INCREMENT PRIMARY KEY,
+  agent VARCHAR(64) NOT NULL,
+  total_runs INT NOT NULL DEFAULT 0,
+  success_runs INT NOT NULL DEFAULT 0,
+  failed_runs INT NOT NULL DEFAULT 0,
+  last_error TEXT NULL,
+  last_run_at DATETIME NULL,
+  updated_at DATETIME NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS agent_deltas (
+  id INT AUTO_INCREMENT PRIMARY KEY,
+  agent_id VARCHAR(64),
+  version VARCHAR(64),
+  payload JSON,
+  note TEXT,
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
@@ -0,0 +1,45 @@
+-- 0002_hot_query_indexes - 熱門查詢用的複合索引與 unique key
+-- 每個索引一條 ALTER：舊環境若已手動建過同名索引（errno 1061），schema_migrate 只會跳過那一條。
+-- 對應的查詢登記在 schema_migrate.HOT_QUERIES，`schema_migrate.py check` 會逐條 EXPLAIN。
+-- （l5_reflect 的 task_runs WHERE id > %s 走 PRIMARY KEY range，不需要另建索引）
+
+-- core_bridge.fetch_pending_tasks: WHERE status='pending' ORDER BY created_at
+ALTER TABLE tasks ADD KEY idx_status_created (status, created_at);
+
+-- scripts/daily_status_summary.py, round_engine_intent_fill.py: WHERE intent IS NULL OR intent = ''
+ALTER TABLE tasks ADD KEY idx_intent (intent);
+
+-- consensus_arbiter / l5_reflect: WHERE agent=%s（一個 agent 只該有一列）
+-- 舊環境可能因為 l5_reflect 的 SELECT-then-INSERT race 已經有重複列，直接加 unique key 會 1062；
+-- 先合併到 id 最小的那一列再刪掉其他列。計數取 MAX 而不是相加：l5_reflect 的 UPDATE 是
+-- WHERE agent=%s，同一個 agent 的每一列每次都被寫成同一組數字，相加會重複計算。
+UPDATE agent_stats keep_row
+JOIN (
+  SELECT agent,
+         MIN(id) AS keep_id,
+         MAX(total_runs) AS total_runs,
+         MAX(success_runs) AS success_runs,
+         MAX(failed_runs) AS failed_runs,
+         MAX(last_run_at) AS last_run_at,
+         MAX(updated_at) AS updated_at
+  FROM agent_stats
+  GROUP BY agent
+  HAVING COUNT(*) > 1
+) dup ON keep_row.id = dup.keep_id
+SET keep_row.total_runs = dup.total_runs,
+    keep_row.success_runs = dup.success_runs,
+    keep_row.failed_runs = dup.failed_runs,
+    keep_row.last_run_at = dup.last_run_at,
+    keep_row.updated_at = dup.updated_at;
+
+DELETE extra FROM agent_stats extra
+JOIN agent_stats keep_row ON keep_row.agent = extra.agent AND keep_row.id < extra.id;
+
+ALTER TABLE agent_stats ADD UNIQUE KEY uk_agent (agent);
+
+-- collect_api_changes.get_last_versions: WHERE source_id IN (...) GROUP BY source_id 取 MAX(id)
+-- 用 (source_id, id) 才能走 loose index scan（Using index for group-by）；外層再用 PRIMARY 取回那一列
+ALTER TABLE kc_api_changes ADD KEY idx_source_id (source_id, id);
+
+-- services/sync_gateway.get_latest: WHERE agent_id=%s ORDER BY created_at DESC LIMIT 1
+ALTER TABLE agent_deltas ADD KEY idx_agent_created (agent_id, created_at);
@@ -0,0 +1,12 @@
+-- 0003_kc_internal_hits - internal request 合併（coalescing）用欄位
+--   dedup_key   : 正規化 (question, intent) 的 sha1，見 internal_bridge.coalesce_key
+--   hit_count   : 同一個 request 被問了幾次（collector 以累加方式 upsert）
+--   last_hit_at : 最後一次被問的時間
+
+-- 每個欄位 / 索引各一條 ALTER：部分套用過的環境（errno 1060/1061）只會跳過已存在的那一條。
+
+ALTER TABLE kc_internal_requests ADD COLUMN dedup_key CHAR(40) NULL AFTER source;
+ALTER TABLE kc_internal_requests ADD COLUMN hit_count INT UNSIGNED NOT NULL DEFAULT 1 AFTER dedup_key;
+ALTER TABLE kc_internal_requests ADD COLUMN last_hit_at DATETIME NULL AFTER hit_count;
+ALTER TABLE kc_internal_requests ADD KEY idx_dedup_key (dedup_key);
+ALTER TABLE kc_internal_requests ADD KEY idx_hit_count (hit_count, last_hit_at);
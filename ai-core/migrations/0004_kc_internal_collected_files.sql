@@ -0,0 +1,11 @@
+-- 0004_kc_internal_collected_files - collector 已寫入 DB 的 request 檔
+--   file_name    : 原始檔名（不含 .claimed），每個檔案（含增量檔）一個，只會收一次
+--   collected_at : 跟 kc_internal_requests 的 upsert 同一個 transaction 寫入
+-- commit 之後、檔案搬走之前中斷時，重跑看到這裡有紀錄就只搬檔案，不會把 hit_count 再加一次。
+
+CREATE TABLE IF NOT EXISTS kc_internal_collected_files (
+  file_name VARCHAR(191) NOT NULL PRIMARY KEY,
+  request_uuid VARCHAR(64) NULL,
+  collected_at DATETIME NOT NULL,
+  KEY idx_collected_at (collected_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
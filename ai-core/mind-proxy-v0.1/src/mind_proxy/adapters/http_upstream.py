@@ -1,21 +1,308 @@
 
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+
 import httpx
+from prometheus_client import Counter, Histogram
 from pydantic import BaseModel
 
+# 多個 upstream（hybrid-engine instance）：
+# - 每個 upstream 有自己的 weight、breaker、延遲 EWMA、in-flight 數與最近 N 次延遲（算 p95）
+# - power-of-two-choices：依 weight 隨機抽兩個，挑 score = ewma * (inflight + 1) / weight 小的；
+#   breaker 開著的跳過
+# - 失敗（連不上 / 5xx）換下一個 upstream，最多試 max_attempts 個；只有 connect 階段的錯才換，
+#   送出去之後才出的錯（ReadTimeout 等）upstream 可能已經在生成了，重送會變成兩份，直接丟給呼叫端
+# - hedge（選配）：第一個過了該 upstream 的 p95 還沒回，就對另一個 upstream 再送一次，
+#   先回來的贏，另一個取消；最少等 hedge_min_seconds，樣本不夠時用 hedge_default_seconds
+# - open_stream：串流用，拿到 upstream 的 status / headers 就回來，body 交給呼叫端一段一段讀；
+#   還沒回 headers 前失敗一樣換 upstream，但不 hedge（同一段生成跑兩份太貴）
+
+UPSTREAM_REQUESTS = Counter("mind_proxy_upstream_requests_total", "Requests sent to upstreams", ["upstream", "result"])
+UPSTREAM_LATENCY = Histogram(
+    "mind_proxy_upstream_latency_seconds",
+    "Upstream response time",
+    ["upstream"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60),
+)
+UPSTREAM_TTFB = Histogram(
+    "mind_proxy_upstream_ttfb_seconds",
+    "Time until an upstream returns response headers (streaming requests)",
+    ["upstream"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30),
+)
+UPSTREAM_BREAKER = Counter(
+    "mind_proxy_upstream_breaker_total", "Per-upstream circuit breaker decisions", ["upstream", "result"]
+)
+UPSTREAM_HEDGES = Counter("mind_proxy_upstream_hedges_total", "Hedged upstream requests", ["result"])
+
+
+# request 確定還沒送到 upstream 的錯，換一個 upstream 重送是安全的
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
 class UpstreamResponse(BaseModel):
     status: int
     text: str
 
+
+class NoUpstreamAvailable(Exception):
+    pass
+
+
+def parse_upstreams(raw: str, default_url: str) -> List[Tuple[str, float]]:
+    """ "http://a:7790=2,http://b:7790" → [(url, weight), ...]；沒設就只有 default_url """
+    out: List[Tuple[str, float]] = []
+    for part in (raw or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        url, weight = part, 1.0
+        if "=" in part:
+            url, w = part.rsplit("=", 1)
+            try:
+                weight = float(w)
+            except ValueError:
+                url = part
+        if weight > 0:
+            out.append((url.strip(), weight))
+    return out or [(default_url, 1.0)]
+
+
 class HttpUpstream:
-    def __init__(self, base_url: str, timeout: float = 30):
+    def __init__(
+        self,
+        base_url: str,
+        timeout: float = 30,
+        weight: float = 1.0,
+        breaker=None,
+        client: Optional[httpx.AsyncClient] = None,
+        ewma_alpha: float = 0.3,
+        window: int = 100,
+    ):
         self.base_url = base_url.rstrip('/')
         self.timeout = timeout
-        self.client = httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout)
+        self.weight = weight
+        self.breaker = breaker
+        self._own_client = client is None
+        self.client = client or httpx.AsyncClient(timeout=self.timeout)
+        self.ewma_alpha = ewma_alpha
+        self.ewma: Optional[float] = None
+        self.inflight = 0
+        self.latencies: Deque[float] = deque(maxlen=window)
 
     async def close(self):
-        await self.client.aclose()
+        if self._own_client:
+            await self.client.aclose()
+
+    def score(self) -> float:
+        # 還沒有樣本的 upstream 當成很快，讓它先拿到流量
+        return (self.ewma or 0.0) * (self.inflight + 1) / self.weight
+
+    def p95(self, min_samples: int = 20) -> Optional[float]:
+        if len(self.latencies) < min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    def observe(self, seconds: float) -> None:
+        self.latencies.append(seconds)
+        self.ewma = seconds if self.ewma is None else self.ewma + self.ewma_alpha * (seconds - self.ewma)
+        UPSTREAM_LATENCY.labels(self.base_url).observe(seconds)
+
+    async def acquire(self) -> bool:
+        if self.breaker is None:
+            return True
+        ok = await self.breaker.acquire()
+        UPSTREAM_BREAKER.labels(self.base_url, "allowed" if ok else "rejected").inc()
+        return ok
+
+    async def report(self, ok: bool) -> None:
+        UPSTREAM_REQUESTS.labels(self.base_url, "ok" if ok else "error").inc()
+        if self.breaker is not None:
+            await self.breaker.report(ok)
 
     async def chat(self, payload: dict) -> UpstreamResponse:
         # Generic forwarding to /chat (POST)
-        r = await self.client.post("/chat", json=payload)
+        self.inflight += 1
+        t0 = time.perf_counter()
+        try:
+            r = await self.client.post(f"{self.base_url}/chat", json=payload, timeout=self.timeout)
+        except Exception:
+            await self.report(False)
+            raise
+        finally:
+            self.inflight -= 1
+        self.observe(time.perf_counter() - t0)
+        await self.report(r.status_code < 500)
         return UpstreamResponse(status=r.status_code, text=r.text)
+
+    async def open_stream(self, path: str, content: bytes, headers: Dict[str, str]) -> httpx.Response:
+        """回傳還沒讀 body 的 response；呼叫端讀完或放棄時一定要 close_stream"""
+        self.inflight += 1
+        try:
+            req = self.client.build_request(
+                "POST", f"{self.base_url}{path}", content=content, headers=headers, timeout=self.timeout
+            )
+            t0 = time.perf_counter()
+            r = await self.client.send(req, stream=True)
+            UPSTREAM_TTFB.labels(self.base_url).observe(time.perf_counter() - t0)
+        except BaseException as e:
+            self.inflight -= 1
+            if isinstance(e, Exception):
+                await self.report(False)
+            raise
+        await self.report(r.status_code < 500)
+        return r
+
+    async def close_stream(self, r: httpx.Response) -> None:
+        try:
+            await r.aclose()
+        finally:
+            self.inflight -= 1
+
+
+class UpstreamPool:
+    def __init__(
+        self,
+        upstreams: List[Tuple[str, float]],
+        timeout: float = 30,
+        breaker_factory: Optional[Callable[[str], object]] = None,
+        max_attempts: int = 2,
+        hedge: bool = False,
+        hedge_min_seconds: float = 0.05,
+        hedge_default_seconds: float = 2.0,
+        client: Optional[httpx.AsyncClient] = None,
+    ):
+        self.client = client or httpx.AsyncClient(timeout=timeout)
+        self.upstreams = [
+            HttpUpstream(url, timeout, weight, breaker_factory(url) if breaker_factory else None, self.client)
+            for url, weight in upstreams
+        ]
+        self.max_attempts = max(1, max_attempts)
+        self.hedge = hedge
+        self.hedge_min_seconds = hedge_min_seconds
+        self.hedge_default_seconds = hedge_default_seconds
+
+    @property
+    def base_url(self) -> str:
+        return ",".join(u.base_url for u in self.upstreams)
+
+    async def close(self):
+        await self.client.aclose()
+
+    def _two_choices(self, candidates: List[HttpUpstream]) -> List[HttpUpstream]:
+        """依 weight 抽兩個不同的，score 小的排前面，其餘照原順序接在後面（給 breaker 開著時遞補）"""
+        if len(candidates) <= 2:
+            return sorted(candidates, key=lambda u: u.score())
+        a = random.choices(candidates, weights=[u.weight for u in candidates])[0]
+        rest = [u for u in candidates if u is not a]
+        b = random.choices(rest, weights=[u.weight for u in rest])[0]
+        pair = sorted((a, b), key=lambda u: u.score())
+        return pair + [u for u in candidates if u is not a and u is not b]
+
+    async def pick(self, exclude: Optional[Set[HttpUpstream]] = None) -> Optional[HttpUpstream]:
+        exclude = exclude or set()
+        for u in self._two_choices([u for u in self.upstreams if u not in exclude]):
+            if await u.acquire():
+                return u
+        return None
+
+    def hedge_delay(self, u: HttpUpstream) -> float:
+        p95 = u.p95()
+        return max(self.hedge_min_seconds, self.hedge_default_seconds if p95 is None else p95)
+
+    async def chat(self, payload: dict) -> Tuple[UpstreamResponse, HttpUpstream]:
+        """
+        回傳 (response, 實際回應的 upstream)；全部失敗時回最後一個 5xx，沒有就把最後的錯丟出去。
+        只有 RETRYABLE_ERRORS 跟 5xx 會換 upstream；ReadTimeout 之類的錯不再重送。
+        """
+        first = await self.pick()
+        if first is None:
+            raise NoUpstreamAvailable("all upstreams are unavailable")
+        tried: Set[HttpUpstream] = {first}
+        hedges: Set[HttpUpstream] = set()
+        tasks: Dict["asyncio.Task[UpstreamResponse]", HttpUpstream] = {asyncio.ensure_future(first.chat(payload)): first}
+        hedged = not self.hedge
+        last: Optional[Tuple[UpstreamResponse, HttpUpstream]] = None
+        last_exc: Optional[BaseException] = None
+        terminal = False
+        try:
+            while tasks:
+                timeout = None if hedged else self.hedge_delay(first)
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    extra = await self.pick(tried)
+                    if extra is not None:
+                        tried.add(extra)
+                        hedges.add(extra)
+                        tasks[asyncio.ensure_future(extra.chat(payload))] = extra
+                        UPSTREAM_HEDGES.labels("launched").inc()
+                    continue
+                for t in done:
+                    u = tasks.pop(t)
+                    try:
+                        resp = t.result()
+                    except Exception as e:
+                        last_exc = e
+                        terminal = terminal or not isinstance(e, RETRYABLE_ERRORS)
+                        continue
+                    if resp.status < 500:
+                        if u in hedges:
+                            UPSTREAM_HEDGES.labels("won").inc()
+                        return resp, u
+                    last = (resp, u)
+                if not tasks and not terminal and len(tried) < self.max_attempts:
+                    # 失敗（連不上 / 5xx）換一個 upstream 再試；還在跑的 hedge 照樣等它回來
+                    nxt = await self.pick(tried)
+                    if nxt is not None:
+                        tried.add(nxt)
+                        tasks[asyncio.ensure_future(nxt.chat(payload))] = nxt
+        finally:
+            # 輸掉的 hedge 直接取消（不算 breaker 失敗）
+            for t in tasks:
+                t.cancel()
+        if last is not None:
+            return last
+        raise last_exc or NoUpstreamAvailable("all upstreams failed")
+
+    async def open_stream(
+        self, path: str, content: bytes, headers: Dict[str, str]
+    ) -> Tuple[httpx.Response, HttpUpstream]:
+        """
+        連不上 / 5xx 換下一個 upstream（body 還沒開始送給 client，重試是安全的）；
+        等 headers 時 ReadTimeout 之類的錯不換（upstream 可能已經在生成），直接丟出去；
+        全部失敗時回最後一個 5xx（body 照樣轉給 client），沒有就把最後的錯丟出去
+        """
+        tried: Set[HttpUpstream] = set()
+        last: Optional[Tuple[httpx.Response, HttpUpstream]] = None
+        last_exc: Optional[BaseException] = None
+        try:
+            while len(tried) < self.max_attempts:
+                u = await self.pick(tried)
+                if u is None:
+                    break
+                tried.add(u)
+                try:
+                    r = await u.open_stream(path, content, headers)
+                except RETRYABLE_ERRORS as e:
+                    last_exc = e
+                    continue
+                # 5xx 先留著不關：後面沒有 upstream 可換時就把它原樣回給 client
+                if last is not None:
+                    await last[1].close_stream(last[0])
+                last = (r, u)
+                if r.status_code < 500:
+                    return last
+        except BaseException:
+            if last is not None:
+                await last[1].close_stream(last[0])
+            raise
+        if last is not None:
+            return last
+        if last_exc is None:
+            raise NoUpstreamAvailable("all upstreams are unavailable")
+        raise last_exc
@@ -6,18 +6,45 @@ import os
 class Settings(BaseModel):
     host: str = os.getenv("MP_HOST", "127.0.0.1")
     port: int = int(os.getenv("MP_PORT", "7780"))
+    workers: int = int(os.getenv("MP_WORKERS", "1"))
     log_level: str = os.getenv("MP_LOG_LEVEL", "info")
     allowed_origins: str = os.getenv("MP_ALLOWED_ORIGINS", "*")
     upstream_base_url: str = os.getenv("UPSTREAM_BASE_URL", "http://127.0.0.1:7790")
     upstream_timeout_seconds: float = float(os.getenv("UPSTREAM_TIMEOUT_SECONDS", "30"))
+    # 多個 upstream：url=weight，逗號分隔；沒設就只用 UPSTREAM_BASE_URL
+    upstreams: str = os.getenv("UPSTREAMS", "")
+    upstream_max_attempts: int = int(os.getenv("UPSTREAM_MAX_ATTEMPTS", "2"))
+    upstream_hedge_enabled: bool = os.getenv("UPSTREAM_HEDGE_ENABLED", "false").lower() == "true"
+    upstream_hedge_min_seconds: float = float(os.getenv("UPSTREAM_HEDGE_MIN_SECONDS", "0.05"))
+    upstream_hedge_default_seconds: float = float(os.getenv("UPSTREAM_HEDGE_DEFAULT_SECONDS", "2"))
     rate_limit_enabled: bool = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
     rate_limit_tokens: int = int(os.getenv("RATE_LIMIT_TOKENS", "60"))
     rate_limit_refill_per_sec: float = float(os.getenv("RATE_LIMIT_REFILL_PER_SEC", "1"))
+    rate_limit_max_keys: int = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+    rate_limit_shards: int = int(os.getenv("RATE_LIMIT_SHARDS", "16"))
+    rate_limit_routes: str = os.getenv("RATE_LIMIT_ROUTES", "")
+    rate_limit_key_costs: str = os.getenv("RATE_LIMIT_KEY_COSTS", "")
+    # 依 upstream RTT 自動調整同時打 upstream 的數量（gradient | aimd）
+    concurrency_enabled: bool = os.getenv("CONCURRENCY_ENABLED", "true").lower() == "true"
+    concurrency_algorithm: str = os.getenv("CONCURRENCY_ALGORITHM", "gradient")
+    concurrency_initial_limit: int = int(os.getenv("CONCURRENCY_INITIAL_LIMIT", "20"))
+    concurrency_min_limit: int = int(os.getenv("CONCURRENCY_MIN_LIMIT", "2"))
+    concurrency_max_limit: int = int(os.getenv("CONCURRENCY_MAX_LIMIT", "200"))
+    concurrency_queue_size: int = int(os.getenv("CONCURRENCY_QUEUE_SIZE", "50"))
+    concurrency_queue_timeout_seconds: float = float(os.getenv("CONCURRENCY_QUEUE_TIMEOUT_SECONDS", "0.5"))
+    concurrency_aimd_latency_seconds: float = float(os.getenv("CONCURRENCY_AIMD_LATENCY_SECONDS", "0"))
+    # 同一個 x-request-id 的重試：還在跑就等同一個結果，跑完的在 TTL 內直接回存好的
+    idempotency_enabled: bool = os.getenv("IDEMPOTENCY_ENABLED", "true").lower() == "true"
+    idempotency_ttl_seconds: float = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "600"))
+    idempotency_max_entries: int = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
     cb_enabled: bool = os.getenv("CB_ENABLED", "true").lower() == "true"
     cb_fail_threshold: int = int(os.getenv("CB_FAIL_THRESHOLD", "5"))
     cb_cooldown_seconds: float = float(os.getenv("CB_COOLDOWN_SECONDS", "15"))
     redis_enabled: bool = os.getenv("REDIS_ENABLED", "false").lower() == "true"
     redis_url: str = os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0")
+    # 限流 / 熔斷 state 放哪：memory（單 worker）、redis、shm（同機多 worker）；沒設時 REDIS_ENABLED=true 就用 redis
+    state_backend: str = os.getenv("STATE_BACKEND", "redis" if os.getenv("REDIS_ENABLED", "false").lower() == "true" else "memory")
+    shm_path: str = os.getenv("MP_SHM_PATH", "/dev/shm/mind-proxy.state")
 
 @lru_cache
 def get_settings() -> Settings:
@@ -1,39 +1,175 @@
 
-from fastapi import APIRouter, Request, HTTPException
+from fastapi import APIRouter, Request, HTTPException, Response
 from .schemas import ChatRequest, ProxyResponse
 from ..core.config import get_settings
-from ..adapters.http_upstream import HttpUpstream
-from ..utils.rate_limit import MemoryRateLimiter
-from ..utils.circuit_breaker import CircuitBreaker
+from ..adapters.http_upstream import NoUpstreamAvailable, UpstreamPool, parse_upstreams
+from ..utils.rate_limit import MemoryRateLimiter, SharedRateLimiter, parse_key_costs, parse_route_policies
+from ..utils.circuit_breaker import CircuitBreaker, SharedCircuitBreaker
+from ..utils.state import build_state
+from ..utils.concurrency import AdaptiveLimiter, ConcurrencyRejected
+from ..utils.idempotency import IdempotencyCache, IdempotencyConflict, fingerprint
+from ..utils.streaming import PassthroughResponse, forward_headers
+import asyncio
 import uuid
 
 router = APIRouter()
 settings = get_settings()
-rate = MemoryRateLimiter(settings.rate_limit_tokens, settings.rate_limit_refill_per_sec)
-breaker = CircuitBreaker(settings.cb_fail_threshold, settings.cb_cooldown_seconds)
-upstream = HttpUpstream(settings.upstream_base_url, settings.upstream_timeout_seconds)
+rate = MemoryRateLimiter(
+    settings.rate_limit_tokens,
+    settings.rate_limit_refill_per_sec,
+    max_keys=settings.rate_limit_max_keys,
+    shards=settings.rate_limit_shards,
+    routes=parse_route_policies(settings.rate_limit_routes),
+    key_costs=parse_key_costs(settings.rate_limit_key_costs),
+)
+rate.export_metrics()
+# 多 worker 時限流 / 熔斷走共享 state；本 process 的 rate / breaker 留著當 fallback
+state = build_state(settings.state_backend, settings.redis_url, settings.shm_path, settings.rate_limit_max_keys)
+if state is not None:
+    rate = SharedRateLimiter(
+        state,
+        settings.rate_limit_tokens,
+        settings.rate_limit_refill_per_sec,
+        routes=rate.routes,
+        key_costs=rate.key_costs,
+        fallback=rate,
+    )
+
+
+def make_breaker(url: str):
+    # 每個 upstream 一個 breaker
+    if not settings.cb_enabled:
+        return None
+    if state is not None:
+        return SharedCircuitBreaker(state, f"upstream:{url}", settings.cb_fail_threshold, settings.cb_cooldown_seconds)
+    return CircuitBreaker(settings.cb_fail_threshold, settings.cb_cooldown_seconds)
+
+
+upstream = UpstreamPool(
+    parse_upstreams(settings.upstreams, settings.upstream_base_url),
+    settings.upstream_timeout_seconds,
+    breaker_factory=make_breaker,
+    max_attempts=settings.upstream_max_attempts,
+    hedge=settings.upstream_hedge_enabled,
+    hedge_min_seconds=settings.upstream_hedge_min_seconds,
+    hedge_default_seconds=settings.upstream_hedge_default_seconds,
+)
+idempotency = IdempotencyCache(settings.idempotency_max_entries, settings.idempotency_ttl_seconds)
+limiter = AdaptiveLimiter(
+    settings.concurrency_algorithm,
+    initial_limit=settings.concurrency_initial_limit,
+    min_limit=settings.concurrency_min_limit,
+    max_limit=settings.concurrency_max_limit,
+    queue_size=settings.concurrency_queue_size,
+    queue_timeout=settings.concurrency_queue_timeout_seconds,
+    aimd_latency_seconds=settings.concurrency_aimd_latency_seconds,
+) if settings.concurrency_enabled else None
+
+
+async def call_upstream(payload: dict):
+    if limiter is None:
+        return await upstream.chat(payload)
+    async with limiter.slot() as s:
+        resp, served_by = await upstream.chat(payload)
+        if resp.status >= 500:
+            s.fail()
+        return resp, served_by
+
+
+async def open_upstream_stream(body: bytes, headers: dict):
+    """名額一直佔到串流結束（回傳的 slot 由呼叫端 release）；RTT 只算到 upstream 回 headers"""
+    slot = await limiter.acquire() if limiter is not None else None
+    try:
+        r, served_by = await upstream.open_stream("/chat", body, headers)
+    except asyncio.CancelledError:
+        if slot is not None:
+            slot.release()
+        raise
+    except Exception:
+        if slot is not None:
+            slot.fail()
+            slot.sample()
+            slot.release()
+        raise
+    if slot is not None:
+        if r.status_code >= 500:
+            slot.fail()
+        slot.sample()
+    return r, served_by, slot
+
+
+def overloaded(e: ConcurrencyRejected) -> HTTPException:
+    return HTTPException(status_code=503, detail=f"overloaded: {e.reason}", headers={"Retry-After": "1"})
+
 
 @router.post("/v1/proxy/chat", response_model=ProxyResponse)
-async def proxy_chat(req: Request, body: ChatRequest):
-    rid = req.headers.get("x-request-id") or str(uuid.uuid4())
+async def proxy_chat(req: Request, body: ChatRequest, response: Response):
+    client_rid = req.headers.get("x-request-id")
+    rid = client_rid or str(uuid.uuid4())
     ip = req.client.host if req.client else "unknown"
-    if settings.rate_limit_enabled and not rate.check(ip):
+    if settings.rate_limit_enabled and not await rate.acquire(ip, route="/v1/proxy/chat"):
         raise HTTPException(status_code=429, detail="rate limited")
 
-    if settings.cb_enabled and not breaker.allow():
+    payload = body.model_dump()
+    try:
+        if settings.idempotency_enabled and client_rid:
+            # client 自己帶的 request id 才當 idempotency key（自動產生的每次都不同，存了也用不到）
+            (resp, served_by), outcome = await idempotency.run(
+                client_rid,
+                fingerprint(body.model_dump_json().encode()),
+                lambda: call_upstream(payload),
+                should_keep=lambda result: result[0].status < 500,
+            )
+            if outcome != "miss":
+                response.headers["x-idempotent-replay"] = outcome
+        else:
+            resp, served_by = await call_upstream(payload)
+        return ProxyResponse(status=resp.status, body=resp.text, upstream=served_by.base_url, request_id=rid)
+    except ConcurrencyRejected as e:
+        raise overloaded(e)
+    except IdempotencyConflict:
+        raise HTTPException(status_code=409, detail="x-request-id was already used with a different body")
+    except NoUpstreamAvailable:
         raise HTTPException(status_code=503, detail="upstream temporarily unavailable")
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"upstream error: {e}")
+
+@router.post("/v1/proxy/chat/stream")
+async def proxy_chat_stream(req: Request):
+    """
+    串流版：request body 原樣轉給 upstream 的 /chat，upstream 的 status / headers / body bytes 原樣回給 client，
+    不解碼、不整包收完。client 斷線時關掉 upstream 連線。
+    """
+    rid = req.headers.get("x-request-id") or str(uuid.uuid4())
+    ip = req.client.host if req.client else "unknown"
+    if settings.rate_limit_enabled and not await rate.acquire(ip, route="/v1/proxy/chat/stream"):
+        raise HTTPException(status_code=429, detail="rate limited")
 
+    headers = forward_headers(req.headers, drop=("host", "content-length"))
+    headers["x-request-id"] = rid
     try:
-        resp = await upstream.chat(body.model_dump())
-        if 200 <= resp.status < 500:
-            breaker.record_success()
-        else:
-            breaker.record_failure()
-        return ProxyResponse(status=resp.status, body=resp.text, upstream=settings.upstream_base_url, request_id=rid)
+        r, served_by, slot = await open_upstream_stream(await req.body(), headers)
+    except ConcurrencyRejected as e:
+        raise overloaded(e)
+    except NoUpstreamAvailable:
+        raise HTTPException(status_code=503, detail="upstream temporarily unavailable")
     except Exception as e:
-        breaker.record_failure()
         raise HTTPException(status_code=502, detail=f"upstream error: {e}")
 
+    async def close():
+        try:
+            await served_by.close_stream(r)
+        finally:
+            if slot is not None:
+                slot.release()
+
+    out_headers = forward_headers(r.headers)
+    out_headers["x-request-id"] = rid
+    out_headers["x-upstream"] = served_by.base_url
+    return PassthroughResponse(
+        r.aiter_raw(), status_code=r.status_code, headers=out_headers, on_close=close
+    )
+
 @router.get("/health")
 async def health():
     return {"status":"ok"}
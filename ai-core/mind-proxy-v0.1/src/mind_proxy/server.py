@@ -1,19 +1,27 @@
 
 import uvicorn
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from prometheus_client import Counter, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 from starlette.responses import Response
 from .core.config import get_settings
 from .utils.logging import setup_logging
+from .utils.metrics import PrometheusMiddleware
+from .routes import http as http_routes
 from .routes.http import router as http_router
 
 settings = get_settings()
 log = setup_logging(settings.log_level)
 
-REQ_COUNTER = Counter("mind_proxy_requests_total", "Total HTTP requests", ["path", "method", "code"])
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await http_routes.upstream.close()
+    if http_routes.state is not None:
+        await http_routes.state.close()
 
-app = FastAPI(title="mind-proxy", version="0.1.0")
+app = FastAPI(title="mind-proxy", version="0.1.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -23,14 +31,7 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.middleware("http")
-async def prom_mw(request, call_next):
-    response = await call_next(request)
-    try:
-        REQ_COUNTER.labels(path=request.url.path, method=request.method, code=str(response.status_code)).inc()
-    except Exception:
-        pass
-    return response
+app.add_middleware(PrometheusMiddleware)
 
 app.include_router(http_router)
 
@@ -40,5 +41,8 @@ def metrics():
     return Response(content=data, media_type=CONTENT_TYPE_LATEST)
 
 def run():
-    log.info("starting", host=settings.host, port=settings.port, upstream=settings.upstream_base_url)
-    uvicorn.run("mind_proxy.server:app", host=settings.host, port=settings.port, reload=False, workers=1)
+    log.info("starting", host=settings.host, port=settings.port, upstream=http_routes.upstream.base_url,
+             workers=settings.workers, state_backend=settings.state_backend)
+    if settings.workers > 1 and settings.state_backend == "memory":
+        log.warning("multiple workers with in-memory state: rate limits and breaker are per worker")
+    uvicorn.run("mind_proxy.server:app", host=settings.host, port=settings.port, reload=False, workers=settings.workers)
@@ -1,6 +1,11 @@
 
+import logging
 import time
 
+from .state import STATE_FALLBACK
+
+log = logging.getLogger(__name__)
+
 class CircuitBreaker:
     def __init__(self, fail_threshold: int, cooldown_seconds: float):
         self.fail_threshold = fail_threshold
@@ -31,3 +36,43 @@ class CircuitBreaker:
         if self.state == "half-open":
             return True
         return True
+
+    # 跟 SharedCircuitBreaker 同一組介面，routes 不用管 state 放在哪
+    async def acquire(self) -> bool:
+        return self.allow()
+
+    async def report(self, ok: bool) -> None:
+        if ok:
+            self.record_success()
+        else:
+            self.record_failure()
+
+
+class SharedCircuitBreaker:
+    """
+    狀態放在共享 state（utils/state.py），多個 worker 一起計失敗數、一起開關。
+    state 連不上時退回本 process 的 CircuitBreaker。
+    """
+
+    def __init__(self, state, name: str, fail_threshold: int, cooldown_seconds: float):
+        self.state = state
+        self.name = name
+        self.fail_threshold = fail_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.fallback = CircuitBreaker(fail_threshold, cooldown_seconds)
+
+    async def acquire(self) -> bool:
+        try:
+            return await self.state.breaker_allow(self.name, self.cooldown_seconds)
+        except Exception as e:
+            log.warning("shared breaker unavailable, using local state: %r", e)
+            STATE_FALLBACK.labels("breaker").inc()
+            return self.fallback.allow()
+
+    async def report(self, ok: bool) -> None:
+        try:
+            await self.state.breaker_record(self.name, ok, self.fail_threshold)
+        except Exception as e:
+            log.warning("shared breaker unavailable, using local state: %r", e)
+            STATE_FALLBACK.labels("breaker").inc()
+            await self.fallback.report(ok)
@@ -0,0 +1,210 @@
+
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# 依 upstream RTT 自動調整同時打 upstream 的數量（in-flight limit）：
+# - gradient（預設，類似 Netflix Gradient2）：長期 RTT（EWMA）/ 這次 RTT 當 gradient，
+#   RTT 變慢 limit 就跟著縮；in-flight 不到 limit 一半時不往上長（流量不夠，RTT 看不出容量）
+# - aimd：成功且 in-flight 過半就 +1；失敗（或 RTT 超過 aimd_latency_seconds）就乘 backoff
+# 兩種演算法在失敗（例外 / 5xx）時都乘 backoff。
+# 超過 limit 的請求排進 FIFO 佇列，最多 queue_size 個、最多等 queue_timeout 秒，否則快速拒絕
+# （reason=queue_full|queue_timeout）。
+
+CONCURRENCY_LIMIT = Gauge("mind_proxy_concurrency_limit", "Current adaptive in-flight limit for upstream requests")
+CONCURRENCY_INFLIGHT = Gauge("mind_proxy_concurrency_inflight", "Upstream requests currently in flight")
+CONCURRENCY_QUEUED = Gauge("mind_proxy_concurrency_queued", "Requests waiting for an in-flight slot")
+CONCURRENCY_REJECTED = Counter("mind_proxy_concurrency_rejected_total", "Requests rejected by the adaptive limiter", ["reason"])
+CONCURRENCY_WAIT = Histogram(
+    "mind_proxy_concurrency_wait_seconds",
+    "Time spent waiting for an in-flight slot",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2),
+)
+
+
+class ConcurrencyRejected(Exception):
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class Slot:
+    """
+    拿到的一個 in-flight 名額。一般用 limiter.slot() 包起來自動處理；
+    串流這種名額要活得比 handler 久的，用 limiter.acquire() 拿，
+    收到 upstream headers 時 sample()（RTT 算到第一個 byte），串流結束再 release()。
+    """
+
+    __slots__ = ("_limiter", "t0", "inflight", "ok", "_sampled", "_released")
+
+    def __init__(self, limiter: "AdaptiveLimiter") -> None:
+        self._limiter = limiter
+        self.t0 = time.perf_counter()
+        self.inflight = limiter.inflight
+        self.ok = True
+        self._sampled = False
+        self._released = False
+
+    def fail(self) -> None:
+        """回應拿到了但算失敗（例如 5xx）；limit 會往下調"""
+        self.ok = False
+
+    def sample(self) -> None:
+        """把到目前為止的時間當 RTT 回報一次（重複呼叫只算第一次）"""
+        if not self._sampled:
+            self._sampled = True
+            self._limiter._on_sample(time.perf_counter() - self.t0, self.ok, self.inflight)
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._limiter._release()
+
+
+class AdaptiveLimiter:
+    def __init__(
+        self,
+        algorithm: str = "gradient",
+        initial_limit: int = 20,
+        min_limit: int = 2,
+        max_limit: int = 200,
+        queue_size: int = 50,
+        queue_timeout: float = 0.5,
+        backoff: float = 0.9,
+        smoothing: float = 0.2,
+        tolerance: float = 1.5,
+        long_window: int = 600,
+        aimd_latency_seconds: float = 0.0,
+    ):
+        self.algorithm = algorithm
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self._limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self.tolerance = tolerance
+        self._long_alpha = 2.0 / (long_window + 1)
+        self._long_rtt: Optional[float] = None
+        self.aimd_latency_seconds = aimd_latency_seconds
+        self.inflight = 0
+        self._waiters: Deque["asyncio.Future[None]"] = deque()
+        CONCURRENCY_LIMIT.set(self.limit)
+
+    @property
+    def limit(self) -> int:
+        return max(self.min_limit, int(self._limit))
+
+    def _set_limit(self, value: float) -> None:
+        self._limit = min(float(self.max_limit), max(float(self.min_limit), value))
+        CONCURRENCY_LIMIT.set(self.limit)
+
+    # ------------------------------------------------------------
+    # 調整 limit
+    # ------------------------------------------------------------
+    def _on_sample(self, rtt: float, ok: bool, inflight: int) -> None:
+        if not ok:
+            self._set_limit(self._limit * self.backoff)
+            return
+        if self.algorithm == "aimd":
+            if self.aimd_latency_seconds and rtt > self.aimd_latency_seconds:
+                self._set_limit(self._limit * self.backoff)
+            elif inflight * 2 >= self.limit:
+                self._set_limit(self._limit + 1)
+            return
+
+        if self._long_rtt is None:
+            self._long_rtt = rtt
+        else:
+            self._long_rtt += self._long_alpha * (rtt - self._long_rtt)
+            if self._long_rtt / max(rtt, 1e-6) > 2:
+                # 長期 RTT 卡在以前的慢值時往下修，不然 limit 會一路長上去
+                self._long_rtt *= 0.95
+        if inflight * 2 < self.limit:
+            return
+        gradient = max(0.5, min(1.0, self.tolerance * self._long_rtt / max(rtt, 1e-6)))
+        target = self._limit * gradient + math.sqrt(self._limit)
+        self._set_limit(self._limit * (1 - self.smoothing) + target * self.smoothing)
+
+    # ------------------------------------------------------------
+    # 拿 / 還 slot
+    # ------------------------------------------------------------
+    async def _wait_turn(self) -> None:
+        """排隊等 slot；回來時 slot 已經算進 inflight（_wake 叫醒前先加好）"""
+        if len(self._waiters) >= self.queue_size:
+            CONCURRENCY_REJECTED.labels("queue_full").inc()
+            raise ConcurrencyRejected("queue_full")
+        fut: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        CONCURRENCY_QUEUED.set(len(self._waiters))
+        t0 = time.perf_counter()
+        granted = False
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), self.queue_timeout)
+            granted = True
+        except asyncio.TimeoutError:
+            CONCURRENCY_REJECTED.labels("queue_timeout").inc()
+            raise ConcurrencyRejected("queue_timeout")
+        finally:
+            if not granted:
+                if fut.done() and not fut.cancelled():
+                    # 放棄（逾時 / 被取消）的同時剛好被叫醒：slot 還回去
+                    self._release()
+                else:
+                    fut.cancel()
+                    try:
+                        self._waiters.remove(fut)
+                    except ValueError:
+                        pass
+            CONCURRENCY_QUEUED.set(len(self._waiters))
+            CONCURRENCY_WAIT.observe(time.perf_counter() - t0)
+
+    def _wake(self) -> None:
+        while self._waiters and self.inflight < self.limit:
+            fut = self._waiters.popleft()
+            if fut.done():
+                continue
+            self.inflight += 1
+            fut.set_result(None)
+        CONCURRENCY_QUEUED.set(len(self._waiters))
+        CONCURRENCY_INFLIGHT.set(self.inflight)
+
+    async def acquire(self) -> Slot:
+        """拿不到名額時丟 ConcurrencyRejected；拿到的一定要 release()"""
+        if self.inflight < self.limit and not self._waiters:
+            self.inflight += 1
+            CONCURRENCY_INFLIGHT.set(self.inflight)
+        else:
+            await self._wait_turn()
+        return Slot(self)
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[Slot]:
+        """
+        async with limiter.slot() as s: ... 整段的時間當 RTT；丟例外或呼叫 s.fail() 算失敗。
+        被取消（client 斷線）的不當成樣本。
+        """
+        s = await self.acquire()
+        try:
+            yield s
+        except asyncio.CancelledError:
+            raise
+        except BaseException:
+            s.fail()
+            s.sample()
+            raise
+        else:
+            s.sample()
+        finally:
+            s.release()
+
+    def _release(self) -> None:
+        self.inflight -= 1
+        CONCURRENCY_INFLIGHT.set(self.inflight)
+        self._wake()
@@ -0,0 +1,94 @@
+
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+from prometheus_client import Counter, Gauge
+
+# 以 x-request-id 當 idempotency key：
+# - 第一次：upstream 呼叫放進獨立的 task（client timeout 斷線也不會被取消），結果留 ttl 秒
+# - 同一個 key 還在跑：重試直接等同一個 task（joined），不再打 upstream
+# - 已經跑完：直接回存好的結果（hit）
+# - 失敗（例外或 should_keep 判定不留，例如 5xx）：等待中的都拿到同樣結果，但 entry 拿掉，下次重試會重打
+# - 同一個 key 帶不同 body：IdempotencyConflict
+# 最多 max_entries 筆；TTL 固定，所以插入順序就是到期順序，從最舊的開始丟。
+# 只在本 process 內；多 worker 時重試落到別的 worker 就是 miss。
+
+IDEMPOTENCY = Counter("mind_proxy_idempotency_total", "Idempotency cache lookups", ["result"])
+IDEMPOTENCY_ENTRIES = Gauge("mind_proxy_idempotency_entries", "Idempotency entries (in-flight and completed)")
+
+
+class IdempotencyConflict(Exception):
+    pass
+
+
+def fingerprint(body: bytes) -> str:
+    return hashlib.sha256(body).hexdigest()
+
+
+class _Entry:
+    __slots__ = ("fingerprint", "task", "expires_at")
+
+    def __init__(self, fingerprint: str, task: "asyncio.Task[Any]", expires_at: float):
+        self.fingerprint = fingerprint
+        self.task = task
+        self.expires_at = expires_at
+
+
+class IdempotencyCache:
+    def __init__(self, max_entries: int = 10_000, ttl_seconds: float = 600):
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _evict(self, now: float) -> None:
+        while self._entries:
+            oldest = next(iter(self._entries.values()))
+            if oldest.expires_at > now and len(self._entries) < self.max_entries:
+                break
+            self._entries.popitem(last=False)
+        IDEMPOTENCY_ENTRIES.set(len(self._entries))
+
+    def _forget(self, key: str, entry: _Entry) -> None:
+        if self._entries.get(key) is entry:
+            del self._entries[key]
+            IDEMPOTENCY_ENTRIES.set(len(self._entries))
+
+    async def run(
+        self,
+        key: str,
+        fp: str,
+        fn: Callable[[], Awaitable[Any]],
+        should_keep: Optional[Callable[[Any], bool]] = None,
+    ) -> Tuple[Any, str]:
+        """回傳 (結果, miss|joined|hit)"""
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at <= now:
+            self._forget(key, entry)
+            entry = None
+        if entry is not None:
+            if entry.fingerprint != fp:
+                IDEMPOTENCY.labels("conflict").inc()
+                raise IdempotencyConflict(key)
+            outcome = "hit" if entry.task.done() else "joined"
+            IDEMPOTENCY.labels(outcome).inc()
+            return await asyncio.shield(entry.task), outcome
+
+        IDEMPOTENCY.labels("miss").inc()
+        self._evict(now)
+        task = asyncio.ensure_future(fn())
+        entry = self._entries[key] = _Entry(fp, task, now + self.ttl_seconds)
+        IDEMPOTENCY_ENTRIES.set(len(self._entries))
+
+        def done(t: "asyncio.Task[Any]") -> None:
+            if t.cancelled() or t.exception() is not None or (should_keep is not None and not should_keep(t.result())):
+                self._forget(key, entry)
+
+        task.add_done_callback(done)
+        return await asyncio.shield(task), "miss"
@@ -0,0 +1,69 @@
+
+import time
+
+from prometheus_client import Counter, Histogram
+
+# HTTP 層的 /metrics：path label 用比對到的 route template（例如 /v1/proxy/chat），
+# 沒比對到的（404 掃描）一律 <unmatched>，method 也限定在已知的幾種，series 數量有上限。
+# 時間算到最後一段 body 送出（串流就是整段串流），大小算實際收 / 送的 body bytes。
+
+UNMATCHED = "<unmatched>"
+_METHODS = frozenset({"GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"})
+_SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+REQ_COUNTER = Counter("mind_proxy_requests_total", "Total HTTP requests", ["path", "method", "code"])
+REQ_LATENCY = Histogram(
+    "mind_proxy_request_seconds",
+    "HTTP request duration (until the last body chunk is sent)",
+    ["path", "method"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+REQ_SIZE = Histogram("mind_proxy_request_size_bytes", "HTTP request body size", ["path"], buckets=_SIZE_BUCKETS)
+RESP_SIZE = Histogram("mind_proxy_response_size_bytes", "HTTP response body size", ["path"], buckets=_SIZE_BUCKETS)
+
+
+def route_template(scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or UNMATCHED
+
+
+class PrometheusMiddleware:
+    """純 ASGI middleware（不經過 BaseHTTPMiddleware），串流回應照樣一段一段送"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        t0 = time.perf_counter()
+        status = 500
+        req_bytes = 0
+        resp_bytes = 0
+
+        async def counting_receive():
+            nonlocal req_bytes
+            message = await receive()
+            if message["type"] == "http.request":
+                req_bytes += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal status, resp_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                resp_bytes += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            path = route_template(scope)
+            method = scope.get("method", "")
+            method = method if method in _METHODS else "OTHER"
+            REQ_COUNTER.labels(path=path, method=method, code=str(status)).inc()
+            REQ_LATENCY.labels(path, method).observe(time.perf_counter() - t0)
+            REQ_SIZE.labels(path).observe(req_bytes)
+            RESP_SIZE.labels(path).observe(resp_bytes)
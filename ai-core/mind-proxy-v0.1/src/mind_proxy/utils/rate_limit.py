@@ -1,33 +1,242 @@
 
+import itertools
+import logging
+import sys
+import threading
 import time
-from typing import Dict, Tuple
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from prometheus_client import Counter, Gauge
+
+from .state import STATE_FALLBACK
+
+log = logging.getLogger(__name__)
+
+# 每個 key（client IP）一個 token bucket：
+# - key 分散到 2^n 個 shard，各自一把 lock、一個 OrderedDict（LRU 順序），不會全部擠在同一個結構上
+# - 總共最多 max_keys 個 bucket；超過就從最久沒用的丟（capacity eviction）
+# - 閒置超過「從 0 補滿」所需時間的 bucket 跟新的一樣，直接丟掉不影響結果（idle eviction）
+# - bucket 用 __slots__，只存 tokens 與 updated_at；容量 / 補充速度放在 Policy，整條 route 共用
+# - route 可以有自己的 Policy（容量、補充速度、預設 cost）；key 可以有自己的 cost 倍率
+#   （例如內部服務 0、爬蟲 5），呼叫端也可以每次直接帶 cost
+
+RATE_LIMITED = Counter("mind_proxy_rate_limited_total", "Requests rejected by the rate limiter", ["route"])
+RATE_EVICTIONS = Counter("mind_proxy_rate_limit_evictions_total", "Token buckets evicted", ["reason"])
+RATE_KEYS = Gauge("mind_proxy_rate_limit_keys", "Token buckets currently tracked")
+RATE_BYTES_PER_KEY = Gauge("mind_proxy_rate_limit_bytes_per_key", "Estimated memory per tracked rate-limit key")
+
+# OrderedDict 每個 entry 的額外成本（hash table slot + 雙向串列節點），CPython 3.10+ 大約值
+_ODICT_ENTRY_OVERHEAD = 100
+
+
+class Policy:
+    __slots__ = ("capacity", "refill_per_sec", "cost")
+
+    def __init__(self, capacity: float, refill_per_sec: float, cost: float = 1):
+        self.capacity = float(capacity)
+        self.refill_per_sec = float(refill_per_sec)
+        self.cost = float(cost)
+
+    @property
+    def idle_seconds(self) -> float:
+        """從 0 補到滿需要的時間；閒置比這更久的 bucket 一定是滿的"""
+        if self.refill_per_sec <= 0:
+            return float("inf")
+        return self.capacity / self.refill_per_sec
+
+
+def parse_route_policies(raw: str) -> Dict[str, Policy]:
+    """
+    "/v1/proxy/chat=30:0.5,/v1/proxy/chat/stream=10:0.2:2"
+    → route=capacity:refill_per_sec[:cost]
+    """
+    out: Dict[str, Policy] = {}
+    for part in (raw or "").split(","):
+        if "=" not in part:
+            continue
+        route, spec = part.rsplit("=", 1)
+        nums = spec.split(":")
+        try:
+            out[route.strip()] = Policy(*(float(n) for n in nums[:3]))
+        except (TypeError, ValueError):
+            continue
+    return out
+
+
+def parse_key_costs(raw: str) -> Dict[str, float]:
+    """ "10.0.0.5=0,203.0.113.7=5" → key=cost 倍率 """
+    out: Dict[str, float] = {}
+    for part in (raw or "").split(","):
+        if "=" not in part:
+            continue
+        key, mult = part.rsplit("=", 1)
+        try:
+            out[key.strip()] = float(mult)
+        except ValueError:
+            continue
+    return out
+
 
 class TokenBucket:
-    def __init__(self, capacity: int, refill_per_sec: float):
-        self.capacity = capacity
-        self.refill_per_sec = refill_per_sec
-        self.tokens = capacity
-        self.updated_at = time.monotonic()
+    __slots__ = ("tokens", "updated_at")
 
-    def allow(self, cost: int = 1) -> bool:
-        now = time.monotonic()
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated_at = now
+
+    def allow(self, policy: Policy, cost: float, now: float) -> bool:
         elapsed = now - self.updated_at
         self.updated_at = now
-        self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_per_sec)
+        self.tokens = min(policy.capacity, self.tokens + elapsed * policy.refill_per_sec)
         if self.tokens >= cost:
             self.tokens -= cost
             return True
         return False
 
-class MemoryRateLimiter:
-    def __init__(self, capacity: int, refill_per_sec: float):
+
+class _Shard:
+    __slots__ = ("lock", "buckets")
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+
+class _Policies:
+    """route → Policy、key → cost 倍率的解析；記憶體版跟共享 state 版共用"""
+
+    def __init__(
+        self,
+        capacity: int,
+        refill_per_sec: float,
+        routes: Optional[Dict[str, Policy]] = None,
+        key_costs: Optional[Dict[str, float]] = None,
+    ):
         self.capacity = capacity
         self.refill_per_sec = refill_per_sec
-        self.buckets: Dict[str, TokenBucket] = {}
-
-    def check(self, key: str, cost: int = 1) -> bool:
-        b = self.buckets.get(key)
-        if not b:
-            b = TokenBucket(self.capacity, self.refill_per_sec)
-            self.buckets[key] = b
-        return b.allow(cost)
+        self.default = Policy(capacity, refill_per_sec)
+        self.routes = dict(routes or {})
+        self.key_costs = dict(key_costs or {})
+
+    def resolve(self, key: str, cost: Optional[float], route: Optional[str]) -> Tuple[Policy, str, float]:
+        """回傳 (policy, bucket key, 這次要扣的 cost)"""
+        if route is not None and route in self.routes:
+            policy, bucket_key = self.routes[route], f"{route}|{key}"
+        else:
+            policy, bucket_key = self.default, key
+        cost = policy.cost if cost is None else cost
+        return policy, bucket_key, cost * self.key_costs.get(key, 1.0)
+
+
+class MemoryRateLimiter(_Policies):
+    def __init__(
+        self,
+        capacity: int,
+        refill_per_sec: float,
+        max_keys: int = 100_000,
+        shards: int = 16,
+        routes: Optional[Dict[str, Policy]] = None,
+        key_costs: Optional[Dict[str, float]] = None,
+    ):
+        super().__init__(capacity, refill_per_sec, routes, key_costs)
+        n = 1
+        while n < max(1, shards):
+            n <<= 1
+        self._mask = n - 1
+        self._shards: List[_Shard] = [_Shard() for _ in range(n)]
+        self._per_shard = max(1, -(-max_keys // n))
+        # 閒置多久可以丟：以最慢補滿的 policy 為準，才不會把還沒補滿的 bucket 當成閒置
+        self._idle = max([self.default.idle_seconds] + [p.idle_seconds for p in self.routes.values()])
+
+    def __len__(self) -> int:
+        return sum(len(s.buckets) for s in self._shards)
+
+    async def acquire(self, key: str, cost: Optional[float] = None, route: Optional[str] = None) -> bool:
+        return self.check(key, cost, route)
+
+    def check(self, key: str, cost: Optional[float] = None, route: Optional[str] = None) -> bool:
+        policy, bucket_key, cost = self.resolve(key, cost, route)
+        if cost <= 0:
+            return True
+        now = time.monotonic()
+        shard = self._shards[hash(bucket_key) & self._mask]
+        with shard.lock:
+            buckets = shard.buckets
+            b = buckets.get(bucket_key)
+            if b is None:
+                self._evict(buckets, now)
+                b = buckets[bucket_key] = TokenBucket(policy.capacity, now)
+            else:
+                buckets.move_to_end(bucket_key)
+            ok = b.allow(policy, cost, now)
+        if not ok:
+            RATE_LIMITED.labels(route or "default").inc()
+        return ok
+
+    def _evict(self, buckets: "OrderedDict[str, TokenBucket]", now: float) -> None:
+        # 呼叫端持有 shard lock；只在新增 key 時做，最舊的在最前面
+        while buckets:
+            oldest = next(iter(buckets.values()))
+            if now - oldest.updated_at >= self._idle:
+                buckets.popitem(last=False)
+                RATE_EVICTIONS.labels("idle").inc()
+            elif len(buckets) >= self._per_shard:
+                buckets.popitem(last=False)
+                RATE_EVICTIONS.labels("capacity").inc()
+            else:
+                break
+
+    def bytes_per_key(self) -> float:
+        """抽樣估算每個 key 佔的記憶體（key 字串 + bucket + 兩個 float + dict entry）"""
+        sample = 0
+        size = 0
+        for s in self._shards:
+            with s.lock:
+                for k, b in itertools.islice(s.buckets.items(), 8):
+                    size += (
+                        sys.getsizeof(k) + sys.getsizeof(b)
+                        + sys.getsizeof(b.tokens) + sys.getsizeof(b.updated_at)
+                        + _ODICT_ENTRY_OVERHEAD
+                    )
+                    sample += 1
+        return size / sample if sample else 0.0
+
+    def export_metrics(self) -> None:
+        """把 key 數與每個 key 的記憶體掛到 /metrics（scrape 時才計算）"""
+        RATE_KEYS.set_function(lambda: len(self))
+        RATE_BYTES_PER_KEY.set_function(self.bytes_per_key)
+
+
+class SharedRateLimiter(_Policies):
+    """
+    bucket 放在共享 state（utils/state.py：Redis 或同機 shared memory），多個 worker 看到同一份額度。
+    state 連不上時退回本 process 的 MemoryRateLimiter（每個 worker 各算各的，不會整個擋掉）。
+    """
+
+    def __init__(
+        self,
+        state,
+        capacity: int,
+        refill_per_sec: float,
+        routes: Optional[Dict[str, Policy]] = None,
+        key_costs: Optional[Dict[str, float]] = None,
+        fallback: Optional[MemoryRateLimiter] = None,
+    ):
+        super().__init__(capacity, refill_per_sec, routes, key_costs)
+        self.state = state
+        self.fallback = fallback or MemoryRateLimiter(capacity, refill_per_sec, routes=routes, key_costs=key_costs)
+
+    async def acquire(self, key: str, cost: Optional[float] = None, route: Optional[str] = None) -> bool:
+        policy, bucket_key, charge = self.resolve(key, cost, route)
+        if charge <= 0:
+            return True
+        try:
+            ok = await self.state.take(bucket_key, policy.capacity, policy.refill_per_sec, charge)
+        except Exception as e:
+            log.warning("shared rate limit unavailable, using local buckets: %r", e)
+            STATE_FALLBACK.labels("rate_limit").inc()
+            return self.fallback.check(key, cost, route)
+        if not ok:
+            RATE_LIMITED.labels(route or "default").inc()
+        return ok
@@ -0,0 +1,289 @@
+
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List
+
+from prometheus_client import Counter
+
+# 限流 / 熔斷的共享 state，讓 mind-proxy 可以開多個 worker（MP_WORKERS）還維持同一份額度：
+# - RedisState      ：token bucket 與 breaker 都是 Lua script，在 Redis 裡原子地讀-改-寫，
+#                     時間用 Redis 的 TIME（各 worker / 各主機的時鐘不用對齊）
+# - SharedMemoryState：同一台機器的多個 worker，共用一個 mmap 檔（預設在 /dev/shm）；
+#                     bucket 表是固定大小的 8-way set-associative 表（滿了丟該組最久沒動的），
+#                     每組用 fcntl 的 byte-range lock 互斥，不同組不互相等
+# 兩者都提供：
+#   await take(key, capacity, refill_per_sec, cost) -> bool
+#   await breaker_allow(name, cooldown_seconds) -> bool
+#   await breaker_record(name, ok, fail_threshold)
+#   await close()
+
+log = logging.getLogger(__name__)
+
+STATE_FALLBACK = Counter(
+    "mind_proxy_state_fallback_total", "Operations served from process-local state because the shared backend failed", ["op"]
+)
+
+
+# ------------------------------------------------------------
+# Redis
+# ------------------------------------------------------------
+_BUCKET_LUA = """
+local capacity = tonumber(ARGV[1])
+local refill = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local b = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(b[1])
+local ts = tonumber(b[2])
+if tokens == nil or ts == nil then
+  tokens = capacity
+  ts = now
+end
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * refill)
+local ok = 0
+if tokens >= cost then
+  tokens = tokens - cost
+  ok = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+-- 補滿之後就跟新的 bucket 一樣，不用留著
+local ttl = 86400
+if refill > 0 then
+  ttl = math.min(ttl, math.ceil((capacity - tokens) / refill) + 1)
+end
+redis.call('EXPIRE', KEYS[1], ttl)
+return ok
+"""
+
+_BREAKER_ALLOW_LUA = """
+local cooldown = tonumber(ARGV[1])
+local b = redis.call('HMGET', KEYS[1], 'state', 'opened_at')
+if b[1] ~= 'open' then
+  return 1
+end
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+if now - tonumber(b[2]) >= cooldown then
+  redis.call('HSET', KEYS[1], 'state', 'half-open')
+  return 1
+end
+return 0
+"""
+
+_BREAKER_RECORD_LUA = """
+if ARGV[1] == '1' then
+  redis.call('HSET', KEYS[1], 'fails', 0, 'state', 'closed')
+  return 0
+end
+local fails = redis.call('HINCRBY', KEYS[1], 'fails', 1)
+local state = redis.call('HGET', KEYS[1], 'state')
+if fails >= tonumber(ARGV[2]) and state ~= 'open' then
+  local t = redis.call('TIME')
+  redis.call('HSET', KEYS[1], 'state', 'open', 'opened_at', tostring(tonumber(t[1]) + tonumber(t[2]) / 1000000))
+end
+return fails
+"""
+
+
+class RedisState:
+    name = "redis"
+
+    def __init__(
+        self, url: str, prefix: str = "mind-proxy", timeout: float = 0.5, retry_after: float = 5.0, client=None
+    ):
+        """client 給了就直接用（測試塞 fakeredis），url / timeout 不再使用"""
+        self.prefix = prefix
+        self.retry_after = retry_after
+        self._down_until = 0.0
+        if client is None:
+            import redis.asyncio as aioredis
+
+            client = aioredis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+        self.client = client
+        self._bucket = self.client.register_script(_BUCKET_LUA)
+        self._allow = self.client.register_script(_BREAKER_ALLOW_LUA)
+        self._record = self.client.register_script(_BREAKER_RECORD_LUA)
+
+    async def _run(self, script, key: str, args: list) -> int:
+        # Redis 掛掉時每個請求都等 timeout 太貴：失敗一次之後 retry_after 秒內直接丟錯，讓呼叫端走 fallback
+        if time.monotonic() < self._down_until:
+            raise ConnectionError("redis marked down")
+        try:
+            return int(await script(keys=[f"{self.prefix}:{key}"], args=args))
+        except Exception:
+            self._down_until = time.monotonic() + self.retry_after
+            raise
+
+    async def take(self, key: str, capacity: float, refill_per_sec: float, cost: float) -> bool:
+        return await self._run(self._bucket, f"rl:{key}", [capacity, refill_per_sec, cost]) == 1
+
+    async def breaker_allow(self, name: str, cooldown_seconds: float) -> bool:
+        return await self._run(self._allow, f"cb:{name}", [cooldown_seconds]) == 1
+
+    async def breaker_record(self, name: str, ok: bool, fail_threshold: int) -> None:
+        await self._run(self._record, f"cb:{name}", ["1" if ok else "0", fail_threshold])
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+# ------------------------------------------------------------
+# Shared memory (single host)
+# ------------------------------------------------------------
+_MAGIC = 0x4D505331  # "MPS1"
+_HEADER = struct.Struct("<IIII")  # magic, groups, ways, breakers
+_HEADER_SIZE = 64
+_SLOT = struct.Struct("<Qdd")  # key hash (0 = 空), tokens, updated_at
+_BREAKER = struct.Struct("<Qqqd")  # name hash, fails, state, opened_at
+_WAYS = 8
+_BREAKERS = 64
+_LOCK_STRIPES = 64
+_CLOSED, _OPEN, _HALF_OPEN = 0, 1, 2
+
+
+def _stable_hash(key: str) -> int:
+    # hash() 每個 process 的 seed 不同，跨 worker 要用固定的 hash
+    h = int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+    return h or 1
+
+
+class SharedMemoryState:
+    """
+    時間用 time.monotonic()：Linux 上是整台機器共用的 CLOCK_MONOTONIC，不同 worker 可以直接比較。
+    fcntl 的 lock 是以 process 為單位，同一個 process 裡的 thread 另外用 threading.Lock 擋。
+    """
+
+    name = "shm"
+
+    def __init__(self, path: str, max_keys: int = 100_000):
+        self.path = path
+        self.groups = max(1, -(-max_keys // _WAYS))
+        self._breaker_off = _HEADER_SIZE
+        self._bucket_off = self._breaker_off + _BREAKERS * _BREAKER.size
+        size = self._bucket_off + self.groups * _WAYS * _SLOT.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._tlocks: List[threading.Lock] = [threading.Lock() for _ in range(_LOCK_STRIPES + 1)]
+        # 第一個 worker 建表；大小或格式對不上（設定改過）就整個重建
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, _LOCK_STRIPES)
+        try:
+            header = os.pread(self._fd, _HEADER.size, 0)
+            expected = _HEADER.pack(_MAGIC, self.groups, _WAYS, _BREAKERS)
+            if header != expected or os.fstat(self._fd).st_size != size:
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, expected, 0)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, _LOCK_STRIPES)
+        self._mm = mmap.mmap(self._fd, size)
+
+    @contextmanager
+    def _locked(self, stripe: int) -> Iterator[None]:
+        with self._tlocks[stripe]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, stripe)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, stripe)
+
+    def take_sync(self, key: str, capacity: float, refill_per_sec: float, cost: float) -> bool:
+        h = _stable_hash(key)
+        group = h % self.groups
+        base = self._bucket_off + group * _WAYS * _SLOT.size
+        mm = self._mm
+        now = time.monotonic()
+        with self._locked(group % _LOCK_STRIPES):
+            slot = None
+            victim, victim_ts = base, float("inf")
+            for i in range(_WAYS):
+                off = base + i * _SLOT.size
+                kh, tokens, ts = _SLOT.unpack_from(mm, off)
+                if kh == h:
+                    slot = off
+                    break
+                if kh == 0:
+                    ts = float("-inf")
+                if ts < victim_ts:
+                    victim, victim_ts = off, ts
+            if slot is None:
+                # 這組滿了就丟最久沒動的 bucket（閒置的通常早就補滿，丟掉等於新的）
+                slot, tokens, ts = victim, float(capacity), now
+            tokens = min(capacity, tokens + max(0.0, now - ts) * refill_per_sec)
+            ok = tokens >= cost
+            if ok:
+                tokens -= cost
+            _SLOT.pack_into(mm, slot, h, tokens, now)
+        return ok
+
+    def _breaker_slot(self, name: str) -> int:
+        # breaker 只有少數幾個（每個 upstream 一個），線性探測；呼叫端持有 breaker lock
+        h = _stable_hash(name)
+        for i in range(_BREAKERS):
+            off = self._breaker_off + ((h + i) % _BREAKERS) * _BREAKER.size
+            kh = _BREAKER.unpack_from(self._mm, off)[0]
+            if kh == h:
+                return off
+            if kh == 0:
+                _BREAKER.pack_into(self._mm, off, h, 0, _CLOSED, 0.0)
+                return off
+        raise RuntimeError("shared breaker table is full")
+
+    def breaker_allow_sync(self, name: str, cooldown_seconds: float) -> bool:
+        with self._locked(_LOCK_STRIPES):
+            off = self._breaker_slot(name)
+            h, fails, state, opened_at = _BREAKER.unpack_from(self._mm, off)
+            if state != _OPEN:
+                return True
+            if time.monotonic() - opened_at >= cooldown_seconds:
+                _BREAKER.pack_into(self._mm, off, h, fails, _HALF_OPEN, opened_at)
+                return True
+            return False
+
+    def breaker_record_sync(self, name: str, ok: bool, fail_threshold: int) -> None:
+        with self._locked(_LOCK_STRIPES):
+            off = self._breaker_slot(name)
+            h, fails, state, opened_at = _BREAKER.unpack_from(self._mm, off)
+            if ok:
+                fails, state = 0, _CLOSED
+            else:
+                fails += 1
+                if fails >= fail_threshold and state != _OPEN:
+                    state, opened_at = _OPEN, time.monotonic()
+            _BREAKER.pack_into(self._mm, off, h, fails, state, opened_at)
+
+    # 都是幾微秒的記憶體操作，直接在 event loop 裡做
+    async def take(self, key: str, capacity: float, refill_per_sec: float, cost: float) -> bool:
+        return self.take_sync(key, capacity, refill_per_sec, cost)
+
+    async def breaker_allow(self, name: str, cooldown_seconds: float) -> bool:
+        return self.breaker_allow_sync(name, cooldown_seconds)
+
+    async def breaker_record(self, name: str, ok: bool, fail_threshold: int) -> None:
+        self.breaker_record_sync(name, ok, fail_threshold)
+
+    async def close(self) -> None:
+        self._mm.close()
+        os.close(self._fd)
+
+
+def build_state(kind: str, redis_url: str = "", shm_path: str = "", max_keys: int = 100_000):
+    """kind=memory 回傳 None（用 process 內的 limiter / breaker）；redis / shm 建不起來也退回 None"""
+    kind = (kind or "memory").lower()
+    try:
+        if kind == "redis":
+            return RedisState(redis_url)
+        if kind == "shm":
+            return SharedMemoryState(shm_path, max_keys)
+    except Exception as e:
+        log.warning("state backend %s unavailable, using in-process state: %r", kind, e)
+        return None
+    if kind != "memory":
+        log.warning("unknown state backend %r, using in-process state", kind)
+    return None
@@ -0,0 +1,37 @@
+
+from starlette.responses import StreamingResponse
+
+# hop-by-hop headers（RFC 7230 6.1）只對單一連線有意義，轉送時拿掉
+HOP_BY_HOP = frozenset({
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailer", "trailers", "transfer-encoding", "upgrade",
+})
+
+
+def forward_headers(headers, drop=()) -> dict:
+    skip = HOP_BY_HOP.union(h.lower() for h in drop)
+    return {k: v for k, v in headers.items() if k.lower() not in skip}
+
+
+class PassthroughResponse(StreamingResponse):
+    """
+    StreamingResponse 在 ASGI spec >= 2.4 時，client 斷線只會丟 ClientDisconnect，不會關 body iterator；
+    這裡不管怎麼結束（送完、斷線、取消、連第一段都沒送出去）都 aclose() iterator 並呼叫 on_close，
+    讓 upstream 連線關掉（生成跟著停）。
+    """
+
+    def __init__(self, content, *, on_close=None, **kw):
+        super().__init__(content, **kw)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            try:
+                aclose = getattr(self.body_iterator, "aclose", None)
+                if aclose is not None:
+                    await aclose()
+            finally:
+                if self.on_close is not None:
+                    await self.on_close()
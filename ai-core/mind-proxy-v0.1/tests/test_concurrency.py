@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from mind_proxy.utils.concurrency import AdaptiveLimiter, ConcurrencyRejected
+
+
+def test_excess_requests_queue_then_get_rejected():
+    async def run():
+        lim = AdaptiveLimiter(initial_limit=2, min_limit=2, max_limit=2, queue_size=1, queue_timeout=0.05)
+        release = asyncio.Event()
+
+        async def hold():
+            async with lim.slot():
+                await release.wait()
+
+        holders = [asyncio.ensure_future(hold()) for _ in range(2)]
+        await asyncio.sleep(0)
+        queued = asyncio.ensure_future(hold())
+        await asyncio.sleep(0)
+        with pytest.raises(ConcurrencyRejected) as full:
+            await lim.acquire()
+        assert full.value.reason == "queue_full"
+        with pytest.raises(ConcurrencyRejected) as timeout:
+            await queued
+        assert timeout.value.reason == "queue_timeout"
+
+        queued = asyncio.ensure_future(hold())
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(*holders, queued)
+        assert lim.inflight == 0
+
+    asyncio.run(run())
+
+
+def test_gradient_shrinks_when_rtt_climbs():
+    lim = AdaptiveLimiter("gradient", initial_limit=40, min_limit=2, max_limit=100)
+    for _ in range(50):
+        lim._on_sample(0.1, True, 40)
+    steady = lim.limit
+    for _ in range(30):
+        lim._on_sample(1.0, True, lim.limit)
+    assert lim.limit < steady / 2
+
+
+def test_aimd_grows_on_success_and_backs_off_on_failure():
+    lim = AdaptiveLimiter("aimd", initial_limit=10, min_limit=1, max_limit=100)
+    for _ in range(5):
+        lim._on_sample(0.1, True, 10)
+    assert lim.limit == 15
+    lim._on_sample(0.1, False, 10)
+    assert lim.limit == 13
+    lim._on_sample(0.1, True, 1)  # 沒用到一半，不長
+    assert lim.limit == 13
+
+
+def test_failures_inside_slot_lower_the_limit():
+    async def run():
+        lim = AdaptiveLimiter("aimd", initial_limit=10)
+        with pytest.raises(RuntimeError):
+            async with lim.slot():
+                raise RuntimeError("upstream down")
+        assert lim.limit == 9 and lim.inflight == 0
+
+    asyncio.run(run())
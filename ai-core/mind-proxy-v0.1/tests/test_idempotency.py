@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from mind_proxy.utils.idempotency import IdempotencyCache, IdempotencyConflict
+
+
+def test_retries_join_in_flight_and_replay_completed():
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.02)
+        return "done"
+
+    async def run():
+        cache = IdempotencyCache()
+        first = asyncio.ensure_future(cache.run("r1", "fp", work))
+        await asyncio.sleep(0)
+        second = await cache.run("r1", "fp", work)
+        assert await first == ("done", "miss")
+        assert second == ("done", "joined")
+        assert await cache.run("r1", "fp", work) == ("done", "hit")
+        with pytest.raises(IdempotencyConflict):
+            await cache.run("r1", "other", work)
+
+    asyncio.run(run())
+    assert calls == 1
+
+
+def test_cancelled_caller_does_not_cancel_upstream_work():
+    async def run():
+        cache = IdempotencyCache()
+
+        async def work():
+            await asyncio.sleep(0.02)
+            return 42
+
+        caller = asyncio.ensure_future(cache.run("r", "fp", work))
+        await asyncio.sleep(0)
+        caller.cancel()  # client timeout
+        assert await cache.run("r", "fp", work) == (42, "joined")
+
+    asyncio.run(run())
+
+
+def test_failures_are_not_kept():
+    async def run():
+        cache = IdempotencyCache()
+
+        async def boom():
+            raise RuntimeError("upstream down")
+
+        with pytest.raises(RuntimeError):
+            await cache.run("r", "fp", boom)
+        assert await cache.run("r", "fp", _value(500), should_keep=lambda v: v < 500) == (500, "miss")
+        assert len(cache) == 0
+        assert await cache.run("r", "fp", _value(200), should_keep=lambda v: v < 500) == (200, "miss")
+        assert len(cache) == 1
+
+    asyncio.run(run())
+
+
+def test_bounded_and_expiring():
+    async def run():
+        cache = IdempotencyCache(max_entries=3, ttl_seconds=60)
+        for i in range(10):
+            await cache.run(f"r{i}", "fp", _value(i))
+        assert len(cache) == 3
+        expiring = IdempotencyCache(ttl_seconds=0)
+        await expiring.run("r", "fp", _value(1))
+        assert await expiring.run("r", "fp", _value(2)) == (2, "miss")
+
+    asyncio.run(run())
+
+
+def _value(v):
+    async def fn():
+        return v
+
+    return fn
@@ -0,0 +1,24 @@
+from fastapi.testclient import TestClient
+
+from mind_proxy.server import app
+
+
+def _samples(text: str, name: str):
+    return [line for line in text.splitlines() if line.startswith(name + "{")]
+
+
+def test_request_metrics_use_route_templates():
+    with TestClient(app) as c:
+        for i in range(5):
+            c.get(f"/scan/{i}")
+        c.get("/health")
+        c.request("BREW", "/health")
+        text = c.get("/metrics").text
+
+    counts = _samples(text, "mind_proxy_requests_total")
+    assert not any("/scan/" in line for line in counts)
+    assert any('path="<unmatched>"' in line and 'code="404"' in line for line in counts)
+    assert any('path="/health"' in line and 'method="GET"' in line for line in counts)
+    assert any('method="OTHER"' in line for line in counts)
+    assert _samples(text, "mind_proxy_request_seconds_bucket")
+    assert any('path="/health"' in line for line in _samples(text, "mind_proxy_response_size_bytes_count"))
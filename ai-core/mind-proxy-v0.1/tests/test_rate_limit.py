@@ -0,0 +1,46 @@
+from mind_proxy.utils.rate_limit import MemoryRateLimiter, parse_key_costs, parse_route_policies
+
+
+def test_bucket_capacity_and_cost():
+    rl = MemoryRateLimiter(3, 0.0)
+    assert rl.check("a", cost=2)
+    assert not rl.check("a", cost=2)
+    assert rl.check("a")
+    assert not rl.check("a")
+    assert rl.check("b")
+
+
+def test_lru_is_bounded():
+    rl = MemoryRateLimiter(1, 0.0, max_keys=8, shards=4)
+    for i in range(1000):
+        rl.check(f"10.0.0.{i}")
+    assert len(rl) <= 8
+    assert rl.bytes_per_key() > 0
+
+
+def test_idle_buckets_are_evicted(monkeypatch):
+    import mind_proxy.utils.rate_limit as mod
+
+    now = [100.0]
+    monkeypatch.setattr(mod.time, "monotonic", lambda: now[0])
+    rl = MemoryRateLimiter(2, 1.0, shards=1)
+    rl.check("a")
+    now[0] += 5  # 超過 2 / 1.0 秒，a 一定已經補滿
+    rl.check("b")
+    assert len(rl) == 1
+
+
+def test_route_policy_and_key_cost():
+    rl = MemoryRateLimiter(
+        10, 0.0,
+        routes=parse_route_policies("/heavy=4:0:2, bad"),
+        key_costs=parse_key_costs("internal=0,crawler=2"),
+    )
+    assert rl.check("x", route="/heavy")
+    assert rl.check("x", route="/heavy")
+    assert not rl.check("x", route="/heavy")
+    assert rl.check("x")  # 預設 bucket 跟 /heavy 分開算
+    for _ in range(100):
+        assert rl.check("internal", route="/heavy")
+    assert rl.check("crawler", route="/heavy")  # cost 2 * 2
+    assert not rl.check("crawler", route="/heavy")
@@ -0,0 +1,148 @@
+import asyncio
+import multiprocessing as mp
+import os
+
+import pytest
+
+from mind_proxy.utils.circuit_breaker import SharedCircuitBreaker
+from mind_proxy.utils.rate_limit import SharedRateLimiter
+from mind_proxy.utils.state import RedisState, SharedMemoryState
+
+
+def _take_many(path, n, out):
+    st = SharedMemoryState(path, max_keys=64)
+    out.put(sum(st.take_sync("1.2.3.4", 10, 0.0, 1) for _ in range(n)))
+
+
+def test_shm_bucket_is_shared_across_processes(tmp_path):
+    path = str(tmp_path / "state")
+    SharedMemoryState(path, max_keys=64)
+    ctx = mp.get_context("spawn")
+    out = ctx.Queue()
+    procs = [ctx.Process(target=_take_many, args=(path, 6, out)) for _ in range(3)]
+    for p in procs:
+        p.start()
+    granted = sum(out.get(timeout=30) for _ in procs)
+    for p in procs:
+        p.join(timeout=30)
+    assert granted == 10
+
+
+def test_shm_table_is_bounded(tmp_path):
+    st = SharedMemoryState(str(tmp_path / "state"), max_keys=16)
+    size = os.path.getsize(st.path)
+    for i in range(1000):
+        assert st.take_sync(f"k{i}", 1, 0.0, 1)
+    assert os.path.getsize(st.path) == size
+
+
+def test_shm_breaker_opens_and_recovers(tmp_path):
+    st = SharedMemoryState(str(tmp_path / "state"), max_keys=16)
+    cb = SharedCircuitBreaker(st, "upstream", fail_threshold=2, cooldown_seconds=0.05)
+
+    async def run():
+        await cb.report(False)
+        assert await cb.acquire()
+        await cb.report(False)
+        assert not await cb.acquire()
+        # 另一個 worker 看到同一個狀態
+        other = SharedCircuitBreaker(SharedMemoryState(st.path, max_keys=16), "upstream", 2, 0.05)
+        assert not await other.acquire()
+        await asyncio.sleep(0.06)
+        assert await other.acquire()
+        await other.report(True)
+        assert await cb.acquire()
+
+    asyncio.run(run())
+
+
+def test_redis_down_falls_back_to_local():
+    async def run():
+        st = RedisState("redis://127.0.0.1:1/0", timeout=0.1)
+        rl = SharedRateLimiter(st, 2, 0.0)
+        assert await rl.acquire("a")
+        assert await rl.acquire("a")
+        assert not await rl.acquire("a")
+        await st.close()
+
+    asyncio.run(run())
+
+
+def _fake_redis_state(**kwargs):
+    # fakeredis[lua] 真的會跑 _BUCKET_LUA / _BREAKER_*_LUA，不用起一個 Redis
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    return RedisState("redis://fake", client=fakeredis.FakeAsyncRedis(), **kwargs)
+
+
+def test_redis_lua_token_bucket():
+    async def run():
+        st = _fake_redis_state()
+        try:
+            results = await asyncio.gather(*(st.take("k", 5, 0.0, 1) for _ in range(20)))
+            assert sum(results) == 5
+            assert await st.take("other", 5, 0.0, 5)
+            assert not await st.take("other", 5, 0.0, 1)
+            # 會補充的 bucket 設 TTL（補滿所需秒數 + 1），不會永久留在 Redis
+            assert await st.take("refill", 10, 100.0, 4)
+            assert 0 < await st.client.ttl("mind-proxy:rl:refill") <= 2
+        finally:
+            await st.close()
+
+    asyncio.run(run())
+
+
+def test_redis_lua_breaker_opens_and_recovers():
+    async def run():
+        st = _fake_redis_state()
+        cb = SharedCircuitBreaker(st, "upstream", fail_threshold=2, cooldown_seconds=0.05)
+        try:
+            await cb.report(False)
+            assert await cb.acquire()
+            await cb.report(False)
+            assert not await cb.acquire()
+            await asyncio.sleep(0.06)
+            assert await cb.acquire()
+            assert await st.client.hget("mind-proxy:cb:upstream", "state") == b"half-open"
+            await cb.report(True)
+            assert await st.client.hget("mind-proxy:cb:upstream", "state") == b"closed"
+            assert await cb.acquire()
+        finally:
+            await st.close()
+
+    asyncio.run(run())
+
+
+def test_shared_rate_limiter_over_redis_lua():
+    async def run():
+        st = _fake_redis_state()
+        rl = SharedRateLimiter(st, 2, 0.0, key_costs={"crawler": 2})
+        try:
+            assert await rl.acquire("a")
+            assert await rl.acquire("a")
+            assert not await rl.acquire("a")
+            assert await rl.acquire("crawler")
+            assert not await rl.acquire("crawler")
+            # 沒有走到 fallback：本地 bucket 一個都沒建
+            assert len(rl.fallback) == 0
+        finally:
+            await st.close()
+
+    asyncio.run(run())
+
+
+@pytest.mark.skipif(not os.getenv("MP_TEST_REDIS_URL"), reason="set MP_TEST_REDIS_URL to run against a Redis")
+def test_redis_token_bucket():
+    async def run():
+        st = RedisState(os.environ["MP_TEST_REDIS_URL"], prefix=f"mp-test-{os.getpid()}")
+        try:
+            results = await asyncio.gather(*(st.take("k", 5, 0.0, 1) for _ in range(20)))
+            assert sum(results) == 5
+            assert await st.breaker_allow("cb", 10)
+            await st.breaker_record("cb", False, 1)
+            assert not await st.breaker_allow("cb", 10)
+        finally:
+            await st.client.delete(f"{st.prefix}:rl:k", f"{st.prefix}:cb:cb")
+            await st.close()
+
+    asyncio.run(run())
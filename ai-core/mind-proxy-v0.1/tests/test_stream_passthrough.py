@@ -0,0 +1,89 @@
+import asyncio
+
+import httpx
+
+from mind_proxy.adapters.http_upstream import UpstreamPool
+from mind_proxy.routes import http as http_routes
+from mind_proxy.server import app
+
+
+def _install_pool(monkeypatch, handler):
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    pool = UpstreamPool([("http://up", 1.0)], client=client)
+    monkeypatch.setattr(http_routes, "upstream", pool)
+    return pool
+
+
+async def _call(body: bytes, disconnect_after: int = 0):
+    """直接打 ASGI app；disconnect_after > 0 時收到這麼多段 body 之後 client 就斷線"""
+    sent = []
+    got_body = asyncio.Event()
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        if disconnect_after:
+            await got_body.wait()
+        else:
+            await asyncio.Event().wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+        chunks = [m for m in sent if m["type"] == "http.response.body" and m.get("body")]
+        if disconnect_after and len(chunks) >= disconnect_after:
+            got_body.set()
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/v1/proxy/chat/stream", "raw_path": b"/v1/proxy/chat/stream",
+        "query_string": b"", "root_path": "", "client": ("127.0.0.1", 1234), "server": ("test", 80),
+        "headers": [(b"content-type", b"application/json"), (b"host", b"test")],
+    }
+    await asyncio.wait_for(app(scope, receive, send), 5)
+    return sent
+
+
+def test_bytes_status_and_headers_pass_through(monkeypatch):
+    seen = {}
+
+    async def body():
+        yield b'{"a":1}\n'
+        yield b'{"b":2}\n'
+
+    def handler(request):
+        seen["body"] = request.content
+        return httpx.Response(201, headers={"content-type": "application/x-ndjson", "x-engine": "a"}, content=body())
+
+    pool = _install_pool(monkeypatch, handler)
+    sent = asyncio.run(_call(b'{"messages":[]}'))
+    start = sent[0]
+    headers = dict(start["headers"])
+    assert start["status"] == 201
+    assert headers[b"x-engine"] == b"a"
+    assert headers[b"x-upstream"] == b"http://up"
+    assert b"".join(m.get("body", b"") for m in sent[1:]) == b'{"a":1}\n{"b":2}\n'
+    assert seen["body"] == b'{"messages":[]}'
+    assert pool.upstreams[0].inflight == 0
+
+
+def test_client_disconnect_closes_upstream(monkeypatch):
+    state = {"closed": False, "chunks": 0}
+
+    async def body():
+        try:
+            while True:
+                state["chunks"] += 1
+                yield b"tok\n"
+                await asyncio.sleep(0.01)
+        finally:
+            state["closed"] = True
+
+    pool = _install_pool(monkeypatch, lambda request: httpx.Response(200, content=body()))
+    asyncio.run(_call(b"{}", disconnect_after=2))
+    assert state["closed"]
+    assert state["chunks"] < 50
+    assert pool.upstreams[0].inflight == 0
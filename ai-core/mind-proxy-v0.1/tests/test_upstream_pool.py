@@ -0,0 +1,171 @@
+import asyncio
+
+import httpx
+
+from mind_proxy.adapters.http_upstream import NoUpstreamAvailable, UpstreamPool, parse_upstreams
+from mind_proxy.utils.circuit_breaker import CircuitBreaker
+
+
+def _pool(handler, urls, **kw):
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return UpstreamPool([(u, 1.0) for u in urls], client=client, **kw)
+
+
+def test_parse_upstreams():
+    assert parse_upstreams("http://a=2, http://b", "http://x") == [("http://a", 2.0), ("http://b", 1.0)]
+    assert parse_upstreams("", "http://x") == [("http://x", 1.0)]
+
+
+def test_failover_and_breaker_skips_dead_upstream():
+    def handler(request):
+        if request.url.host == "dead":
+            raise httpx.ConnectError("refused")
+        return httpx.Response(200, text="ok")
+
+    pool = _pool(handler, ["http://dead", "http://alive"], breaker_factory=lambda url: CircuitBreaker(1, 60))
+
+    async def run():
+        for _ in range(10):
+            resp, u = await pool.chat({})
+            assert resp.status == 200 and u.base_url == "http://alive"
+        dead = pool.upstreams[0]
+        assert dead.breaker.state == "open"
+
+    asyncio.run(run())
+
+
+def test_all_upstreams_open_raises():
+    pool = _pool(lambda r: httpx.Response(200), ["http://a"], breaker_factory=lambda url: CircuitBreaker(1, 60))
+    pool.upstreams[0].breaker.record_failure()
+
+    async def run():
+        try:
+            await pool.chat({})
+        except NoUpstreamAvailable:
+            return
+        raise AssertionError("expected NoUpstreamAvailable")
+
+    asyncio.run(run())
+
+
+def test_p2c_prefers_faster_upstream():
+    pool = _pool(lambda r: httpx.Response(200), ["http://a", "http://b"])
+    slow, fast = pool.upstreams
+    slow.observe(1.0)
+    fast.observe(0.01)
+
+    async def run():
+        picks = [await pool.pick() for _ in range(20)]
+        assert all(p is fast for p in picks)
+
+    asyncio.run(run())
+
+
+def test_hedge_wins_when_first_is_slow():
+    async def handler(request):
+        if request.url.host == "slow":
+            await asyncio.sleep(1)
+        return httpx.Response(200, text=request.url.host)
+
+    pool = _pool(handler, ["http://slow", "http://fast"], hedge=True, hedge_min_seconds=0.01, hedge_default_seconds=0.05)
+    slow, fast = pool.upstreams
+    slow.observe(0.01)  # 看起來比較快，第一次一定挑到 slow
+    fast.observe(1.0)
+
+    async def run():
+        resp, u = await pool.chat({})
+        assert u is fast and resp.text == "fast"
+        await asyncio.sleep(0.01)
+        assert slow.inflight == 0  # 輸掉的那個被取消了
+
+    asyncio.run(run())
+
+
+def test_stream_returns_upstream_5xx_when_nothing_else_to_try():
+    async def body():
+        yield b"overloaded"
+
+    pool = _pool(lambda r: httpx.Response(503, content=body()), ["http://only"])
+
+    async def run():
+        r, u = await pool.open_stream("/chat", b"{}", {})
+        assert r.status_code == 503
+        assert b"".join([c async for c in r.aiter_raw()]) == b"overloaded"
+        await u.close_stream(r)
+        assert u.inflight == 0
+
+    asyncio.run(run())
+
+
+def test_stream_fails_over_past_5xx():
+    async def body(text):
+        yield text
+
+    def handler(request):
+        if request.url.host == "bad":
+            return httpx.Response(502, content=body(b"bad"))
+        return httpx.Response(200, content=body(b"ok"))
+
+    pool = _pool(handler, ["http://bad", "http://good"])
+    bad, good = pool.upstreams
+    good.observe(1.0)  # 第一次先挑 bad
+
+    async def run():
+        r, u = await pool.open_stream("/chat", b"{}", {})
+        assert u is good and r.status_code == 200
+        await u.close_stream(r)
+        assert bad.inflight == 0 and good.inflight == 0
+
+    asyncio.run(run())
+
+
+def test_read_timeout_is_not_retried():
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.host)
+        if request.url.host == "slow":
+            raise httpx.ReadTimeout("generation took too long")
+        return httpx.Response(200, text="ok")
+
+    pool = _pool(handler, ["http://slow", "http://other"])
+    slow, other = pool.upstreams
+    other.observe(1.0)  # 第一次先挑 slow
+
+    async def run():
+        try:
+            await pool.chat({})
+        except httpx.ReadTimeout:
+            pass
+        else:
+            raise AssertionError("expected ReadTimeout")
+        assert calls == ["slow"]  # 沒有在 other 上再生成一次
+
+        calls.clear()
+        try:
+            await pool.open_stream("/chat", b"{}", {})
+        except httpx.ReadTimeout:
+            pass
+        else:
+            raise AssertionError("expected ReadTimeout")
+        assert calls == ["slow"] and slow.inflight == 0
+
+    asyncio.run(run())
+
+
+def test_connect_timeout_and_5xx_fail_over():
+    def handler(request):
+        if request.url.host == "a":
+            raise httpx.ConnectTimeout("connect timed out")
+        if request.url.host == "b":
+            return httpx.Response(503, text="busy")
+        return httpx.Response(200, text="c")
+
+    async def run():
+        for first in ("a", "b"):
+            pool = _pool(handler, [f"http://{first}", "http://c"])
+            pool.upstreams[1].observe(1.0)
+            resp, u = await pool.chat({})
+            assert resp.text == "c" and u is pool.upstreams[1]
+
+    asyncio.run(run())
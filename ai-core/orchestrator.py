@@ -29,7 +29,7 @@ Cockswain Task Orchestrator (with local LLM via Ollama)
 import json
 import os
 from http.server import BaseHTTPRequestHandler, HTTPServer
-import mysql.connector
+from db_pool import get_connection
 import urllib.request
 
 # ====== MySQL 設定（跟你現在系統一致）======
@@ -42,44 +42,39 @@ MYSQL_SOCKET = "/var/run/mysqld/mysqld.sock"
 ORCH_PORT = int(os.environ.get("ORCH_PORT", "9002"))
 
 # ====== Ollama 設定 ======
-OLLAMA_URL = "http://127.0.0.1:11434/api/generate"
-OLLAMA_MODEL = "phi3"  # 你如果 pull 了別的就改這裡
+# 可以指向 hybrid-engine 管的任何一個後端（HE_BACKENDS 裡有列的那幾台）
+OLLAMA_URL = os.environ.get("ORCH_OLLAMA_URL", "http://127.0.0.1:11434/api/generate")
+OLLAMA_MODEL = os.environ.get("ORCH_OLLAMA_MODEL", "phi3")  # 你如果 pull 了別的就改這裡
 
 
 def get_db():
-    """取得 DB 連線（走 UNIX socket，避免 SSL 那個舊問題）"""
-    return mysql.connector.connect(
+    """從共用連線池借 DB 連線（走 UNIX socket，避免 SSL 那個舊問題）；close() 即還回 pool"""
+    return get_connection(
+        "orchestrator",
         user=MYSQL_USER,
         password=MYSQL_PASSWORD,
         database=MYSQL_DB,
         unix_socket=MYSQL_SOCKET,
         ssl_disabled=True,
+        autocommit=False,
     )
 
 
 def ensure_task_runs_table():
-    """第一次啟動時確保有 task_runs 這張表"""
+    """
+    啟動時確認有 task_runs 這張表；schema 只由 migrations/0001、0002 管，這裡不再建表，
+    缺表就直接停下來，提示先跑 schema_migrate.py migrate。
+    """
     conn = get_db()
     cur = conn.cursor()
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS task_runs (
-          id INT AUTO_INCREMENT PRIMARY KEY,
-          task_id INT,
-          agent VARCHAR(64),
-          backend VARCHAR(64),
-          status VARCHAR(32),
-          result_text TEXT,
-          started_at DATETIME,
-          ended_at DATETIME,
-          cost_token INT NULL,
-          cost_ms INT NULL
-        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
-        """
-    )
-    conn.commit()
-    cur.close()
-    conn.close()
+    try:
+        cur.execute("SHOW TABLES LIKE 'task_runs'")
+        exists = bool(cur.fetchall())
+    finally:
+        cur.close()
+        conn.close()
+    if not exists:
+        raise SystemExit("[orchestrator] task_runs 不存在，請先執行 python3 schema_migrate.py migrate")
 
 
 def model_selector(payload: dict) -> str:
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+Cockswain Core - Schema Migration & Hot Query Checker v1
+
+- ai-core/migrations/NNNN_<name>.sql 依版本號順序套用，已套用的記在 schema_migrations
+- 同一時間只會有一個 migrate 在跑（MySQL GET_LOCK）
+- MySQL 的 DDL 會 implicit commit，一個 migration 無法整包 rollback；
+  所以每條語句都要能重跑：「已存在」類錯誤（表 / 欄位 / 同名索引）只記 log 然後跳過
+- 已套用的檔案內容被改過（checksum 不同）時，status / migrate 會提出警告
+- status 與 migrate --dry-run 只讀：不建 schema_migrations、不拿 GET_LOCK
+- check：對 HOT_QUERIES 裡登記的每條熱門查詢跑 EXPLAIN（db_instrument.explain），
+  出現 full table scan（type=ALL）就 exit 1，可以直接掛在部署流程裡
+
+用法：
+    python3 schema_migrate.py status
+    python3 schema_migrate.py migrate [--dry-run] [--check]
+    python3 schema_migrate.py check [--strict]
+
+連線走 database_core.get_db_connection()（.env 的 DB_HOST / DB_NAME / DB_USER / DB_PASSWORD）。
+"""
+
+import hashlib
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from mysql.connector import Error
+
+from database_core import get_db_connection
+from db_instrument import explain
+
+AI_CORE_DIR = Path(__file__).resolve().parent
+MIGRATIONS_DIR = AI_CORE_DIR / "migrations"
+
+LOCK_NAME = "cockswain_schema_migrate"
+LOCK_TIMEOUT = 30
+
+_MIGRATION_RE = re.compile(r"^(\d{4})_([\w\-]+)\.sql$")
+
+# 1050 table exists / 1060 duplicate column / 1061 duplicate key name
+_ALREADY_APPLIED_ERRNOS = {1050, 1060, 1061}
+
+# 熱門查詢登記表：(名稱, SQL, 參數)。參數只是給 optimizer 看的代表值，不需要真的有資料。
+HOT_QUERIES: List[Tuple[str, str, Tuple[Any, ...]]] = [
+    (
+        "core_bridge.fetch_pending_tasks",
+        "SELECT id, payload FROM tasks WHERE status='pending' ORDER BY created_at ASC LIMIT 10",
+        (),
+    ),
+    (
+        "daily_status_summary.count_unlabeled",
+        "SELECT COUNT(*) AS c FROM tasks WHERE intent IS NULL OR intent = ''",
+        (),
+    ),
+    (
+        "l5_reflect.fetch_new_runs",
+        "SELECT id, task_id, agent, backend, status, result_text, started_at, ended_at "
+        "FROM task_runs WHERE id > %s ORDER BY id ASC LIMIT %s",
+        (0, 50),
+    ),
+    (
+        "l5_reflect.upsert_agent_stat",
+        "SELECT id, total_runs, success_runs, failed_runs FROM agent_stats WHERE agent=%s",
+        ("default",),
+    ),
+    (
+        "collect_api_changes.get_last_versions",
+        "SELECT c.source_id, c.new_version FROM kc_api_changes c "
+        "JOIN (SELECT source_id, MAX(id) AS max_id FROM kc_api_changes "
+        "WHERE source_id IN (%s) GROUP BY source_id) m ON m.max_id = c.id",
+        ("example",),
+    ),
+    (
+        "sync_gateway.get_latest",
+        "SELECT * FROM agent_deltas WHERE agent_id=%s ORDER BY created_at DESC LIMIT 1",
+        ("default",),
+    ),
+    (
+        "list_internal_requests.top",
+        "SELECT question, intent, hit_count, last_hit_at, status FROM kc_internal_requests "
+        "ORDER BY hit_count DESC, last_hit_at DESC LIMIT %s",
+        (20,),
+    ),
+]
+
+
+def log(msg: str) -> None:
+    print(f"[schema_migrate] {msg}")
+
+
+# ---- migration 檔案 ----
+
+def discover_migrations(directory: Path = MIGRATIONS_DIR) -> List[Dict[str, Any]]:
+    """
+    列出 migrations 目錄裡的 NNNN_<name>.sql，依版本號排序。
+    """
+    found: List[Dict[str, Any]] = []
+    seen: Dict[int, str] = {}
+    for path in sorted(directory.glob("*.sql")):
+        m = _MIGRATION_RE.match(path.name)
+        if not m:
+            log(f"skip {path.name}: 檔名不是 NNNN_<name>.sql")
+            continue
+        version = int(m.group(1))
+        if version in seen:
+            raise SystemExit(f"duplicate migration version {version}: {seen[version]} / {path.name}")
+        seen[version] = path.name
+        text = path.read_text(encoding="utf-8")
+        found.append(
+            {
+                "version": version,
+                "name": m.group(2),
+                "path": path,
+                "checksum": hashlib.sha256(text.encode("utf-8")).hexdigest(),
+                "statements": split_statements(text),
+            }
+        )
+    return sorted(found, key=lambda m: m["version"])
+
+
+def split_statements(text: str) -> List[str]:
+    """
+    很單純的切法：去掉 `--` 註解後，行尾是 `;` 就算一條語句結束。
+    migrations 裡不要寫 stored procedure / 字串內含 `;` 換行這種東西。
+    """
+    statements: List[str] = []
+    buf: List[str] = []
+    for line in text.splitlines():
+        code = line.split("--", 1)[0].rstrip()
+        if not code.strip():
+            continue
+        buf.append(code)
+        if code.endswith(";"):
+            stmt = "\n".join(buf).rstrip(";").strip()
+            if stmt:
+                statements.append(stmt)
+            buf = []
+    tail = "\n".join(buf).strip()
+    if tail:
+        statements.append(tail)
+    return statements
+
+
+# ---- schema_migrations 紀錄 ----
+
+def ensure_migrations_table(conn) -> None:
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+              version INT NOT NULL PRIMARY KEY,
+              name VARCHAR(128) NOT NULL,
+              checksum CHAR(64) NOT NULL,
+              applied_at DATETIME NOT NULL,
+              duration_ms INT NOT NULL DEFAULT 0
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            """
+        )
+    finally:
+        cur.close()
+
+
+def migrations_table_exists(conn) -> bool:
+    cur = conn.cursor()
+    try:
+        cur.execute("SHOW TABLES LIKE 'schema_migrations'")
+        return bool(cur.fetchall())
+    finally:
+        cur.close()
+
+
+def applied_migrations(conn) -> Dict[int, Dict[str, Any]]:
+    """
+    已套用的版本；schema_migrations 還不存在時回傳空的（只讀的指令不幫忙建表）。
+    """
+    if not migrations_table_exists(conn):
+        return {}
+    cur = conn.cursor(dictionary=True)
+    try:
+        cur.execute("SELECT version, name, checksum, applied_at FROM schema_migrations ORDER BY version")
+        return {int(row["version"]): row for row in cur.fetchall()}
+    finally:
+        cur.close()
+
+
+def _checksum_warnings(migrations: List[Dict[str, Any]], applied: Dict[int, Dict[str, Any]]) -> None:
+    for m in migrations:
+        row = applied.get(m["version"])
+        if row and row["checksum"] != m["checksum"]:
+            log(f"WARN {m['path'].name} 在套用後被修改過（checksum 不同），不會重跑；請另開新版本")
+
+
+def _acquire_lock(conn) -> None:
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT GET_LOCK(%s, %s)", (LOCK_NAME, LOCK_TIMEOUT))
+        row = cur.fetchone()
+    finally:
+        cur.close()
+    if not row or row[0] != 1:
+        raise SystemExit(f"another schema_migrate is running (GET_LOCK {LOCK_NAME} timed out)")
+
+
+def _release_lock(conn) -> None:
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+        cur.fetchall()
+    finally:
+        cur.close()
+
+
+def apply_migration(conn, migration: Dict[str, Any]) -> None:
+    started = time.monotonic()
+    cur = conn.cursor()
+    try:
+        for stmt in migration["statements"]:
+            try:
+                cur.execute(stmt)
+            except Error as e:
+                if getattr(e, "errno", None) in _ALREADY_APPLIED_ERRNOS:
+                    log(f"  already present, skipped: {e.msg}")
+                    continue
+                raise
+        duration_ms = int((time.monotonic() - started) * 1000)
+        cur.execute(
+            """
+            INSERT INTO schema_migrations (version, name, checksum, applied_at, duration_ms)
+            VALUES (%s, %s, %s, NOW(), %s)
+            """,
+            (migration["version"], migration["name"], migration["checksum"], duration_ms),
+        )
+        conn.commit()
+    finally:
+        cur.close()
+
+
+def _apply_pending(conn, migrations: List[Dict[str, Any]], dry_run: bool) -> int:
+    applied = applied_migrations(conn)
+    _checksum_warnings(migrations, applied)
+    pending = [m for m in migrations if m["version"] not in applied]
+    if not pending:
+        log("schema is up to date")
+        return 0
+    for m in pending:
+        log(f"apply {m['path'].name} ({len(m['statements'])} statements)")
+        if dry_run:
+            for stmt in m["statements"]:
+                print(stmt + ";\n")
+            continue
+        apply_migration(conn, m)
+    log(f"{'would apply' if dry_run else 'applied'} {len(pending)} migration(s)")
+    return 0
+
+
+def migrate(dry_run: bool = False) -> int:
+    migrations = discover_migrations()
+    conn = get_db_connection(autocommit=True)
+    try:
+        if dry_run:
+            # 只印出會跑的語句：不建 schema_migrations、不拿 lock
+            return _apply_pending(conn, migrations, dry_run=True)
+        ensure_migrations_table(conn)
+        _acquire_lock(conn)
+        try:
+            return _apply_pending(conn, migrations, dry_run=False)
+        finally:
+            _release_lock(conn)
+    finally:
+        conn.close()
+
+
+def status() -> int:
+    migrations = discover_migrations()
+    conn = get_db_connection(autocommit=True)
+    try:
+        applied = applied_migrations(conn)
+    finally:
+        conn.close()
+
+    _checksum_warnings(migrations, applied)
+    for m in migrations:
+        row = applied.get(m["version"])
+        mark = f"applied {row['applied_at']}" if row else "PENDING"
+        print(f"{m['version']:04d}  {m['name']:<32} {mark}")
+    return 0
+
+
+# ---- hot query checker ----
+
+def check_plan(plan: List[Dict[str, Any]]) -> Tuple[str, List[str]]:
+    """
+    看 EXPLAIN 結果判斷有沒有 full table scan：
+      - "fail": type=ALL 且沒有任何 possible_keys（缺索引）
+      - "warn": type=ALL 但其實有可用索引（通常是表太小，optimizer 覺得掃全表比較快）
+      - "ok"
+    <derived2> / <subquery2> 這類 optimizer 自己 materialize 的暫存表本來就只能整張掃，不算。
+    回傳 (結果, 有問題的 table 說明)。
+    """
+    verdict = "ok"
+    notes: List[str] = []
+    for row in plan:
+        if (row.get("type") or "").upper() != "ALL":
+            continue
+        table = row.get("table")
+        if str(table or "").startswith("<"):
+            continue
+        rows = row.get("rows")
+        if row.get("possible_keys"):
+            notes.append(f"{table}: full scan (rows={rows}) although possible_keys={row['possible_keys']}")
+            if verdict == "ok":
+                verdict = "warn"
+        else:
+            notes.append(f"{table}: full scan (rows={rows}), no usable index")
+            verdict = "fail"
+    return verdict, notes
+
+
+def check(strict: bool = False, conn: Optional[Any] = None) -> int:
+    """
+    對 HOT_QUERIES 逐條 EXPLAIN；有 fail（strict 時 warn 也算）或 EXPLAIN 本身失敗就回傳 1。
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection(autocommit=True)
+    failed = 0
+    try:
+        for name, sql, params in HOT_QUERIES:
+            try:
+                plan = explain(conn, sql, params or None)
+            except Error as e:
+                failed += 1
+                print(f"FAIL  {name}: EXPLAIN error {e!r}")
+                continue
+            verdict, notes = check_plan(plan)
+            if verdict == "fail" or (strict and verdict == "warn"):
+                failed += 1
+            keys = ", ".join(str(r.get("key")) for r in plan)
+            print(f"{verdict.upper():<5} {name}  key={keys}")
+            for note in notes:
+                print(f"      {note}")
+    finally:
+        if own_conn:
+            conn.close()
+
+    log(f"{len(HOT_QUERIES) - failed}/{len(HOT_QUERIES)} hot queries ok")
+    return 1 if failed else 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = list(sys.argv[1:] if argv is None else argv)
+    cmd = args.pop(0) if args else "status"
+
+    if cmd == "status":
+        return status()
+    if cmd == "migrate":
+        rc = migrate(dry_run="--dry-run" in args)
+        if rc == 0 and "--check" in args and "--dry-run" not in args:
+            rc = check(strict="--strict" in args)
+        return rc
+    if cmd == "check":
+        return check(strict="--strict" in args)
+
+    print(__doc__)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,7 @@
+import sys
+from pathlib import Path
+
+# ai-core 底下的模組（db_pool、knowledge_center ...）都是直接從 ai-core 根目錄 import
+AI_CORE_DIR = Path(__file__).resolve().parents[1]
+if str(AI_CORE_DIR) not in sys.path:
+    sys.path.insert(0, str(AI_CORE_DIR))
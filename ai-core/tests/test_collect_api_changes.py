@@ -0,0 +1,107 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from knowledge_center.collectors import collect_api_changes as cac
+
+
+def test_backoff_doubles_up_to_the_cap():
+    assert cac.backoff_seconds(0) == 0
+    assert [cac.backoff_seconds(n) for n in (1, 2, 3)] == [60, 120, 240]
+    assert cac.backoff_seconds(50) == cac.BACKOFF_MAX_SECONDS
+
+
+def test_freq_accepts_names_and_seconds():
+    assert cac.freq_to_seconds("Hourly") == 3600
+    assert cac.freq_to_seconds(90) == 90
+    assert cac.freq_to_seconds("120") == 120
+    assert cac.freq_to_seconds("fortnightly") == cac.DEFAULT_FREQ_SECONDS
+
+
+def test_due_sources_and_next_wakeup_follow_state():
+    sources = [
+        {"id": "a", "freq": "hourly"},
+        {"id": "b", "freq": "daily"},
+        {"id": "off", "enabled": False},
+        {"id": "rss", "type": "rss"},
+    ]
+    state = {"a": {"next_due_at": 100.0}, "b": {"next_due_at": 500.0}}
+
+    assert [s["id"] for s in cac.due_sources(sources, state, now=200.0)] == ["a"]
+    assert [s["id"] for s in cac.due_sources(sources, state, now=200.0, force=True)] == ["a", "b"]
+    assert cac.next_wakeup(sources, state) == 100.0
+
+
+def test_headers_carry_validators_and_auth():
+    src = {"api_key_env": "TOKEN", "headers": {"X-Foo": "bar"}}
+    headers = cac.build_headers(src, {"TOKEN": "t0k"}, {"etag": '"v1"', "last_modified": "Mon, 01 Jan 2024 00:00:00 GMT"})
+    assert headers["If-None-Match"] == '"v1"'
+    assert headers["If-Modified-Since"] == "Mon, 01 Jan 2024 00:00:00 GMT"
+    assert headers["Authorization"] == "Bearer t0k"
+    assert headers["X-Foo"] == "bar"
+    assert "If-None-Match" not in cac.build_headers({}, {}, {})
+
+
+def test_poll_source_uses_etag_for_304():
+    def handler(request):
+        if request.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, json={"pkgVersion": "1.2.3"}, headers={"ETag": '"v1"'})
+
+    async def run(st):
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await cac.poll_source(client, asyncio.Semaphore(1), {"id": "m"}, {}, st)
+
+    first = asyncio.run(run({}))
+    assert first["status"] == "changed" and first["version"] == "1.2.3" and first["etag"] == '"v1"'
+    assert asyncio.run(run({"etag": '"v1"'})) == {"status": "not_modified"}
+
+
+@pytest.fixture
+def polled(monkeypatch):
+    results = {
+        "new": {"status": "changed", "version": "2.0.0", "raw": {}, "etag": '"v2"', "last_modified": None},
+        "same": {"status": "not_modified"},
+    }
+
+    async def poll_all(sources, env, state):
+        return [(src, results[src["id"]]) for src in sources]
+
+    monkeypatch.setattr(cac, "poll_all", poll_all)
+    return [{"id": "new", "freq": "daily"}, {"id": "same", "freq": "hourly"}]
+
+
+def test_db_read_failure_still_updates_schedule(polled, monkeypatch):
+    def down(env):
+        raise ConnectionError("db down")
+
+    monkeypatch.setattr(cac, "get_db_connection", down)
+    state = {"new": {"etag": '"v1"', "last_version": "1.0.0"}}
+
+    assert cac.run_cycle(polled, {}, state) == 1
+
+    new, same = state["new"], state["same"]
+    # 新版本沒寫進 DB：不推進 ETag，照退避重試
+    assert new["etag"] == '"v1"' and new["last_version"] == "1.0.0"
+    assert new["failures"] == 1
+    assert new["next_due_at"] == pytest.approx(new["last_polled_at"] + 60)
+    assert same["failures"] == 0
+    assert same["next_due_at"] == pytest.approx(same["last_polled_at"] + 3600)
+
+
+def test_daemon_saves_state_and_exits_on_ctrl_c(polled, monkeypatch, tmp_path):
+    state_path = tmp_path / "state.json"
+    monkeypatch.setattr(cac, "STATE_PATH", str(state_path))
+    monkeypatch.setattr(cac, "load_env", lambda path: {})
+    monkeypatch.setattr(cac, "load_sources", lambda path: polled)
+
+    def interrupted(sources, env, state, force=False):
+        state["same"] = {"next_due_at": 1.0}
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(cac, "run_cycle", interrupted)
+
+    assert cac.main(["collect_api_changes.py", "--daemon"]) == 0
+    assert json.loads(state_path.read_text(encoding="utf-8")) == {"same": {"next_due_at": 1.0}}
@@ -0,0 +1,164 @@
+import json
+import os
+
+import pytest
+
+from knowledge_center import collect_internal_requests as collector
+from knowledge_center import internal_bridge
+
+
+class FakeDB:
+    """只認得 collector 會送的那幾種語句；commit 前的變更先放在 staged，rollback 就丟掉"""
+
+    def __init__(self):
+        self.hits = {}
+        self.collected = set()
+        self.staged = None
+
+    def connect(self):
+        return _FakeConn(self)
+
+
+class _FakeConn:
+    def __init__(self, db):
+        self.db = db
+        self.autocommit = True
+
+    def cursor(self):
+        return _FakeCursor(self)
+
+    def commit(self):
+        staged, self.db.staged = self.db.staged, None
+        if staged:
+            hits, collected = staged
+            for rid, n in hits.items():
+                self.db.hits[rid] = self.db.hits.get(rid, 0) + n
+            self.db.collected |= collected
+
+    def rollback(self):
+        self.db.staged = None
+
+    def close(self):
+        pass
+
+
+class _FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows = []
+
+    def _staged(self):
+        db = self.conn.db
+        if db.staged is None:
+            db.staged = ({}, set())
+        return db.staged
+
+    def execute(self, sql, params=None):
+        sql = " ".join(sql.split())
+        if sql.startswith("SELECT file_name FROM kc_internal_collected_files"):
+            self.rows = [(name,) for name in params if name in self.conn.db.collected]
+        elif not sql.startswith("DELETE FROM kc_internal_collected_files"):
+            raise AssertionError(sql)
+
+    def executemany(self, sql, rows):
+        hits, collected = self._staged()
+        if "INTO kc_internal_requests" in sql:
+            for row in rows:
+                hits[row[0]] = hits.get(row[0], 0) + row[9]
+        elif "INTO kc_internal_collected_files" in sql:
+            for name, _, _ in rows:
+                if name in collected or name in self.conn.db.collected:
+                    raise RuntimeError("1062 duplicate entry")
+                collected.add(name)
+        else:
+            raise AssertionError(sql)
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    db = FakeDB()
+    dirs = {name: tmp_path / name for name in ("requests", "processed", "failed")}
+    for d in dirs.values():
+        d.mkdir()
+    monkeypatch.setattr(collector, "REQUEST_DIR", str(dirs["requests"]))
+    monkeypatch.setattr(collector, "PROCESSED_DIR", str(dirs["processed"]))
+    monkeypatch.setattr(collector, "FAILED_DIR", str(dirs["failed"]))
+    monkeypatch.setattr(collector, "get_connection", db.connect)
+    # 用真的 coalesce_lock（跟 internal_bridge 同一把），只是把 index / lock 檔放到 tmp
+    monkeypatch.setattr(internal_bridge, "BASE_DIR", str(dirs["requests"]))
+    monkeypatch.setattr(internal_bridge, "COALESCE_INDEX_PATH", str(tmp_path / "coalesce.json"))
+    monkeypatch.setattr(internal_bridge, "COALESCE_WINDOW_SECONDS", 600.0)
+    return db, dirs
+
+
+def _write(d, name, rid, hits):
+    (d / name).write_text(json.dumps({"request_id": rid, "question": "q", "hit_count": hits}), encoding="utf-8")
+
+
+def test_original_and_delta_files_add_up(env):
+    db, dirs = env
+    _write(dirs["requests"], "a.json", "r1", 3)
+    _write(dirs["requests"], "b.json", "r1", 1)
+
+    assert collector.sweep() == 1
+    assert db.hits == {"r1": 4}
+    assert os.listdir(dirs["requests"]) == []
+    assert sorted(os.listdir(dirs["processed"])) == ["a.json", "b.json"]
+
+
+def test_crash_between_commit_and_move_does_not_double_count(env, monkeypatch):
+    db, dirs = env
+    _write(dirs["requests"], "a.json", "r1", 3)
+
+    def crash(path, data):
+        raise KeyboardInterrupt
+
+    with monkeypatch.context() as m:
+        m.setattr(collector, "_mark_processed", crash)
+        with pytest.raises(KeyboardInterrupt):
+            collector.sweep()
+    # commit 已經做了，檔案還以 *.claimed 留在原地
+    assert db.hits == {"r1": 3}
+    assert os.listdir(dirs["requests"]) == ["a.json.claimed"]
+
+    assert collector.sweep() == 0
+    assert db.hits == {"r1": 3}
+    assert os.listdir(dirs["requests"]) == []
+    assert os.listdir(dirs["processed"]) == ["a.json"]
+
+
+def test_failed_commit_puts_files_back(env, monkeypatch):
+    db, dirs = env
+    _write(dirs["requests"], "a.json", "r1", 2)
+
+    def down():
+        raise ConnectionError("db down")
+
+    with monkeypatch.context() as m:
+        m.setattr(collector, "get_connection", down)
+        with pytest.raises(ConnectionError):
+            collector.sweep()
+    assert os.listdir(dirs["requests"]) == ["a.json"]
+
+    assert collector.sweep() == 1
+    assert db.hits == {"r1": 2}
+
+
+def test_hits_after_collection_land_in_a_delta_file(env):
+    db, dirs = env
+    first = internal_bridge.queue_internal_knowledge_request("GPU 滿了？", "ops", {})
+    internal_bridge.queue_internal_knowledge_request("gpu 滿了", "ops", {})
+    assert collector.sweep() == 1
+    assert db.hits == {first["request_id"]: 2}
+
+    again = internal_bridge.queue_internal_knowledge_request("GPU 滿了?", "ops", {})
+    assert again["coalesced"] and again["request_id"] == first["request_id"]
+    assert again["path"] != first["path"]
+    assert collector.sweep() == 1
+    assert db.hits == {first["request_id"]: 3}
@@ -0,0 +1,99 @@
+import json
+import threading
+import time
+
+import pytest
+
+import db_instrument
+from db_instrument import InstrumentedCursor, fingerprint, normalize_sql, redact_params
+
+
+@pytest.fixture
+def slow_log(tmp_path, monkeypatch):
+    path = tmp_path / "slow.jsonl"
+    monkeypatch.setattr(db_instrument, "SLOW_QUERY_LOG", str(path))
+    monkeypatch.setattr(db_instrument, "_fingerprints", {})
+
+    def read():
+        if not path.exists():
+            return []
+        return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+    return read
+
+
+def test_normalize_sql_replaces_literals_and_folds_lists():
+    assert normalize_sql("SELECT * FROM t WHERE a = 'x''y' AND b = 42") == "select * from t where a = ? and b = ?"
+    assert normalize_sql("select *\n  from t -- note\n where id in (1, 2, 3);") == "select * from t where id in (?+)"
+    assert normalize_sql("INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s)") == "insert into t (a, b) values (?+)"
+    assert normalize_sql("select '#not a comment' from t2 /* hint */") == "select ? from t2"
+    # 識別字裡的數字不是字面值
+    assert normalize_sql("select col1 from t_2020") == "select col1 from t_2020"
+
+
+def test_fingerprint_is_stable_across_literals_and_logs_statement_once(slow_log):
+    a = fingerprint("SELECT id FROM tasks WHERE status='pending' LIMIT 10")
+    b = fingerprint("select id\n  from tasks where status='done' limit 5")
+    assert a == b
+    fp_id, norm, op = a
+    assert len(fp_id) == 12 and op == "select"
+    assert fingerprint("UPDATE tasks SET status=%s WHERE id=%s")[2] == "update"
+
+    records = [r for r in slow_log() if r["event"] == "fingerprint"]
+    assert [(r["fingerprint"], r["statement"]) for r in records][0] == (fp_id, norm)
+    assert len(records) == 2
+
+
+def test_redact_params_keeps_only_types_and_lengths():
+    assert redact_params(None) is None
+    assert redact_params(("abc", 3, None, b"xy")) == ["<str:3>", "<int>", "<null>", "<bytes:2>"]
+    assert redact_params({"q": "secret", "n": 1.5}) == {"q": "<str:6>", "n": "<float>"}
+    assert redact_params([("a", 1), ("bb", 2)]) == [["<str:1>", "<int>"], ["<str:2>", "<int>"]]
+
+
+class _SlowFetchCursor:
+    rowcount = -1
+
+    def execute(self, sql, params=None):
+        pass
+
+    def fetchall(self):
+        time.sleep(0.05)
+        return [(1,), (2,)]
+
+    def close(self):
+        pass
+
+
+def test_select_latency_includes_fetch_time(slow_log, monkeypatch):
+    monkeypatch.setattr(db_instrument, "SLOW_QUERY_MS", 30)
+    cur = InstrumentedCursor(_SlowFetchCursor())
+    cur.execute("SELECT id FROM t WHERE a = %s", ("secret",))
+    assert cur.fetchall() == [(1,), (2,)]
+    cur.close()
+
+    (slow,) = [r for r in slow_log() if r["event"] == "slow"]
+    assert slow["duration_ms"] >= 40
+    assert slow["rows"] == 2
+    assert slow["params"] == ["<str:6>"]
+
+
+def test_should_explain_lets_one_thread_through_per_interval(monkeypatch):
+    monkeypatch.setattr(db_instrument, "EXPLAIN_ENABLED", True)
+    monkeypatch.setattr(db_instrument, "_explained_at", {})
+    start = threading.Barrier(16)
+    results = []
+
+    def worker():
+        start.wait()
+        results.append(db_instrument.should_explain("fp-hot", "select"))
+
+    threads = [threading.Thread(target=worker) for _ in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results.count(True) == 1
+    assert not db_instrument.should_explain("fp-hot", "select")
+    assert not db_instrument.should_explain("fp-other", "show")
@@ -0,0 +1,96 @@
+import threading
+import time
+
+import pytest
+
+import db_pool
+from db_pool import ConnectionPool, PoolTimeout
+
+
+class FakeConnection:
+    def __init__(self):
+        self.autocommit = True
+        self.in_transaction = False
+        self.connected = True
+        self.closed = False
+        self.rollbacks = 0
+
+    def is_connected(self):
+        return self.connected
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.in_transaction = False
+
+    def ping(self, **kwargs):
+        if not self.connected:
+            raise ConnectionError("gone")
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def opened(monkeypatch):
+    conns = []
+
+    def connect(**kwargs):
+        conns.append(FakeConnection())
+        return conns[-1]
+
+    monkeypatch.setattr(db_pool.mysql.connector, "connect", connect)
+    return conns
+
+
+def test_exhausted_pool_times_out_then_hands_over_returned_connection(opened):
+    pool = ConnectionPool("t-exhaust", size=1, timeout=0.05)
+    held = pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(pool.acquire(timeout=2)))
+    waiter.start()
+    time.sleep(0.05)
+    held.close()
+    waiter.join(2)
+    assert got and got[0].raw_connection is opened[0]
+    assert len(opened) == 1
+    assert pool.stats()["in_use"] == 1
+
+
+def test_open_transaction_is_rolled_back_on_return(opened):
+    pool = ConnectionPool("t-rollback", size=1)
+    conn = pool.acquire()
+    conn.autocommit = False
+    opened[0].in_transaction = True
+    conn.close()
+    conn.close()  # 重複 close 無害
+
+    assert opened[0].rollbacks == 1
+    again = pool.acquire()
+    assert again.raw_connection is opened[0]
+    assert again.autocommit is True
+    assert pool.stats() == {"pool": "t-rollback", "size": 1, "total": 1, "in_use": 1, "idle": 0}
+
+
+def test_old_connections_are_recycled(opened):
+    pool = ConnectionPool("t-recycle", size=1, recycle=0.02)
+    pool.acquire().close()
+    time.sleep(0.05)
+    conn = pool.acquire()
+
+    assert len(opened) == 2
+    assert opened[0].closed
+    assert conn.raw_connection is opened[1]
+
+
+def test_broken_connection_is_discarded_on_return(opened):
+    pool = ConnectionPool("t-broken", size=1, ping_interval=0)
+    conn = pool.acquire()
+    opened[0].connected = False
+    conn.close()
+
+    assert opened[0].closed
+    assert pool.stats()["total"] == 0
+    assert pool.acquire().raw_connection is opened[1]
@@ -0,0 +1,88 @@
+import json
+import os
+import threading
+
+import pytest
+
+from knowledge_center import internal_bridge as bridge
+
+
+@pytest.fixture
+def queue_dir(tmp_path, monkeypatch):
+    d = tmp_path / "requests"
+    monkeypatch.setattr(bridge, "BASE_DIR", str(d))
+    monkeypatch.setattr(bridge, "COALESCE_INDEX_PATH", str(tmp_path / "coalesce.json"))
+    monkeypatch.setattr(bridge, "COALESCE_WINDOW_SECONDS", 600.0)
+    return d
+
+
+def _load(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_repeat_inside_window_bumps_the_pending_file(queue_dir):
+    first = bridge.queue_internal_knowledge_request("Ollama 怎麼重啟？", "ops", {})
+    second = bridge.queue_internal_knowledge_request("  ollama 怎麼重啟 ", "ops", {})
+
+    assert not first["coalesced"]
+    assert second["coalesced"] and second["hit_count"] == 2
+    assert second["request_id"] == first["request_id"] and second["path"] == first["path"]
+    assert _load(first["path"])["hit_count"] == 2
+    assert os.listdir(queue_dir) == [os.path.basename(first["path"])]
+    # intent 不同就是不同的問題
+    assert not bridge.queue_internal_knowledge_request("Ollama 怎麼重啟？", "dev", {})["coalesced"]
+
+
+def test_repeat_after_claim_writes_a_delta_file(queue_dir):
+    first = bridge.queue_internal_knowledge_request("備份在哪", "ops", {})
+    os.rename(first["path"], first["path"] + ".claimed")
+
+    again = bridge.queue_internal_knowledge_request("備份在哪", "ops", {})
+
+    assert again["coalesced"] and again["request_id"] == first["request_id"]
+    assert again["path"] != first["path"] and again["hit_count"] == 1
+    delta = _load(again["path"])
+    assert delta["request_id"] == first["request_id"] and delta["hit_count"] == 1
+    # 已經被認領的檔案不會再被 +1
+    assert _load(first["path"] + ".claimed")["hit_count"] == 1
+
+
+def test_repeat_after_window_gets_a_new_request(queue_dir):
+    first = bridge.queue_internal_knowledge_request("索引壞了", "ops", {})
+    index = _load(bridge.COALESCE_INDEX_PATH)
+    for entry in index.values():
+        entry["first_seen"] -= 601
+    with open(bridge.COALESCE_INDEX_PATH, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+
+    again = bridge.queue_internal_knowledge_request("索引壞了", "ops", {})
+
+    assert not again["coalesced"] and again["request_id"] != first["request_id"]
+    # 過期的 entry 順手清掉，index 只留新的那一筆
+    assert [e["request_id"] for e in _load(bridge.COALESCE_INDEX_PATH).values()] == [again["request_id"]]
+
+
+def test_window_zero_disables_coalescing(queue_dir, monkeypatch):
+    monkeypatch.setattr(bridge, "COALESCE_WINDOW_SECONDS", 0.0)
+    a = bridge.queue_internal_knowledge_request("q", "i", {})
+    b = bridge.queue_internal_knowledge_request("q", "i", {})
+
+    assert not a["coalesced"] and not b["coalesced"]
+    assert a["request_id"] != b["request_id"]
+    assert _load(a["path"])["dedup_key"] is None
+    assert not os.path.exists(bridge.COALESCE_INDEX_PATH)
+
+
+def test_concurrent_repeats_are_counted_under_the_lock(queue_dir):
+    first = bridge.queue_internal_knowledge_request("同一題", "ops", {})
+    threads = [
+        threading.Thread(target=bridge.queue_internal_knowledge_request, args=("同一題", "ops", {}))
+        for _ in range(8)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert _load(first["path"])["hit_count"] == 9
@@ -0,0 +1,100 @@
+import schema_migrate
+
+
+class _RecordingConn:
+    def __init__(self, tables=()):
+        self.tables = set(tables)
+        self.executed = []
+
+    def cursor(self, **kwargs):
+        return _RecordingCursor(self)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _RecordingCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows = []
+
+    def execute(self, sql, params=None):
+        sql = " ".join(sql.split())
+        self.conn.executed.append(sql)
+        if sql.startswith("SHOW TABLES LIKE"):
+            name = sql.split("'")[1]
+            self.rows = [(name,)] if name in self.conn.tables else []
+        elif sql.startswith("SELECT GET_LOCK"):
+            self.rows = [(1,)]
+        else:
+            self.rows = []
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+def test_dry_run_neither_creates_tables_nor_locks(monkeypatch, capsys):
+    conn = _RecordingConn()
+    monkeypatch.setattr(schema_migrate, "get_db_connection", lambda **kw: conn)
+
+    assert schema_migrate.migrate(dry_run=True) == 0
+
+    assert conn.executed == ["SHOW TABLES LIKE 'schema_migrations'"]
+    assert "ADD UNIQUE KEY uk_agent" in capsys.readouterr().out
+
+
+def test_status_is_read_only(monkeypatch):
+    conn = _RecordingConn()
+    monkeypatch.setattr(schema_migrate, "get_db_connection", lambda **kw: conn)
+
+    assert schema_migrate.status() == 0
+    assert conn.executed == ["SHOW TABLES LIKE 'schema_migrations'"]
+
+
+def test_migrate_locks_and_records_each_version(monkeypatch):
+    conn = _RecordingConn()
+    monkeypatch.setattr(schema_migrate, "get_db_connection", lambda **kw: conn)
+
+    assert schema_migrate.migrate() == 0
+
+    assert conn.executed[0].startswith("CREATE TABLE IF NOT EXISTS schema_migrations")
+    assert conn.executed[1].startswith("SELECT GET_LOCK")
+    assert conn.executed[-1].startswith("SELECT RELEASE_LOCK")
+    inserts = [s for s in conn.executed if s.startswith("INSERT INTO schema_migrations")]
+    assert len(inserts) == len(schema_migrate.discover_migrations())
+
+
+def test_agent_stats_duplicates_are_merged_before_unique_key():
+    (m,) = [m for m in schema_migrate.discover_migrations() if m["version"] == 2]
+    stmts = [" ".join(s.split()) for s in m["statements"]]
+    unique = next(i for i, s in enumerate(stmts) if "ADD UNIQUE KEY uk_agent" in s)
+    merge = next(i for i, s in enumerate(stmts) if s.startswith("UPDATE agent_stats"))
+    delete = next(i for i, s in enumerate(stmts) if s.startswith("DELETE extra FROM agent_stats"))
+    assert merge < delete < unique
+
+
+def test_internal_hits_migration_adds_one_thing_per_statement():
+    (m,) = [m for m in schema_migrate.discover_migrations() if m["version"] == 3]
+    # 1060/1061 會跳過整條 statement，所以每條只能有一個 ADD
+    assert len(m["statements"]) == 5
+    assert all(s.count("ADD ") == 1 for s in m["statements"])
+
+
+def test_check_plan_ignores_materialized_derived_tables():
+    plan = [
+        {"table": "<derived2>", "type": "ALL", "possible_keys": None, "rows": 2},
+        {"table": "c", "type": "eq_ref", "possible_keys": "PRIMARY", "key": "PRIMARY"},
+        {"table": "kc_api_changes", "type": "range", "possible_keys": "idx_source_id",
+         "key": "idx_source_id", "Extra": "Using where; Using index for group-by"},
+    ]
+    assert schema_migrate.check_plan(plan) == ("ok", [])
+    assert schema_migrate.check_plan([{"table": "tasks", "type": "ALL", "possible_keys": None}])[0] == "fail"
@@ -35,16 +35,7 @@ def sync_agent(delta: AgentDelta):
     try:
         db = get_db()
         cur = db.cursor()
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS agent_deltas (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                agent_id VARCHAR(64),
-                version VARCHAR(64),
-                payload JSON,
-                note TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
-        """)
+        # agent_deltas 的建表與索引由 ai-core/schema_migrate.py 管理，不再每個 request 都 CREATE
         insert_sql = """
             INSERT INTO agent_deltas (agent_id, version, payload, note)
             VALUES (%s, %s, %s, %s)